@@ -45,13 +45,19 @@
 import os
 import sys
 import numpy as np
-import subprocess
 from scipy.signal import savgol_filter
-import cv2
 
 sys.modules['sitecustomize'] = None
 
-from mmpose.apis import MMPoseInferencer
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "vision_pipeline", "src"))
+from inference_cache import InferenceCache
+from lifting import PoseLifter, render_3d
+from manifest_index import ManifestIndex
+from pose_archive import make_data_packet, save_output
+from pose_backends import create_backend
+from signal_processing import gate_and_fill, normalize_keypoints
+from tracking import PoseTracker
+from video_io import VideoFrameReader, iter_frame_batches
 
 # ---------------- CONFIG ----------------
 VIDEO_PATH = "data/pull_ups.mp4"
@@ -59,65 +65,69 @@ VIDEOPOSE_ROOT = "VideoPose3D"
 CHECKPOINT_FILENAME = "pretrained_h36m_detectron_coco.bin"
 
 OUTPUT_DIR = "output"
-DATASET_NAME = "custom_video"
-NUM_JOINTS = 17
+# Rendering the 3D animation is slow (matplotlib + ffmpeg); the 3D keypoints are saved either way
+RENDER = True
+
+POSE2D_BACKEND = 'mmpose'
+POSE2D_MODEL = 'td-hm_hrnet-w32_8xb64-210e_coco-256x192'
+POSE2D_DEVICE = 'cuda:0'
+POSE2D_BATCH_SIZE = 16
+# Follow one athlete: full-frame detection every KEYFRAME_INTERVAL frames (or
+# when the track is lost), pose on a tracked crop in between
+POSE2D_KEYFRAME_INTERVAL = 30
+# Keypoints scoring below this are dropped and interpolated over
+POSE2D_SCORE_THRESHOLD = 0.3
+# Raw 2D keypoints are cached here, so re-running the cleaning / 3D steps
+# skips the 2D model. Set to None to disable.
+INFERENCE_CACHE_DIR = "cache/inference"
+# Video metadata (resolution, fps) is read from this index; the video is only
+# probed again when it changed
+MANIFEST_INDEX = "cache/manifest.sqlite"
 
 # ---------------- RUN 2D POSE ----------------
-print(f"Running 2D pose estimation on {VIDEO_PATH}...")
+# The model is only loaded on a cache miss
+pose2d = create_backend(POSE2D_BACKEND, POSE2D_MODEL, device=POSE2D_DEVICE, load=False)
+cache = InferenceCache(INFERENCE_CACHE_DIR) if INFERENCE_CACHE_DIR else None
+tracker = PoseTracker(pose2d, POSE2D_KEYFRAME_INTERVAL, initial="best_score")
+cache_key = pose2d.cache_key(person="track")
+cache_key["params"]["tracking"] = tracker.params
 
-inferencer = MMPoseInferencer(
-    pose2d='td-hm_hrnet-w32_8xb64-210e_coco-256x192',
-    device='cuda:0'
-)
+cached = cache.load(VIDEO_PATH, **cache_key) if cache is not None else None
 
-result_generator = inferencer(VIDEO_PATH, return_vis=False)
+if cached is not None:
+    print(f"Using cached 2D keypoints for {VIDEO_PATH}.")
+    keypoints_2d, scores_2d = cached
+else:
+    print(f"Running 2D pose estimation on {VIDEO_PATH}...")
 
-keypoints_2d = []
+    pose2d.load()
 
-for result in result_generator:
+    keypoints_2d = []
+    scores_2d = []
 
-    frame_preds = result.get('predictions', [])
+    # Same athlete in every frame; frames where they are not found stay NaN
+    for _, frames in iter_frame_batches(VideoFrameReader(VIDEO_PATH), POSE2D_BATCH_SIZE):
+        kps, scores = tracker.infer(frames, fill_value=np.nan)
+        keypoints_2d.append(kps)
+        scores_2d.append(scores)
+    print(f"Tracking: {tracker.summary()}")
 
-    if len(frame_preds) == 0 or len(frame_preds[0]) == 0:
-        keypoints_2d.append(
-            np.full((NUM_JOINTS, 2), np.nan, dtype=np.float32)
-        )
-        continue
+    keypoints_2d = np.concatenate(keypoints_2d).astype(np.float32)
+    scores_2d = np.concatenate(scores_2d).astype(np.float32)
 
-    persons = frame_preds[0]
+    if cache is not None:
+        cache.store(VIDEO_PATH, keypoints_2d, scores_2d, **cache_key)
 
-    best_kp = None
-    best_score = -np.inf
-
-    for person in persons:
-        kp = np.array(person['keypoints'], dtype=np.float32)
-        scores = np.array(person['keypoint_scores'], dtype=np.float32)
-
-        score = np.nanmean(scores)
-
-        if score > best_score:
-            best_score = score
-            best_kp = kp[:, :2]
-
-    keypoints_2d.append(best_kp[:NUM_JOINTS])
-
-keypoints_2d = np.array(keypoints_2d, dtype=np.float32)
 print(f"Extracted 2D keypoints for {keypoints_2d.shape[0]} frames.")
 
 # ---------------- TEMPORAL CLEANING ----------------
 
-for j in range(NUM_JOINTS):
-    for d in range(2):
-        col = keypoints_2d[:, j, d]
-        if np.isnan(col).any():
-            valid = ~np.isnan(col)
-            if valid.sum() < 2:
-                continue
-            col[~valid] = np.interp(
-                np.flatnonzero(~valid),
-                np.flatnonzero(valid),
-                col[valid]
-            )
+raw_keypoints_2d = keypoints_2d
+
+# VideoPose3D needs every frame, so every gap is interpolated (max_gap=None)
+keypoints_2d, missing_2d = gate_and_fill(keypoints_2d, scores_2d, POSE2D_SCORE_THRESHOLD, max_gap=None)
+if missing_2d.any():
+    print(f"Warning: joints {np.flatnonzero(missing_2d.all(axis=0)).tolist()} were never detected.")
 
 if keypoints_2d.shape[0] >= 7:
     keypoints_2d = savgol_filter(
@@ -127,80 +137,31 @@ if keypoints_2d.shape[0] >= 7:
         axis=0
     )
 
-# ---------------- SAVE FOR VIDEOPOSE3D ----------------
-
-# 🔥 Get video resolution + fps
-cap = cv2.VideoCapture(VIDEO_PATH)
-width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-fps = cap.get(cv2.CAP_PROP_FPS)
-cap.release()
-
-video_name = os.path.basename(VIDEO_PATH)
-
-coco_metadata = {
-    'layout_name': 'coco',
-    'num_joints': NUM_JOINTS,
-    'keypoints_symmetry': [
-        [1, 3, 5, 7, 9, 11, 13, 15],
-        [2, 4, 6, 8, 10, 12, 14, 16]
-    ],
-    'video_metadata': {
-        video_name: {
-            'w': width,
-            'h': height,
-            'fps': fps
-        }
-    }
-}
-
-positions_2d = {
-    video_name: {
-        'custom': [keypoints_2d]
-    }
-}
-
-npz_path = os.path.join(
-    VIDEOPOSE_ROOT,
-    "data",
-    f"data_2d_custom_{DATASET_NAME}.npz"
-)
-
-print(f"Saving 2D keypoints to {npz_path}")
-
-np.savez_compressed(
-    npz_path,
-    positions_2d=positions_2d,
-    metadata=coco_metadata
-)
-
-# ---------------- RUN VIDEOPOSE3D ----------------
+# ---------------- LIFT TO 3D (in-process) ----------------
 
-print("Running VideoPose3D inference...")
+with ManifestIndex(MANIFEST_INDEX) as index:
+    video_info = index.video_info(VIDEO_PATH)
+width, height = video_info['width'], video_info['height']
+video_name = os.path.splitext(os.path.basename(VIDEO_PATH))[0]
 
-output_video_path = os.path.abspath(
-    os.path.join(OUTPUT_DIR, "output_3d.mp4")
-)
-
-input_video_abs_path = os.path.abspath(VIDEO_PATH)
-
-cmd = [
-    sys.executable, "run.py",
-    "-d", "custom",
-    "-k", DATASET_NAME,
-    "-arc", "3,3,3,3,3",
-    "-c", "checkpoints",
-    "--evaluate", "../pretrained_h36m_detectron_coco.bin",
-    "--render",
-    "--viz-subject", video_name,
-    "--viz-action", "custom",
-    "--viz-video", input_video_abs_path,
-    "--viz-output", output_video_path,
-    "--viz-size", "6"
-]
+print("Running VideoPose3D inference...")
+lifter = PoseLifter(CHECKPOINT_FILENAME, VIDEOPOSE_ROOT)
+keypoints_3d = lifter.lift(keypoints_2d, width, height)
 
+# 2D and 3D keypoints in the pipeline's output container
 os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-subprocess.run(cmd, cwd=VIDEOPOSE_ROOT, check=True)
-
-print(f"\nSuccess! 3D output saved to: {output_video_path}")
+output_path = os.path.join(OUTPUT_DIR, f"{video_name}.npz")
+packet = make_data_packet(VIDEO_PATH, raw_keypoints_2d, keypoints_2d, normalize_keypoints(keypoints_2d), scores_2d,
+                          video_info=video_info, missing=missing_2d)
+packet['keypoints_3d'] = keypoints_3d
+packet['keypoints_3d_layout'] = 'h36m'
+save_output(packet, output_path)
+print(f"3D keypoints {keypoints_3d.shape} saved to: {output_path}")
+
+# ---------------- RENDER (optional) ----------------
+
+if RENDER:
+    output_video_path = os.path.join(OUTPUT_DIR, f"{video_name}_3d.mp4")
+    render_3d(VIDEO_PATH, keypoints_2d, keypoints_3d, output_video_path, video_info['fps'], (width, height),
+              VIDEOPOSE_ROOT)
+    print(f"\nSuccess! 3D render saved to: {output_video_path}")
@@ -0,0 +1,147 @@
+import logging
+import numpy as np
+import cv2
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class MotionGate:
+    """
+    Decides per frame whether pose inference is needed, from a cheap motion
+    estimate: the share of pixels that changed between a small grayscale copy
+    of the frame and of the last frame sent to the model. Slow phases (the
+    bottom of a squat, the pause at the top of a pull-up) fall below the
+    threshold and are skipped; their keypoints are interpolated afterwards
+    with fill_skipped().
+
+        gate = MotionGate(motion_threshold=1.0, max_skip=4)
+        for positions, frames in gate.iter_batches(reader, batch_size=8):
+            ...  # positions index the delivered frames that need inference
+        keypoints, scores = gate.expand(keypoints, scores)  # NaN rows for skipped frames
+
+    Use one gate per video.
+    """
+    def __init__(self, motion_threshold=1.0, max_skip=4, width=96, pixel_delta=12):
+        """
+        Args:
+            motion_threshold (float): Percent of pixels that must have changed since the
+                last inferred frame to run inference again. Higher = faster, less accurate.
+            max_skip (int): Never skip more than this many frames in a row.
+            width (int): Width of the grayscale copy the motion is measured on.
+            pixel_delta (int): Gray-level change (0-255) counted as motion; below it is noise.
+        """
+        self.motion_threshold = motion_threshold
+        self.max_skip = max(0, int(max_skip))
+        self.width = width
+        self.pixel_delta = pixel_delta
+        self.frames_seen = 0
+        self.positions = []
+        self._reference = None
+        self._skipped = 0
+
+    @property
+    def params(self):
+        """Settings that change the output, for inference cache keys."""
+        return {"motion_threshold": self.motion_threshold, "max_skip": self.max_skip, "width": self.width,
+                "pixel_delta": self.pixel_delta}
+
+    @property
+    def skip_ratio(self):
+        return 1.0 - len(self.positions) / self.frames_seen if self.frames_seen else 0.0
+
+    def _thumbnail(self, frame):
+        h, w = frame.shape[:2]
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        size = (self.width, max(1, int(round(h * self.width / float(w)))))
+        return cv2.resize(gray, size, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def keep(self, frame):
+        """True if `frame` (the next delivered frame) should go through the model."""
+        thumbnail = self._thumbnail(frame)
+        keep = self._reference is None or self._skipped >= self.max_skip
+        if not keep:
+            changed = np.count_nonzero(np.abs(thumbnail - self._reference) > self.pixel_delta)
+            keep = 100.0 * changed / thumbnail.size >= self.motion_threshold
+        if keep:
+            self._reference = thumbnail
+            self._skipped = 0
+            self.positions.append(self.frames_seen)
+        else:
+            self._skipped += 1
+        self.frames_seen += 1
+        return keep
+
+    def iter_frames(self, reader):
+        """
+        Yields (position, frame) for the frames of `reader` that need inference.
+        The last frame is always included so the tail is interpolated, not extrapolated.
+        """
+        last_skipped = None
+        for position, (_, frame) in enumerate(reader):
+            if self.keep(frame):
+                last_skipped = None
+                yield position, frame
+            else:
+                last_skipped = (position, frame)
+        if last_skipped is not None:
+            self.positions.append(last_skipped[0])
+            yield last_skipped
+
+    def iter_batches(self, reader, batch_size):
+        """Like video_io.iter_frame_batches, but yields (positions, frames) of the kept frames only."""
+        positions, frames = [], []
+        for position, frame in self.iter_frames(reader):
+            positions.append(position)
+            frames.append(frame)
+            if len(frames) >= batch_size:
+                yield positions, frames
+                positions, frames = [], []
+        if frames:
+            yield positions, frames
+
+    def expand(self, keypoints, scores):
+        """Scatters results of the kept frames to every delivered frame; skipped frames get NaN keypoints."""
+        full_keypoints = np.full((self.frames_seen,) + np.shape(keypoints)[1:], np.nan)
+        full_scores = np.zeros((self.frames_seen,) + np.shape(scores)[1:])
+        full_keypoints[self.positions] = keypoints
+        full_scores[self.positions] = scores
+        return full_keypoints, full_scores
+
+    def log_summary(self, video_name):
+        logger.info(f"Adaptive sampling: inferred {len(self.positions)}/{self.frames_seen} frames of {video_name} "
+                    f"({self.skip_ratio:.0%} skipped)")
+
+def fill_skipped(keypoints, scores):
+    """
+    Linearly interpolates the frames left out by a MotionGate (NaN keypoints)
+    from the nearest inferred frames before and after them, all joints at once.
+    This is the np.interp fill, vectorised over joints and axes. Next to an
+    inferred frame without a detection (all scores 0), the nearest frame is
+    held instead of blending into the zero fill.
+    Returns:
+        keypoints (np.ndarray): [Frames, 17, 2]
+        scores (np.ndarray): [Frames, 17], interpolated the same way.
+        inferred (np.ndarray): [Frames] bool, False for interpolated frames.
+    """
+    keypoints = np.array(keypoints, dtype=float)
+    scores = np.array(scores, dtype=float)
+    inferred = ~np.isnan(keypoints.reshape(len(keypoints), -1)).all(axis=1)
+    known = np.flatnonzero(inferred)
+    if len(known) == 0 or len(known) == len(keypoints):
+        return keypoints, scores, inferred
+
+    positions = np.arange(len(keypoints))
+    left = np.clip(np.searchsorted(known, positions, side='right') - 1, 0, len(known) - 1)
+    right = np.clip(np.searchsorted(known, positions, side='left'), 0, len(known) - 1)
+    lo, hi = known[left], known[right]
+    span = np.maximum(hi - lo, 1)
+    weight = np.where(hi > lo, (positions - lo) / span, 0.0)
+
+    missed = scores[known].sum(axis=1) == 0
+    weight = np.where(missed[left] | missed[right], np.round(weight), weight)
+
+    skipped = ~inferred
+    w = weight[skipped]
+    keypoints[skipped] = keypoints[lo[skipped]] * (1 - w)[:, None, None] + keypoints[hi[skipped]] * w[:, None, None]
+    scores[skipped] = scores[lo[skipped]] * (1 - w)[:, None] + scores[hi[skipped]] * w[:, None]
+    return keypoints, scores, inferred
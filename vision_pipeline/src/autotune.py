@@ -0,0 +1,278 @@
+import os
+import glob
+import json
+import time
+import socket
+import logging
+import argparse
+import platform
+import importlib.util
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+PROFILE_VERSION = 1
+# Per-host file names, so a home directory shared over NFS can hold the whole fleet's profiles
+DEFAULT_PROFILE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "form_analyser")
+PROFILE_ENV = "FORM_ANALYSER_TUNING_PROFILE"
+
+# Candidates tried by default, if their framework is installed
+DEFAULT_CANDIDATES = [
+    ('mmpose', 'human'),
+    ('yolo', 'yolov8n-pose.pt'),
+    ('yolo', 'yolov8s-pose.pt'),
+    ('yolo', 'yolov8x-pose.pt'),
+]
+_FRAMEWORKS = {'mmpose': 'mmpose', 'yolo': 'ultralytics'}
+
+def default_profile_path():
+    return os.environ.get(PROFILE_ENV) or os.path.join(DEFAULT_PROFILE_DIR, f"autotune-{socket.gethostname()}.json")
+
+def machine_signature():
+    """What a profile was measured on; a profile is only reused on a matching machine."""
+    cpu = platform.processor() or platform.machine()
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    cpu = line.split(':', 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return {"cpu": cpu, "cores": os.cpu_count() or 1, "gpus": detect_devices()[1:]}
+
+def detect_devices():
+    """'cpu' plus any accelerator torch can see."""
+    devices = ['cpu']
+    try:
+        import torch
+        devices += [f'cuda:{i}' for i in range(torch.cuda.device_count())]
+        if getattr(torch.backends, 'mps', None) is not None and torch.backends.mps.is_available():
+            devices.append('mps')
+    except ImportError:
+        pass
+    return devices
+
+def installed_candidates(candidates=None):
+    """Drops candidates whose framework is not importable here (the stub is always available)."""
+    candidates = candidates or DEFAULT_CANDIDATES
+    return [(b, m) for b, m in candidates if b not in _FRAMEWORKS or importlib.util.find_spec(_FRAMEWORKS[b])]
+
+def load_sample_frames(video_paths, frames_per_video=64, max_side=None):
+    """Decodes the first frames of each sample video (as batch_runner would see them)."""
+    from video_io import VideoFrameReader
+    frames = []
+    for path in video_paths:
+        reader = VideoFrameReader(path, max_side=max_side)
+        for i, (_, frame) in enumerate(reader):
+            frames.append(frame)
+            if i + 1 >= frames_per_video:
+                break
+        reader.close()
+    return frames
+
+def pck(keypoints, reference, reference_scores, threshold=0.2, min_score=0.3):
+    """
+    Fraction of confidently-detected reference keypoints that the candidate
+    places within `threshold` torso lengths (PCK). Frames where the reference
+    found nobody are ignored.
+    """
+    from signal_processing import torso_length
+    torso = torso_length(reference)                                          # [N]
+    dist = np.linalg.norm(np.asarray(keypoints) - reference, axis=-1)       # [N, 17]
+    valid = (np.asarray(reference_scores) >= min_score) & (torso[:, None] > 1e-3)
+    if not valid.any():
+        return None
+    return float(((dist <= threshold * torso[:, None]) & valid).sum() / valid.sum())
+
+def _run(backend, frames, batch_size):
+    """Infers all frames in batches. Returns (keypoints, scores, per-frame latencies in seconds, wall)."""
+    keypoints, scores, latencies = [], [], []
+    start = time.perf_counter()
+    for i in range(0, len(frames), batch_size):
+        batch = frames[i:i + batch_size]
+        t0 = time.perf_counter()
+        kps, s = backend.infer(batch)
+        latencies.extend([(time.perf_counter() - t0) / len(batch)] * len(batch))
+        keypoints.append(kps)
+        scores.append(s)
+    return np.concatenate(keypoints), np.concatenate(scores), np.array(latencies), time.perf_counter() - start
+
+def autotune(video_paths, candidates=None, devices=None, batch_sizes=(1, 4, 8, 16), thread_counts=None,
+             reference=None, min_pck=None, frames_per_video=64, max_side=None):
+    """
+    Benchmarks every (backend, model, device, threads, batch size) on frames
+    from the given videos and picks the configuration with the highest
+    estimated machine throughput that meets the accuracy floor.
+    Args:
+        candidates (list): (backend, model) pairs. Default: installed DEFAULT_CANDIDATES.
+        devices (list): Default: everything detect_devices() finds.
+        thread_counts (list): Threads per worker to try on CPU. Default: 1, 2, 4 ... all cores.
+        reference (tuple): (backend, model) whose keypoints define accuracy. Default: the first candidate.
+        min_pck (float): Accuracy floor (PCK@0.2 torso vs the reference); None = throughput only.
+    Returns:
+        profile dict (see save_profile).
+    """
+    from pose_backends import create_backend
+    from batch_runner import limit_threads
+
+    cores = os.cpu_count() or 1
+    candidates = installed_candidates(candidates)
+    if not candidates:
+        raise RuntimeError("No pose backend is installed (tried mmpose, ultralytics). Pass --candidates stub:stub to dry-run.")
+    devices = devices or detect_devices()
+    thread_counts = thread_counts or sorted({min(cores, 2 ** i) for i in range(cores.bit_length() + 1)})
+    reference = tuple(reference) if reference else candidates[0]
+
+    frames = load_sample_frames(video_paths, frames_per_video, max_side)
+    if not frames:
+        raise RuntimeError("Could not decode any frames from the sample videos.")
+    logger.info(f"Tuning on {len(frames)} frames from {len(video_paths)} videos, {cores} cores, devices {devices}")
+
+    # Reference keypoints, from the reference model on the fastest device available
+    limit_threads(cores)
+    ref_backend = create_backend(reference[0], reference[1], devices[-1], warmup=True)
+    ref_keypoints, ref_scores, _, _ = _run(ref_backend, frames, max(batch_sizes))
+    del ref_backend
+
+    results = []
+    for backend_name, model in candidates:
+        for device in devices:
+            try:
+                backend = create_backend(backend_name, model, device, warmup=True)
+            except Exception as e:
+                logger.warning(f"Skipping {backend_name}/{model} on {device}: {e}")
+                continue
+            accuracy = None
+            # Threads only matter for CPU inference; accelerators run one worker with every core
+            for threads in (thread_counts if device == 'cpu' else [cores]):
+                limit_threads(threads)
+                for batch_size in batch_sizes:
+                    try:
+                        keypoints, _, latencies, wall = _run(backend, frames, batch_size)
+                    except Exception as e:
+                        logger.warning(f"{backend_name}/{model} on {device} failed at batch {batch_size}: {e}")
+                        continue
+                    if accuracy is None:
+                        accuracy = pck(keypoints, ref_keypoints, ref_scores)
+                    workers = max(1, cores // threads) if device == 'cpu' else 1
+                    fps = len(frames) / wall
+                    result = {
+                        "backend": backend_name, "model": model, "device": device, "threads": threads,
+                        "batch_size": batch_size, "workers": workers, "fps_per_worker": fps,
+                        # Assumes workers scale linearly, which holds while they share no cores
+                        "est_fps": fps * workers,
+                        "latency_p50_ms": float(np.percentile(latencies, 50) * 1000),
+                        "latency_p95_ms": float(np.percentile(latencies, 95) * 1000),
+                        "pck": accuracy,
+                    }
+                    results.append(result)
+                    logger.info(f"{backend_name}/{model} {device} threads={threads} batch={batch_size}: "
+                                f"{fps:.1f} fps/worker x{workers} = {result['est_fps']:.1f} fps, "
+                                f"p50 {result['latency_p50_ms']:.1f}ms, PCK {accuracy if accuracy is None else round(accuracy, 3)}")
+            del backend
+
+    eligible = [r for r in results if min_pck is None or (r["pck"] is not None and r["pck"] >= min_pck)]
+    if not eligible:
+        raise RuntimeError(f"No configuration reached PCK >= {min_pck} against {reference[0]}/{reference[1]}.")
+    best = max(eligible, key=lambda r: r["est_fps"])
+
+    return {
+        "version": PROFILE_VERSION,
+        "created": time.time(),
+        "host": socket.gethostname(),
+        "machine": machine_signature(),
+        "reference": {"backend": reference[0], "model": reference[1]},
+        "min_pck": min_pck,
+        "sample": {"videos": [os.path.basename(v) for v in video_paths], "frames": len(frames), "max_side": max_side},
+        "recommended": {k: best[k] for k in ("backend", "model", "device", "threads", "workers", "batch_size",
+                                             "est_fps", "pck")},
+        "results": results,
+    }
+
+def save_profile(profile, path=None):
+    path = path or default_profile_path()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(profile, f, indent=2)
+    logger.info(f"Saved tuning profile to {path}")
+    return path
+
+def load_profile(path=None):
+    """
+    Reads a tuning profile. Returns None if there is none, or if it was
+    measured on different hardware (so a profile on a shared disk is never
+    applied to the wrong CPU generation).
+    """
+    path = path or default_profile_path()
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        profile = json.load(f)
+    if profile.get("version") != PROFILE_VERSION:
+        return None
+    signature = machine_signature()
+    measured = profile.get("machine", {})
+    if measured.get("cpu") != signature["cpu"] or measured.get("cores") != signature["cores"]:
+        logger.warning(f"Ignoring tuning profile {path}: measured on {measured.get('cpu')} "
+                       f"({measured.get('cores')} cores), this machine is {signature['cpu']} ({signature['cores']} cores).")
+        return None
+    return profile
+
+def tuned_settings(backend=None, path=None):
+    """
+    The recommended settings of this machine's profile, or {} without one.
+    If the caller already chose a different backend, model/device/batch
+    settings tuned for another backend are not applicable and {} is returned.
+    Keys: backend, model, device, threads (per worker), workers, batch_size.
+    """
+    profile = load_profile(path)
+    if profile is None:
+        return {}
+    recommended = profile["recommended"]
+    if backend is not None and backend != recommended["backend"]:
+        return {}
+    logger.info(f"Using tuning profile: {recommended['backend']}/{recommended['model']} on {recommended['device']}, "
+                f"{recommended['workers']} workers x {recommended['threads']} threads, batch {recommended['batch_size']}")
+    return recommended
+
+def _parse_candidate(text):
+    backend, _, model = text.partition(':')
+    return backend, model or None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark pose backends on this machine and save the best settings")
+    parser.add_argument("--input_dir", "-i", required=True, help="Directory of representative videos")
+    parser.add_argument("--sample-videos", type=int, default=3, help="Videos to sample from input_dir")
+    parser.add_argument("--sample-frames", type=int, default=64, help="Frames decoded per sample video")
+    parser.add_argument("--candidates", nargs="+", default=None, metavar="BACKEND:MODEL",
+                        help="Backends/variants to try, e.g. mmpose:human yolo:yolov8s-pose.pt (default: all installed)")
+    parser.add_argument("--devices", nargs="+", default=None, help="Devices to try (default: all detected)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16], help="Frames per model call to try")
+    parser.add_argument("--threads", type=int, nargs="+", default=None, help="Threads per worker to try (default: powers of 2)")
+    parser.add_argument("--reference", default=None, metavar="BACKEND:MODEL",
+                        help="Reference for the accuracy floor (default: first candidate)")
+    parser.add_argument("--min-pck", type=float, default=None,
+                        help="Reject configurations below this PCK@0.2 against the reference, e.g. 0.9")
+    parser.add_argument("--max-side", type=int, default=None, help="Tune for this ingestion downscale")
+    parser.add_argument("--output", "-o", default=None, help=f"Profile path (default: {default_profile_path()})")
+
+    args = parser.parse_args()
+
+    videos = []
+    for ext in ('.mp4', '.mov', '.avi'):
+        videos.extend(glob.glob(os.path.join(args.input_dir, f"*{ext}")))
+    videos = sorted(videos)
+    # Spread the sample across the directory rather than taking the first few
+    videos = videos[::max(1, len(videos) // max(1, args.sample_videos))][:args.sample_videos]
+    candidates = [_parse_candidate(c) for c in args.candidates] if args.candidates else None
+
+    profile = autotune(videos, candidates, args.devices, args.batch_sizes, args.threads,
+                       _parse_candidate(args.reference) if args.reference else None, args.min_pck,
+                       args.sample_frames, args.max_side)
+    save_profile(profile, args.output)
+    best = profile["recommended"]
+    print(f"✅ Best: --backend {best['backend']} --model {best['model']} --device {best['device']} "
+          f"--workers {best['workers']} --threads {best['workers'] * best['threads']} "
+          f"--infer-batch-size {best['batch_size']}  (~{best['est_fps']:.0f} frames/s)")
@@ -1,72 +1,635 @@
-
 import os
+import time
 import argparse
 import glob
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from video_processor import PoseExtractor
+import contextlib
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import logging
+from instrumentation import Recorder, JobMetrics, StageTracker, NULL_RECORDER, profiled
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def process_single_video(extractor, video_path, output_dir, visualize=False):
+# Set once per worker process by _init_worker, so every task in that process
+# reuses the same loaded model.
+_worker_extractor = None
+
+def build_extractor(backend='mmpose', model=None, device='cpu', cache_dir=None, cache_max_gb=20.0, warmup=True,
+                    score_threshold=0.3, max_gap=10, raw_only=False):
+    """
+    Creates a warmed-up pose extractor for the requested backend.
+    Imports are deferred so a worker only loads the framework it actually uses.
+    Args:
+        backend (str): Any name registered in pose_backends ('mmpose', 'yolo', 'stub').
+        model (str): MMPose mode/alias or YOLO weights file. None uses the backend default.
+        device (str): 'cuda', 'cpu' or 'mps'.
+        cache_dir (str): Inference cache directory (None disables caching).
+        cache_max_gb (float): Size bound of the inference cache.
+        warmup (bool): Run one dummy batch before the first video.
+        score_threshold (float): Confidence gating threshold applied before smoothing.
+        max_gap (int): Longest dropped run interpolated by the gating stage.
+        raw_only (bool): Write raw keypoints + scores only; derived fields are computed on read.
+    """
+    cache = None
+    if cache_dir:
+        from inference_cache import InferenceCache
+        cache = InferenceCache(cache_dir, max_bytes=int(cache_max_gb * 1024 ** 3))
+
+    from video_processor import PoseExtractor
+    return PoseExtractor(model, device, cache, backend=backend, warmup=warmup, score_threshold=score_threshold,
+                         max_gap=max_gap, raw_only=raw_only)
+
+def limit_threads(num_threads):
+    """
+    Caps the intra-op thread pools of torch, OpenCV and BLAS/OpenMP.
+    Must run before the first numpy/torch import in a fresh process for the
+    environment variables to take effect.
+    """
+    num_threads = max(1, int(num_threads))
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS'):
+        os.environ[var] = str(num_threads)
+
+    try:
+        import cv2
+        cv2.setNumThreads(num_threads)
+    except ImportError:
+        pass
+
+    try:
+        import torch
+        torch.set_num_threads(num_threads)
+        try:
+            # Only settable once per process, before any parallel work started
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass
+    except ImportError:
+        pass
+
+def _init_worker(backend, model, device, threads_per_worker, cache_dir, cache_max_gb, score_threshold, max_gap,
+                 raw_only):
+    """Process-pool initializer: pin the thread budget, then load the model once."""
+    global _worker_extractor
+    limit_threads(threads_per_worker)
+    _worker_extractor = build_extractor(backend, model, device, cache_dir, cache_max_gb,
+                                        score_threshold=score_threshold, max_gap=max_gap, raw_only=raw_only)
+
+def _process_in_worker(video_path, output_dir, visualize, output_format, ingest, metrics_dir, profile_video,
+                       on_stage=None):
+    return process_single_video(_worker_extractor, video_path, output_dir, visualize, output_format, ingest,
+                                metrics_dir, profile_video, on_stage)
+
+def output_path_for(video_path, output_dir, output_format='json'):
+    base_name = os.path.splitext(os.path.basename(video_path))[0]
+    return os.path.join(output_dir, f"{base_name}.{output_format}")
+
+def process_single_video(extractor, video_path, output_dir, visualize=False, output_format='json', ingest=None,
+                         metrics_dir=None, profile_video=None, on_stage=None):
     """
     Wrapper to process a single video and save it to the output directory.
+    `ingest` holds process_video options (max_side, frame_stride, batch_size, track, motion_threshold, ...).
+    With `metrics_dir`, per-stage metrics are written to <metrics_dir>/<video>.metrics.json
+    and returned under 'metrics'. If the video's file name equals `profile_video`,
+    it runs under cProfile and the stats land next to the metrics (or the output).
+    on_stage(name) is called as each pipeline stage starts (see instrumentation.StageTracker).
+    Returns a result dict with 'video', 'status' ('done', 'skipped' or 'failed'),
+    'output', 'error' and 'seconds' (plus 'frames' / 'inferred_frames' with adaptive sampling).
     """
+    start = time.time()
+    video_name = os.path.basename(video_path)
+    output_path = output_path_for(video_path, output_dir, output_format)
+    result = {"video": video_path, "status": "done", "output": output_path, "error": None}
+    recorder = Recorder(video_name) if metrics_dir else None
+
     try:
-        video_name = os.path.basename(video_path)
-        base_name = os.path.splitext(video_name)[0]
-        output_path = os.path.join(output_dir, f"{base_name}.json")
-        
         if os.path.exists(output_path):
             logger.info(f"Skipping {video_name}, output already exists.")
-            return
-            
-        extractor.process_video(video_path, output_path, visualize)
-        logger.info(f"Successfully processed {video_name}")
-        
+            result["status"] = "skipped"
+            recorder = None
+        else:
+            profile = None
+            if profile_video and video_name == profile_video:
+                profile = output_path_for(video_path, metrics_dir or output_dir, 'prof')
+            with profiled(profile) if profile else contextlib.nullcontext():
+                tracked = StageTracker(recorder or NULL_RECORDER, on_stage) if on_stage else recorder
+                packet = extractor.process_video(video_path, output_path, visualize, recorder=tracked, **(ingest or {}))
+            result.update(sampling_counts(packet))
+            logger.info(f"Successfully processed {video_name}")
+
     except Exception as e:
         logger.error(f"Failed to process {video_path}: {e}")
+        result["status"] = "failed"
+        result["error"] = str(e)
+
+    result["seconds"] = time.time() - start
+    if recorder is not None:
+        recorder.write_sidecar(metrics_path_for(video_path, metrics_dir))
+        result["metrics"] = recorder.to_dict()
+    return result
+
+def sampling_counts(packet):
+    """Frames seen / run through the model, for videos processed with adaptive sampling."""
+    if packet is None or packet.get("inferred") is None:
+        return {}
+    return {"frames": len(packet["inferred"]), "inferred_frames": int(packet["inferred"].sum())}
+
+def metrics_path_for(video_path, metrics_dir):
+    return output_path_for(video_path, metrics_dir, 'metrics.json')
+
+def _log_progress(result, done, total):
+    name = os.path.basename(result["video"])
+    if result["status"] == "failed":
+        logger.error(f"[{done}/{total}] FAILED {name}: {result['error']}")
+    else:
+        logger.info(f"[{done}/{total}] {result['status']} {name} ({result['seconds']:.1f}s)")
+
+def _batched_process(extractor, video_files, output_dir, batch_size, max_wait, decode_workers, output_format='json',
+                     ingest=None, metrics_dir=None, job_metrics=None, sampling=None):
+    """Runs all pending videos through one cross-video micro-batching scheduler."""
+    from frame_scheduler import process_videos_batched
+
+    recorders = {}
+    job_recorder = Recorder('scheduler') if metrics_dir else None
+
+    def recorder_for(video_path):
+        if metrics_dir:
+            recorders[video_path] = Recorder(os.path.basename(video_path))
+            return recorders[video_path]
+        return None
 
-def batch_process(input_dir, output_dir, extensions=['.mp4', '.mov', '.avi'], visualize=False, workers=1):
+    def output_path(video_path):
+        return output_path_for(video_path, output_dir, output_format)
+
+    results = []
+    pending = []
+    for video_path in video_files:
+        if os.path.exists(output_path(video_path)):
+            logger.info(f"Skipping {os.path.basename(video_path)}, output already exists.")
+            results.append({"video": video_path, "status": "skipped", "output": output_path(video_path),
+                            "error": None, "seconds": 0.0})
+        else:
+            pending.append(video_path)
+
+    start = time.time()
+    for video_path, packet, error in process_videos_batched(extractor, pending, output_path,
+                                                             batch_size=batch_size, max_wait=max_wait,
+                                                             decode_workers=decode_workers, ingest=ingest,
+                                                             recorder_fn=recorder_for, recorder=job_recorder,
+                                                             sampling=sampling):
+        # Videos share batches, so per-video time is only known as time-to-completion
+        result = {"video": video_path, "status": "done", "output": output_path(video_path),
+                  "error": None, "seconds": time.time() - start}
+        if error is not None:
+            logger.error(f"Failed to process {video_path}: {error}")
+            result.update(status="failed", error=str(error), output=None)
+        result.update(sampling_counts(packet))
+        if video_path in recorders:
+            recorder = recorders.pop(video_path)
+            recorder.write_sidecar(metrics_path_for(video_path, metrics_dir))
+            result["metrics"] = recorder.to_dict()
+        results.append(result)
+        _log_progress(result, len(results), len(video_files))
+
+    if job_metrics is not None and job_recorder is not None:
+        # Shared model calls belong to no single video
+        job_metrics.add(job_recorder.to_dict(), status=None)
+    return results
+
+def _supervised_process(video_files, workers, initargs, task_args, budgets, quarantine, output_dir, output_format):
+    """
+    Runs every video in a killable worker process under its wall-clock budget
+    (see supervisor.SupervisedPool). Failures, timeouts and worker crashes are
+    recorded with their stage in the quarantine report; quarantined videos are
+    not run again until their file changes or they are released.
+    """
+    from supervisor import SupervisedPool
+
+    results = []
+    pending = []
+    for video_path in video_files:
+        if quarantine.is_quarantined(video_path):
+            last = quarantine.videos[os.path.abspath(video_path)]["failures"][-1]
+            results.append({"video": video_path, "status": "quarantined", "output": None, "seconds": 0.0,
+                            "error": f"quarantined: {last['error']}", "stage": last["stage"]})
+        else:
+            pending.append(video_path)
+    if results:
+        logger.warning(f"Not running {len(results)} quarantined videos (see {quarantine.path}).")
+
+    pool = SupervisedPool(workers, _init_worker, initargs, _process_in_worker)
+    tasks = [(v, (v,) + task_args, budgets[v]) for v in pending]
+    for video_path, result, failure, stage in pool.run(tasks):
+        if result is None:
+            result = {"video": video_path, "status": "failed", "output": None, "error": failure["error"],
+                      "seconds": failure["seconds"]}
+            # A killed worker may have left a half-written output behind
+            output_path = output_path_for(video_path, output_dir, output_format)
+            if os.path.exists(output_path):
+                os.remove(output_path)
+        if result["status"] == "failed":
+            result["stage"] = stage
+            quarantine.strike(video_path, result["error"], stage, result["seconds"], budgets[video_path])
+        else:
+            quarantine.clear(video_path)
+        results.append(result)
+        _log_progress(result, len(results), len(video_files))
+    quarantine.save()
+    return results
+
+def run_version(backend, model, output_format, track, keyframe_interval, score_threshold, max_gap, ingest, sampling,
+                raw_only=False):
+    """Pipeline version (see manifest_index.pipeline_version) of a run's settings, shared by every entry point."""
+    from manifest_index import pipeline_version
+
+    # raw_only only enters the version when set, so existing indexes keep their runs
+    return pipeline_version(backend=backend, model=model, output_format=output_format, track=track,
+                            keyframe_interval=keyframe_interval, score_threshold=score_threshold, max_gap=max_gap,
+                            **ingest, **sampling, **({"raw_only": True} if raw_only else {}))
+
+def _schedule_from_index(index, input_dir, version, output_dir, output_format):
+    """
+    Indexed videos of input_dir in processing order: longest first, so the
+    long tail does not start last and leave the other workers idle. Only videos
+    the index has done under `version` keep their output and are skipped; any
+    other output (changed content, another pipeline version, or a run without
+    the index) is stale and removed so the video is redone.
+    """
+    video_files = []
+    done = 0
+    for video in index.videos(input_dir):
+        output_path = output_path_for(video['path'], output_dir, output_format)
+        if index.is_done(video['path'], version):
+            done += 1
+        elif os.path.exists(output_path):
+            if index.changed_since_run(video['path']):
+                logger.info(f"{os.path.basename(video['path'])} changed since it was processed, redoing it.")
+            else:
+                logger.info(f"{os.path.basename(video['path'])} has no run under this version, redoing it.")
+            os.remove(output_path)
+        video_files.append(video['path'])
+    logger.info(f"Pipeline version {version}: {done}/{len(video_files)} videos already done.")
+    return video_files
+
+def _duplicate_results(duplicates, alignments, results, output_dir, output_format):
+    """
+    Result dicts for videos that share their canonical copy's result instead of being run.
+    Each gets its own output: the canonical result aligned by time and rescaled to its
+    resolution (see video_dedup.share_result).
+    """
+    from pose_archive import load_output, save_output
+    from video_dedup import share_result
+
+    by_video = {r["video"]: r for r in results}
+    shared = []
+    for video_path, canonical in sorted(duplicates.items()):
+        start = time.time()
+        canonical_output = output_path_for(canonical, output_dir, output_format)
+        output_path = output_path_for(video_path, output_dir, output_format)
+        result = {"video": video_path, "status": "duplicate", "output": output_path, "error": None,
+                  "canonical": canonical}
+        if by_video.get(canonical, {}).get("status") == "failed" or not os.path.exists(canonical_output):
+            result.update(status="failed", output=None, error=f"canonical copy {os.path.basename(canonical)} has no output")
+        else:
+            try:
+                save_output(share_result(load_output(canonical_output), alignments[video_path], video_path),
+                            output_path)
+            except Exception as e:
+                logger.error(f"Failed to share {os.path.basename(canonical)}'s result with {video_path}: {e}")
+                result.update(status="failed", output=None, error=str(e))
+        result["seconds"] = time.time() - start
+        shared.append(result)
+    return shared
+
+def batch_process(input_dir, output_dir, extensions=['.mp4', '.mov', '.avi'], visualize=False, workers=1,
+                  executor='process', backend='mmpose', model=None, device='cpu', threads=None,
+                  batch_size=1, max_wait=0.05, output_format='json', cache_dir=None, cache_max_gb=20.0,
+                  max_side=None, frame_stride=1, metrics_dir=None, prom_file=None, profile_video=None,
+                  infer_batch_size=8, track=False, keyframe_interval=30, motion_threshold=0.0, max_skip=4,
+                  score_threshold=0.3, max_gap=10, index_path=None, chunk_frames=None, raw_only=False, dedup=False,
+                  timeout_per_frame=None, timeout_min=60.0, max_strikes=2, retry_quarantined=False):
     """
     Scans input_dir for videos and processes them.
+    Args:
+        workers (int): Number of parallel workers.
+        executor (str): 'process' gives every worker its own model in a separate
+            process (scales with cores). 'thread' shares one model across threads.
+        backend (str): Registered pose backend ('mmpose', 'yolo', 'stub').
+        model (str): Model mode/variant passed to the extractor.
+        device (str): Inference device.
+        threads (int): Total CPU thread budget, split evenly across workers.
+            Defaults to the machine's core count.
+        batch_size (int): > 1 enables cross-video micro-batching: one model in
+            this process, `workers` videos decoded concurrently, and frames from
+            all of them packed into batches of this size per model call.
+        max_wait (float): Seconds a frame may wait for its batch to fill.
+        output_format (str): 'json' or 'npz' (float32 arrays, memory-mappable via pose_archive).
+        cache_dir (str): Raw inference cache shared by all workers. With a warm
+            cache, changing post-processing only needs the outputs deleted, not
+            the model re-run.
+        cache_max_gb (float): LRU size bound of the cache.
+        max_side (int): Downscale frames to this longer side before inference.
+        frame_stride (int): Run inference on every n-th frame only.
+        metrics_dir (str): Enables instrumentation: per-video <name>.metrics.json
+            sidecars plus job_summary.json and a Prometheus textfile here.
+        prom_file (str): Prometheus textfile path (default: <metrics_dir>/pose_pipeline.prom).
+        profile_video (str): File name of one video to run under cProfile.
+        infer_batch_size (int): Frames per model call inside each worker
+            (batch_size=1 paths); see autotune.py for picking it per machine.
+        track (bool): Follow one athlete per video, running the person detector only
+            every `keyframe_interval` frames or when the track is lost (see tracking.py).
+            Needs per-video frame order, so it cannot be combined with batch_size > 1.
+        keyframe_interval (int): Frames between forced full-frame detections when tracking.
+        motion_threshold (float): > 0 skips inference on frames where less than this
+            percent of pixels changed since the last inferred one, and interpolates them
+            (see adaptive_sampling.py). The achieved skip ratio is logged at the end.
+        max_skip (int): Most consecutive frames adaptive sampling may skip.
+        score_threshold (float): Keypoints scoring below this are dropped before smoothing.
+        max_gap (int): Dropped runs up to this many frames are interpolated; longer
+            ones stay NaN and are flagged in the output's `missing` mask.
+        index_path (str): SQLite manifest index (see manifest_index.py). Videos are then
+            rescanned incrementally, run longest first, and unchanged ones with an
+            output are skipped without being opened; outcomes are recorded per
+            pipeline version. Without it, input_dir is globbed as before.
+        chunk_frames (int): Process each video in chunks of this many frames: memory bounded
+            by the chunk instead of the video length, and an interrupted video resumes
+            from its last chunk on the next run (see chunked.py). Needs batch_size=1.
+        raw_only (bool): Store only raw keypoints, scores and the post-processing
+            parameters (about a third of the size); readers derive smoothed/normalized
+            keypoints on access via pose_archive.load_output / PoseResult.
+        dedup (bool): Fingerprint the videos first (see video_dedup.py) and run only one
+            copy of each group of duplicates / re-encodes; the others are reported with
+            status 'duplicate' and get the canonical copy's result, aligned by time and
+            rescaled to their resolution. Needs index_path.
+        timeout_per_frame (float): Enables supervision: every video runs in a killable
+            worker process (`workers` of them, each with its own model) and is killed
+            after timeout_per_frame seconds per expected frame (at least timeout_min).
+            Failures are kept with their stage in <output_dir>/.quarantine.json; after
+            max_strikes in a row a video is quarantined and skipped by later runs
+            (retry_quarantined releases them). Needs batch_size=1.
+    Returns:
+        list of per-video result dicts (see process_single_video).
     """
+    if track and batch_size > 1:
+        raise ValueError("Tracking follows each video frame by frame; use batch_size=1 (and infer_batch_size) with track.")
+    if chunk_frames and (batch_size > 1 or motion_threshold):
+        raise ValueError("Chunked processing needs batch_size=1 and no adaptive sampling.")
+    if dedup and not index_path:
+        raise ValueError("Deduplication stores its fingerprints in the manifest index; pass index_path.")
+    if timeout_per_frame and batch_size > 1:
+        raise ValueError("Per-video timeouts need one video per worker; use batch_size=1 (and infer_batch_size).")
+
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
-        
-    video_files = []
-    for ext in extensions:
-        video_files.extend(glob.glob(os.path.join(input_dir, f"*{ext}")))
-        
+
+    total_threads = threads or os.cpu_count() or 1
+    # Threads of this process are capped before scanning, which imports numpy/OpenCV
+    if threads and batch_size > 1:
+        limit_threads(total_threads)
+    elif threads and not (workers > 1 and executor == 'process'):
+        limit_threads(max(1, total_threads // max(1, workers)))
+
+    ingest = {"max_side": max_side, "frame_stride": frame_stride}
+    sampling = {"motion_threshold": motion_threshold, "max_skip": max_skip}
+    video_options = dict(ingest, batch_size=infer_batch_size, track=track, keyframe_interval=keyframe_interval,
+                         chunk_frames=chunk_frames, **sampling)
+
+    index = version = None
+    if index_path:
+        from manifest_index import ManifestIndex
+        index = ManifestIndex(index_path)
+        index.scan(input_dir, extensions)
+        version = run_version(backend, model, output_format, track, keyframe_interval, score_threshold, max_gap,
+                              ingest, sampling, raw_only)
+        video_files = _schedule_from_index(index, input_dir, version, output_dir, output_format)
+    else:
+        video_files = []
+        for ext in extensions:
+            video_files.extend(glob.glob(os.path.join(input_dir, f"*{ext}")))
+
+    duplicates, alignments = {}, {}
+    if dedup:
+        from video_dedup import VideoDeduplicator
+        with VideoDeduplicator(index_path) as deduplicator:
+            duplicates = deduplicator.deduplicate(video_files)
+            alignments = {path: deduplicator.alignment(path) for path in duplicates}
+        video_files = [v for v in video_files if os.path.abspath(v) not in duplicates]
+
     logger.info(f"Found {len(video_files)} videos in {input_dir}")
-    
-    # Initialize Extractor (Done once to load model)
-    # Note: MMPose might not be thread-safe for inference if using GPU. 
-    # If using CPU, threading might work but multiprocessing is safer.
-    # For simplicity, we initialize one extractor and run sequentially or use Threading with caution.
-    # RTMPose is fast, so sequential might be fine for small batches.
-    
-    extractor = PoseExtractor()
-    
-    if workers > 1:
-        # Warning: MMPose on CUDA isn't thread-safe usually. 
-        logger.warning("Using multiple workers. Ensure your environment supports threaded inference.")
-        with ThreadPoolExecutor(max_workers=workers) as executor:
-            futures = [executor.submit(process_single_video, extractor, v, output_dir, visualize) for v in video_files]
+    results = []
+    job_metrics = None
+    if metrics_dir or prom_file:
+        metrics_dir = metrics_dir or os.path.join(output_dir, "metrics")
+        os.makedirs(metrics_dir, exist_ok=True)
+        job_metrics = JobMetrics()
+
+    if timeout_per_frame:
+        from supervisor import Quarantine, video_budget, QUARANTINE_FILE
+
+        if workers > 1 and executor == 'thread':
+            logger.info("Per-video timeouts need killable workers: using worker processes instead of threads.")
+        quarantine = Quarantine(os.path.join(output_dir, QUARANTINE_FILE), max_strikes)
+        if retry_quarantined:
+            quarantine.release()
+        budgets = {}
+        for video_path in video_files:
+            if index is not None:
+                info = index.video_info(video_path)
+            else:
+                from video_io import try_probe_video
+                info = try_probe_video(video_path) or {}
+            budgets[video_path] = video_budget((info.get("frame_count") or 0) / max(1, frame_stride),
+                                               timeout_per_frame, timeout_min)
+        threads_per_worker = max(1, total_threads // max(1, workers))
+        results = _supervised_process(video_files, workers,
+                                      (backend, model, device, threads_per_worker, cache_dir, cache_max_gb,
+                                       score_threshold, max_gap, raw_only),
+                                      (output_dir, visualize, output_format, video_options, metrics_dir,
+                                       profile_video),
+                                      budgets, quarantine, output_dir, output_format)
+    elif batch_size > 1:
+        extractor = build_extractor(backend, model, device, cache_dir, cache_max_gb, score_threshold=score_threshold,
+                                    max_gap=max_gap, raw_only=raw_only)
+        results = _batched_process(extractor, video_files, output_dir, batch_size, max_wait, workers, output_format,
+                                   ingest, metrics_dir, job_metrics, sampling)
+    elif workers > 1 and executor == 'process':
+        threads_per_worker = max(1, total_threads // workers)
+        logger.info(f"Starting {workers} worker processes ({threads_per_worker} threads each, backend={backend}).")
+        # 'spawn' keeps CUDA/torch state out of the children and lets each
+        # worker apply its thread limits before numpy/torch are imported.
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(backend, model, device, threads_per_worker, cache_dir, cache_max_gb,
+                                           score_threshold, max_gap, raw_only)) as pool:
+            futures = {pool.submit(_process_in_worker, v, output_dir, visualize, output_format, video_options, metrics_dir,
+                                   profile_video): v for v in video_files}
             for future in as_completed(futures):
-                pass
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # Worker died (e.g. OOM kill or model load failure)
+                    result = {"video": futures[future], "status": "failed", "output": None,
+                              "error": f"worker error: {e}", "seconds": 0.0}
+                results.append(result)
+                _log_progress(result, len(results), len(video_files))
     else:
-        for video_path in video_files:
-            process_single_video(extractor, video_path, output_dir, visualize)
+        # Initialize Extractor (Done once to load model)
+        extractor = build_extractor(backend, model, device, cache_dir, cache_max_gb, score_threshold=score_threshold,
+                                    max_gap=max_gap, raw_only=raw_only)
+
+        if workers > 1:
+            # Warning: MMPose on CUDA isn't thread-safe usually.
+            logger.warning("Using multiple threads with a shared model. Prefer --executor process.")
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(process_single_video, extractor, v, output_dir, visualize, output_format, video_options,
+                                       metrics_dir, profile_video)
+                           for v in video_files]
+                for future in as_completed(futures):
+                    results.append(future.result())
+                    _log_progress(results[-1], len(results), len(video_files))
+        else:
+            for video_path in video_files:
+                results.append(process_single_video(extractor, video_path, output_dir, visualize, output_format, video_options,
+                                                    metrics_dir, profile_video))
+                _log_progress(results[-1], len(results), len(video_files))
+
+    results.extend(_duplicate_results(duplicates, alignments, results, output_dir, output_format))
+
+    if index is not None:
+        for result in results:
+            if result["status"] != "skipped":
+                index.record(result["video"], version, result["status"], result.get("output"), result.get("error"),
+                             result.get("seconds"))
+        index.close()
+
+    failed = sum(1 for r in results if r["status"] == "failed")
+    skipped = sum(1 for r in results if r["status"] == "skipped")
+    duplicate = sum(1 for r in results if r["status"] == "duplicate")
+    quarantined = sum(1 for r in results if r["status"] == "quarantined")
+    logger.info(f"Batch complete: {len(results) - failed - skipped - duplicate - quarantined} processed, "
+                f"{skipped} skipped, {failed} failed" + (f", {duplicate} duplicates reused" if duplicates else "")
+                + (f", {quarantined} quarantined." if quarantined else "."))
+    sampled = [r for r in results if "frames" in r]
+    if sampled:
+        frames = sum(r["frames"] for r in sampled)
+        inferred = sum(r["inferred_frames"] for r in sampled)
+        logger.info(f"Adaptive sampling: inferred {inferred}/{frames} frames "
+                    f"({1 - inferred / max(frames, 1):.1%} skipped, {frames / max(inferred, 1):.2f}x fewer model frames).")
+
+    if job_metrics is not None:
+        for result in results:
+            job_metrics.add(result.get("metrics"), result["status"])
+        job_metrics.write_summary(os.path.join(metrics_dir, "job_summary.json"))
+        job_metrics.write_prometheus(prom_file or os.path.join(metrics_dir, "pose_pipeline.prom"))
+        logger.info(f"Stage breakdown (metrics in {metrics_dir}):")
+        job_metrics.log_summary()
+    return results
 
 if __name__ == "__main__":
+    from pose_backends import available_backends
+    from autotune import tuned_settings
+
     parser = argparse.ArgumentParser(description="Batch Fitness-AQA Vision Pipeline")
     parser.add_argument("--input_dir", "-i", required=True, help="Directory containing video files")
-    parser.add_argument("--output_dir", "-o", required=True, help="Directory to save JSON output")
+    parser.add_argument("--output_dir", "-o", required=True, help="Directory to save JSON/.npz output")
     parser.add_argument("--visualize", "-v", action="store_true", help="Generate visualization videos")
-    parser.add_argument("--workers", "-w", type=int, default=1, help="Number of parallel workers (default: 1)")
-    
+    parser.add_argument("--workers", "-w", type=int, default=None,
+                        help="Number of parallel workers (default: tuning profile, else 1)")
+    parser.add_argument("--executor", choices=["process", "thread"], default="process",
+                        help="Parallelism for --workers > 1: one model per process (default) or a shared model across threads")
+    parser.add_argument("--threads", "-t", type=int, default=None,
+                        help="Total CPU thread budget split across workers (default: tuning profile, else all cores)")
+    parser.add_argument("--backend", "-b", choices=available_backends(), default=None,
+                        help="Pose backend ('stub' needs no model, for tests). Default: tuning profile, else mmpose")
+    parser.add_argument("--model", "-m", default=None, help="MMPose mode or YOLO weights (default: backend default)")
+    parser.add_argument("--device", "-d", default=None, help="Inference device: cpu, cuda or mps (default: tuning profile, else cpu)")
+    parser.add_argument("--format", "-f", choices=["json", "npz"], default="json",
+                        help="Output format: JSON lists or float32 .npz (memory-mappable)")
+    parser.add_argument("--max-side", type=int, default=None,
+                        help="Downscale frames so the longer side is at most this before inference (e.g. 640 for 4K)")
+    parser.add_argument("--frame-stride", type=int, default=1, help="Run inference on every n-th frame")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Cache raw model output here; re-runs only redo smoothing/normalization")
+    parser.add_argument("--cache-max-gb", type=float, default=20.0, help="Inference cache size limit (default: 20)")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="Frames per model call; > 1 batches frames across videos in one process")
+    parser.add_argument("--infer-batch-size", type=int, default=None,
+                        help="Frames per model call within each worker (default: tuning profile, else 8)")
+    parser.add_argument("--track", action="store_true",
+                        help="Detect the athlete on keyframes only and track a crop in between (not with --batch-size > 1)")
+    parser.add_argument("--keyframe-interval", type=int, default=30, help="Frames between full-frame detections with --track")
+    parser.add_argument("--motion-threshold", type=float, default=0.0,
+                        help="Skip inference on frames with less than this %% of pixels changed and interpolate them "
+                             "(0 = off; higher is faster but less accurate, try 1)")
+    parser.add_argument("--max-skip", type=int, default=4, help="Most consecutive frames --motion-threshold may skip")
+    parser.add_argument("--score-threshold", type=float, default=0.3, help="Drop keypoints scoring below this before smoothing")
+    parser.add_argument("--max-gap", type=int, default=10,
+                        help="Interpolate dropped runs up to this many frames; longer ones stay NaN")
+    parser.add_argument("--raw-only", action="store_true",
+                        help="Store only raw keypoints + scores; smoothed/normalized are derived on read (~3x smaller)")
+    parser.add_argument("--chunk-frames", type=int, default=None,
+                        help="Process each video in resumable chunks of this many frames, with memory bounded by the chunk")
+    parser.add_argument("--timeout-per-frame", type=float, default=None,
+                        help="Kill a video after this many seconds per expected frame (runs videos in killable "
+                             "worker processes; e.g. 0.5)")
+    parser.add_argument("--timeout-min", type=float, default=60.0, help="Smallest per-video budget in seconds (default: 60)")
+    parser.add_argument("--max-strikes", type=int, default=2,
+                        help="Failures in a row before a video is quarantined (with --timeout-per-frame)")
+    parser.add_argument("--retry-quarantined", action="store_true", help="Run quarantined videos again")
+    parser.add_argument("--max-wait-ms", type=float, default=50.0,
+                        help="Max time a frame waits for its batch to fill (default: 50ms)")
+    parser.add_argument("--metrics-dir", default=None,
+                        help="Write per-video stage metrics, a job summary and a Prometheus textfile here")
+    parser.add_argument("--prom-file", default=None,
+                        help="Prometheus textfile path, e.g. in node_exporter's textfile directory")
+    parser.add_argument("--profile-video", default=None, help="File name of one video to run under cProfile")
+    parser.add_argument("--index", default=None,
+                        help="SQLite manifest index (default: <output_dir>/manifest.sqlite); rescanned incrementally")
+    parser.add_argument("--no-index", action="store_true", help="Glob the input directory instead of using the index")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Run one copy of duplicate / re-encoded videos only (perceptual fingerprints, needs the index)")
+    parser.add_argument("--pack-into", default=None,
+                        help="Append finished videos to this training store afterwards (see dataset_store.py)")
+    parser.add_argument("--tuning-profile", default=None,
+                        help="Settings from autotune.py (default: this host's profile, if one exists)")
+    parser.add_argument("--no-tuning-profile", action="store_true", help="Ignore any autotune profile")
+
     args = parser.parse_args()
-    
-    batch_process(args.input_dir, args.output_dir, visualize=args.visualize, workers=args.workers)
+    if args.track and args.batch_size > 1:
+        parser.error("--track needs per-video frame order; use --infer-batch-size instead of --batch-size")
+    if args.chunk_frames and (args.batch_size > 1 or args.motion_threshold):
+        parser.error("--chunk-frames cannot be combined with --batch-size > 1 or --motion-threshold")
+    if args.timeout_per_frame and args.batch_size > 1:
+        parser.error("--timeout-per-frame runs one video per worker and cannot be combined with --batch-size > 1")
+    if args.dedup and args.no_index:
+        parser.error("--dedup keeps its fingerprints in the manifest index and cannot be combined with --no-index")
+
+    # Explicit flags win; unset ones come from this machine's autotune profile, then the built-in defaults
+    # (an explicit --model without --backend keeps meaning an MMPose model, as before)
+    requested_backend = args.backend or ("mmpose" if args.model else None)
+    tuned = {} if args.no_tuning_profile else tuned_settings(requested_backend, args.tuning_profile)
+    backend = requested_backend or tuned.get("backend", "mmpose")
+    workers = args.workers or tuned.get("workers", 1)
+    threads = args.threads or (tuned["threads"] * workers if tuned else None)
+
+    results = batch_process(args.input_dir, args.output_dir, visualize=args.visualize, workers=workers,
+                            executor=args.executor, backend=backend, model=args.model or tuned.get("model"),
+                            device=args.device or tuned.get("device", "cpu"),
+                            threads=threads, batch_size=args.batch_size, max_wait=args.max_wait_ms / 1000.0,
+                            output_format=args.format, cache_dir=args.cache_dir, cache_max_gb=args.cache_max_gb,
+                            max_side=args.max_side, frame_stride=args.frame_stride, metrics_dir=args.metrics_dir,
+                            prom_file=args.prom_file, profile_video=args.profile_video,
+                            infer_batch_size=args.infer_batch_size or tuned.get("batch_size", 8),
+                            track=args.track, keyframe_interval=args.keyframe_interval,
+                            motion_threshold=args.motion_threshold, max_skip=args.max_skip,
+                            score_threshold=args.score_threshold, max_gap=args.max_gap,
+                            chunk_frames=args.chunk_frames, raw_only=args.raw_only, dedup=args.dedup,
+                            timeout_per_frame=args.timeout_per_frame, timeout_min=args.timeout_min,
+                            max_strikes=args.max_strikes, retry_quarantined=args.retry_quarantined,
+                            index_path=None if args.no_index else args.index or os.path.join(args.output_dir, "manifest.sqlite"))
+
+    if args.pack_into:
+        from dataset_store import pack_outputs
+        pack_outputs([r["output"] for r in results if r["status"] in ("done", "skipped") and r.get("output")
+                      and os.path.exists(r["output"])],
+                     args.pack_into)
@@ -0,0 +1,242 @@
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import numpy as np
+from synthetic_data import generate_synthetic_skeletons, write_synthetic_video
+from signal_processing import gate_and_fill, smooth_keypoints, normalize_keypoints
+from pose_archive import make_data_packet, save_output
+from video_io import VideoFrameReader, iter_frame_batches
+from pose_backends import create_backend, available_backends
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+STAGES = ('decode', 'inference', 'gating', 'smoothing', 'normalization', 'serialization', 'visualization')
+
+class _PeakRSS:
+    """Samples resident memory on a background thread; `peak_mb` is valid after the with-block."""
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+
+    @staticmethod
+    def current_mb():
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+        except (OSError, ValueError, AttributeError):
+            # Non-Linux: lifetime peak is the best available figure
+            import resource
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return rss / 1024 ** 2 if sys.platform == 'darwin' else rss / 1024
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_mb = max(self.peak_mb, self.current_mb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak_mb = self.current_mb()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, self.current_mb())
+
+def _record(stage, frames, wall, latencies, peak_mb, config):
+    latencies_ms = np.asarray(latencies) * 1000.0 if len(latencies) else np.zeros(1)
+    return {
+        "stage": stage,
+        "frames": int(frames),
+        "wall_s": wall,
+        "fps": frames / wall if wall > 0 else float('inf'),
+        "latency_p50_ms": float(np.percentile(latencies_ms, 50)),
+        "latency_p90_ms": float(np.percentile(latencies_ms, 90)),
+        "latency_p99_ms": float(np.percentile(latencies_ms, 99)),
+        "peak_rss_mb": peak_mb,
+        "config": config,
+        "timestamp": time.time(),
+        "host": socket.gethostname(),
+        "python": platform.python_version(),
+    }
+
+def _run_stage(stage, fn, config):
+    """Runs fn() -> (frames, per-unit latencies) under wall-clock and RSS measurement."""
+    with _PeakRSS() as rss:
+        start = time.perf_counter()
+        frames, latencies = fn()
+        wall = time.perf_counter() - start
+    record = _record(stage, frames, wall, latencies, rss.peak_mb, config)
+    logger.info(f"{stage:>13}: {record['fps']:10.1f} frames/s  p50 {record['latency_p50_ms']:.3f}ms  "
+                f"p99 {record['latency_p99_ms']:.3f}ms  peak RSS {record['peak_rss_mb']:.0f}MB")
+    return record
+
+def _time_calls(fn, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def run_benchmarks(frames=300, width=1280, height=720, persons=1, fps=30.0, backend='stub', model=None,
+                   device='cpu', batch_size=8, max_side=None, repeat=20, stub_cost_ms=0.0, stages=STAGES,
+                   work_dir=None):
+    """
+    Generates a synthetic video and keypoint sequence, then measures each
+    pipeline stage in isolation.
+    Returns:
+        list of per-stage records (frames/sec, latency percentiles, peak RSS).
+    """
+    config = {"frames": frames, "width": width, "height": height, "persons": persons, "backend": backend,
+              "model": model, "batch_size": batch_size, "max_side": max_side, "repeat": repeat}
+    work_dir = work_dir or tempfile.mkdtemp(prefix="pose_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+
+    keypoints, scores = generate_synthetic_skeletons(frames, persons, width, height)
+    video_path = write_synthetic_video(os.path.join(work_dir, "synthetic.mp4"), keypoints, width, height, fps)
+    raw, scores = keypoints[0], scores[0]
+    records = []
+
+    if 'decode' in stages:
+        def decode():
+            latencies, count = [], 0
+            last = time.perf_counter()
+            for _ in VideoFrameReader(video_path, max_side=max_side):
+                now = time.perf_counter()
+                latencies.append(now - last)
+                last = now
+                count += 1
+            return count, latencies
+        records.append(_run_stage('decode', decode, config))
+
+    if 'inference' in stages:
+        options = {"cost_ms": stub_cost_ms} if backend == 'stub' else {}
+        # Warm-up is excluded from the measurement
+        pose_backend = create_backend(backend, model, device, warmup=True, **options)
+        batches = list(iter_frame_batches(VideoFrameReader(video_path, max_side=max_side), batch_size))
+
+        def inference():
+            latencies, count = [], 0
+            for _, batch in batches:
+                start = time.perf_counter()
+                pose_backend.infer(batch)
+                # Per-frame latency within the batch
+                latencies.append((time.perf_counter() - start) / len(batch))
+                count += len(batch)
+            return count, latencies
+        records.append(_run_stage('inference', inference, config))
+
+    if 'gating' in stages:
+        records.append(_run_stage('gating', lambda: (
+            frames * repeat, _time_calls(lambda: gate_and_fill(raw, scores), repeat)), config))
+
+    if 'smoothing' in stages:
+        records.append(_run_stage('smoothing', lambda: (
+            frames * repeat, _time_calls(lambda: smooth_keypoints(raw), repeat)), config))
+
+    if 'normalization' in stages:
+        smoothed = smooth_keypoints(raw)
+        records.append(_run_stage('normalization', lambda: (
+            frames * repeat, _time_calls(lambda: normalize_keypoints(smoothed), repeat)), config))
+
+    smoothed = smooth_keypoints(raw)
+    packet = make_data_packet(video_path, raw, smoothed, normalize_keypoints(smoothed), scores,
+                              {"fps": fps, "width": width, "height": height})
+    json_path = os.path.join(work_dir, "synthetic.json")
+
+    if 'serialization' in stages:
+        for fmt in ('json', 'npz'):
+            out_path = os.path.join(work_dir, f"synthetic.{fmt}")
+            stage_config = dict(config, format=fmt)
+            records.append(_run_stage(f'serialization_{fmt}', lambda: (
+                frames * repeat, _time_calls(lambda: save_output(packet, out_path), repeat)), stage_config))
+    else:
+        save_output(packet, json_path)
+
+    if 'visualization' in stages:
+        from visualizer import render_overlays
+        out_path = os.path.join(work_dir, "synthetic_viz.mp4")
+        records.append(_run_stage('visualization', lambda: (
+            frames, _time_calls(lambda: render_overlays(video_path, json_path, {'smoothed': out_path}), 1)), config))
+
+    return records
+
+def compare_to_baseline(records, baseline, threshold=0.10):
+    """
+    Flags stages whose throughput dropped, or whose p99 latency rose, by more
+    than `threshold` (fraction) relative to the baseline records.
+    Returns:
+        list of human-readable regression messages (empty = no regression).
+    """
+    by_stage = {r["stage"]: r for r in baseline}
+    regressions = []
+    for record in records:
+        base = by_stage.get(record["stage"])
+        if base is None:
+            continue
+        if record["fps"] < base["fps"] * (1 - threshold):
+            regressions.append(f"{record['stage']}: {record['fps']:.1f} frames/s vs baseline {base['fps']:.1f} "
+                               f"({record['fps'] / base['fps'] - 1:+.0%})")
+        if record["latency_p99_ms"] > base["latency_p99_ms"] * (1 + threshold):
+            regressions.append(f"{record['stage']}: p99 {record['latency_p99_ms']:.3f}ms vs baseline "
+                               f"{base['latency_p99_ms']:.3f}ms")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage throughput benchmark on synthetic data")
+    parser.add_argument("--frames", type=int, default=300, help="Synthetic video length")
+    parser.add_argument("--width", type=int, default=1280, help="Synthetic video width")
+    parser.add_argument("--height", type=int, default=720, help="Synthetic video height")
+    parser.add_argument("--persons", type=int, default=1, help="People in the synthetic video")
+    parser.add_argument("--backend", "-b", choices=available_backends(), default="stub",
+                        help="Inference backend (stub runs offline)")
+    parser.add_argument("--model", "-m", default=None, help="MMPose mode or YOLO weights")
+    parser.add_argument("--device", "-d", default="cpu", help="Inference device")
+    parser.add_argument("--batch-size", type=int, default=8, help="Frames per inference call")
+    parser.add_argument("--max-side", type=int, default=None, help="Downscale frames before inference")
+    parser.add_argument("--stub-cost-ms", type=float, default=0.0, help="Simulated per-frame model cost")
+    parser.add_argument("--repeat", type=int, default=20, help="Repetitions for the array-only stages")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES), help="Stages to run")
+    parser.add_argument("--output", "-o", default=None, help="Append records to this JSON-lines file")
+    parser.add_argument("--baseline", default=None, help="Baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Write this run as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed regression (fraction, default 0.10)")
+
+    args = parser.parse_args()
+
+    records = run_benchmarks(args.frames, args.width, args.height, args.persons, backend=args.backend,
+                             model=args.model, device=args.device, batch_size=args.batch_size,
+                             max_side=args.max_side, repeat=args.repeat, stub_cost_ms=args.stub_cost_ms,
+                             stages=args.stages)
+
+    if args.output:
+        with open(args.output, 'a') as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        logger.info(f"Appended {len(records)} records to {args.output}")
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(records, f, indent=2)
+        logger.info(f"Saved baseline to {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(records, baseline, args.threshold)
+        if regressions:
+            for message in regressions:
+                logger.error(f"REGRESSION {message}")
+            sys.exit(1)
+        logger.info(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
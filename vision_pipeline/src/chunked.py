@@ -0,0 +1,309 @@
+import os
+import json
+import shutil
+import zipfile
+import logging
+import numpy as np
+from scipy.signal import savgol_filter
+from signal_processing import gate_and_fill, normalize_keypoints, postprocess_params, _hold_missing
+from pose_archive import packet_meta, json_safe, META_MEMBER
+from video_io import VideoFrameReader, iter_frame_batches
+from tracking import PoseTracker
+from instrumentation import NULL_RECORDER
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Per-frame output fields in output order: (name, dtype on disk, shape of one frame)
+SPOOL_FIELDS = (('raw_keypoints', np.float64, (17, 2)), ('smoothed_keypoints', np.float64, (17, 2)),
+                ('normalized_keypoints', np.float64, (17, 2)), ('scores', np.float64, (17,)),
+                ('missing', np.bool_, (17,)))
+# All a raw-only output stores (see PoseExtractor raw_only)
+RAW_FIELDS = ('raw_keypoints', 'scores')
+STATE_FILE = 'state.json'
+
+class ChunkedPostprocessor:
+    """
+    Confidence gating, Savitzky-Golay smoothing and normalization over a stream
+    of frames, in bounded memory, with results identical to running
+    gate_and_fill / smooth_keypoints / normalize_keypoints on the whole video.
+
+    Each chunk is computed with enough context on both sides that nothing
+    inside it depends on where the chunk ends: max_gap + 1 frames decide any
+    gating gap, window_length frames cover the smoothing window (and the
+    polynomial fit at the real ends of the video), and the last valid value
+    per joint before the context is carried over for NaN runs held by the
+    smoother.
+
+        post = ChunkedPostprocessor(max_gap=10)
+        for keypoints, scores in batches:
+            post.push(keypoints, scores)
+            while post.ready(chunk_frames):
+                smoothed, normalized, missing = post.emit()
+        smoothed, normalized, missing = post.emit(final=True)
+    """
+    def __init__(self, score_threshold=0.3, max_gap=10, window_length=5, polyorder=2):
+        if max_gap is None:
+            raise ValueError("Chunked processing needs a finite max_gap: an unbounded gap could span any chunk.")
+        self.score_threshold = score_threshold
+        self.max_gap = int(max_gap)
+        self.window_length = window_length
+        self.polyorder = polyorder
+        # Frames of context needed before the first and after the last frame of a chunk
+        self.lookback = window_length + self.max_gap + 1
+        self.lookahead = window_length // 2 + self.max_gap + 1
+        self.restore(0, np.zeros((0, 17, 2)), np.zeros((0, 17)), 0, None)
+
+    def restore(self, start, keypoints, scores, emitted, carry):
+        """Resets the stream: buffered raw frames from `start`, `emitted` frames already output."""
+        self._start = start
+        self._keypoints = np.asarray(keypoints, dtype=float).reshape(-1, 17, 2)
+        self._scores = np.asarray(scores, dtype=float).reshape(-1, 17)
+        self.emitted = emitted
+        self.carry = np.full(34, np.nan) if carry is None else np.asarray(carry, dtype=float)
+
+    @property
+    def frames_pushed(self):
+        return self._start + len(self._keypoints)
+
+    def push(self, keypoints, scores):
+        self._keypoints = np.concatenate([self._keypoints, np.asarray(keypoints, dtype=float)])
+        self._scores = np.concatenate([self._scores, np.asarray(scores, dtype=float)])
+
+    def ready(self, chunk_frames):
+        """True once a chunk of chunk_frames frames has all the context it needs."""
+        end = self.frames_pushed - self.lookahead
+        # The first chunk also needs a full window for the polynomial fit at the video start
+        return end - self.emitted >= chunk_frames and end >= self.window_length
+
+    def emit(self, final=False):
+        """
+        Post-processes the next chunk: everything that has its context, or all remaining
+        frames when final=True (end of video).
+        Returns:
+            (smoothed, normalized, missing) for the chunk's frames, or None if there are none.
+        """
+        end = self.frames_pushed if final else self.frames_pushed - self.lookahead
+        first = self.emitted
+        if end <= first:
+            return None
+
+        context = max(self._start, first - self.lookback)
+        offset = context - self._start
+        gated, missing = gate_and_fill(self._keypoints[offset:], self._scores[offset:], self.score_threshold,
+                                       self.max_gap)
+
+        # Smoothing input: from window_length before the chunk (enough for the polynomial
+        # fit at the video end) to half a window after it
+        sub_start = max(0, first - self.window_length)
+        sub = gated[sub_start - context:end + self.window_length // 2 - context]
+        if final and first == 0 and len(sub) < self.window_length:
+            smoothed = sub.copy()   # too short to smooth, as in smooth_keypoints
+        else:
+            flat = sub.reshape(len(sub), -1)
+            held = _hold_missing(np.concatenate([self.carry[None], flat]))[1:]
+            smoothed = savgol_filter(held, self.window_length, self.polyorder, axis=0).reshape(sub.shape)
+            smoothed[np.isnan(sub)] = np.nan
+        smoothed = smoothed[first - sub_start:end - sub_start]
+        normalized = normalize_keypoints(smoothed)
+        missing = missing[first - context:end - context]
+
+        # Last valid value per column before the next chunk's smoothing input
+        next_sub_start = max(0, end - self.window_length)
+        seen = gated[sub_start - context:next_sub_start - context].reshape(-1, 34)
+        if len(seen):
+            valid = ~np.isnan(seen)
+            last = len(seen) - 1 - np.argmax(valid[::-1], axis=0)
+            self.carry = np.where(valid.any(axis=0), seen[last, np.arange(34)], self.carry)
+
+        self.emitted = end
+        keep = max(self._start, end - self.lookback) - self._start
+        self._keypoints = self._keypoints[keep:]
+        self._scores = self._scores[keep:]
+        self._start += keep
+        return smoothed, normalized, missing
+
+class ChunkCheckpoint:
+    """
+    Spool files and resume state of one chunked run, in <output_path>.partial/.
+    Raw model output is appended as frames are inferred, post-processed fields as
+    chunks are emitted; state.json records how many frames of each are complete,
+    so a crashed run continues from its last checkpoint instead of frame 0.
+    """
+    def __init__(self, output_path, video_path, settings):
+        self.output_path = output_path
+        self.directory = output_path + '.partial'
+        st = os.stat(video_path)
+        self.identity = {"video": os.path.abspath(video_path), "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                         "settings": settings}
+
+    def _spool(self, name):
+        return os.path.join(self.directory, name + '.bin')
+
+    def load(self):
+        """Resume state of a matching earlier run (spools trimmed to it), or None to start fresh."""
+        path = os.path.join(self.directory, STATE_FILE)
+        state = None
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                state = json.load(f)
+            if state.get("identity") != json.loads(json.dumps(self.identity)):
+                logger.warning(f"Discarding checkpoint in {self.directory}: video or settings changed.")
+                state = None
+        if state is None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.makedirs(self.directory)
+            return None
+
+        # Drop anything written after the checkpoint
+        for name, dtype, shape in SPOOL_FIELDS:
+            frames = state["inferred"] if name in ('raw_keypoints', 'scores') else state["emitted"]
+            with open(self._spool(name), 'ab') as f:
+                f.truncate(frames * np.dtype(dtype).itemsize * int(np.prod(shape)))
+        return state
+
+    def read(self, name, start, stop):
+        """Frames [start, stop) of a spooled field."""
+        _, dtype, shape = next(field for field in SPOOL_FIELDS if field[0] == name)
+        frame_size = int(np.prod(shape))
+        return np.fromfile(self._spool(name), dtype=dtype, count=(stop - start) * frame_size,
+                           offset=start * frame_size * np.dtype(dtype).itemsize).reshape((-1,) + shape)
+
+    def append(self, **fields):
+        for name, values in fields.items():
+            dtype = next(field[1] for field in SPOOL_FIELDS if field[0] == name)
+            with open(self._spool(name), 'ab') as f:
+                f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+
+    def save(self, inferred, post):
+        """Records a consistent point to resume from (spools are flushed by append())."""
+        state = {"identity": self.identity, "inferred": inferred, "emitted": post.emitted,
+                 "carry": post.carry.tolist()}
+        path = os.path.join(self.directory, STATE_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(path + '.tmp', path)
+
+    def _blocks(self, name, frames, block=4096):
+        for start in range(0, frames, block):
+            yield self.read(name, start, min(frames, start + block))
+
+    def _write_json(self, path, meta, frames, fields):
+        # Same bytes json.dump() writes for the whole packet (see pose_archive.save_output)
+        with open(path, 'w') as f:
+            f.write('{' + ', '.join(f"{json.dumps(k)}: {json.dumps(v)}" for k, v in meta.items()))
+            for name, _, _ in fields:
+                f.write(f", {json.dumps(name)}: [")
+                for i, block in enumerate(self._blocks(name, frames)):
+                    f.write((', ' if i else '') + ', '.join(json.dumps(json_safe(row), allow_nan=False)
+                                                            for row in block.tolist()))
+                f.write(']')
+            f.write('}')
+
+    def _write_npz(self, path, meta, frames, fields):
+        # Same members and dtypes as pose_archive.save_npz, streamed into a stored zip
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+            for name, dtype, shape in fields:
+                out_dtype = np.dtype(bool if dtype is np.bool_ else np.float32)
+                with zf.open(name + '.npy', 'w', force_zip64=True) as member:
+                    np.lib.format.write_array_header_1_0(member, {
+                        'descr': np.lib.format.dtype_to_descr(out_dtype), 'fortran_order': False,
+                        'shape': (frames,) + shape})
+                    for block in self._blocks(name, frames):
+                        member.write(block.astype(out_dtype).tobytes())
+            with zf.open(META_MEMBER + '.npy', 'w') as member:
+                np.lib.format.write_array(member, np.frombuffer(json.dumps(meta).encode('utf-8'), dtype=np.uint8))
+
+    def finalize(self, meta, raw_only=False):
+        """Assembles the output file from the spools (block by block), then removes them."""
+        frames = meta["frame_count"]
+        fields = [field for field in SPOOL_FIELDS if not raw_only or field[0] in RAW_FIELDS]
+        tmp_path = self.output_path + '.tmp'
+        if self.output_path.endswith('.npz'):
+            self._write_npz(tmp_path, meta, frames, fields)
+        else:
+            self._write_json(tmp_path, meta, frames, fields)
+        os.replace(tmp_path, self.output_path)
+        shutil.rmtree(self.directory, ignore_errors=True)
+        logger.info(f"Saved processed data to {self.output_path}")
+
+def process_video_chunked(extractor, video_path, output_path, chunk_frames=9000, max_side=None, frame_stride=1,
+                          start_time=None, end_time=None, batch_size=8, recorder=None, track=False,
+                          keyframe_interval=30, window_length=5, polyorder=2):
+    """
+    PoseExtractor.process_video for arbitrarily long videos: peak memory is
+    O(chunk_frames) instead of O(video length). Results go to spool files as
+    they are produced and the output (.json or .npz, same content as the
+    whole-video path) is assembled at the end. Re-running after a crash resumes
+    from the last completed chunk; a tracker restarts with a fresh detection there.
+    The inference cache is not used (it holds whole videos). With extractor.raw_only
+    only the raw spools are written and nothing is post-processed.
+    Args:
+        extractor (video_processor.PoseExtractor): Loaded extractor (backend, gating settings).
+        chunk_frames (int): Frames post-processed and checkpointed at a time.
+    Returns:
+        The packet metadata (no arrays); read the arrays from output_path.
+    """
+    recorder = recorder or NULL_RECORDER
+    reader = VideoFrameReader(video_path, max_side=max_side, frame_stride=frame_stride,
+                              start_time=start_time, end_time=end_time)
+    post = ChunkedPostprocessor(extractor.score_threshold, extractor.max_gap, window_length, polyorder)
+    chunk_frames = max(int(chunk_frames), window_length)
+    tracker = PoseTracker(extractor.backend, keyframe_interval) if track else None
+    settings = dict(extractor.cache_key, params=dict(reader.params), score_threshold=extractor.score_threshold,
+                    max_gap=extractor.max_gap, window_length=window_length, polyorder=polyorder,
+                    track=tracker.params if tracker is not None else None, raw_only=extractor.raw_only)
+    checkpoint = ChunkCheckpoint(output_path, video_path, settings)
+
+    state = checkpoint.load()
+    inferred = 0
+    if state is not None:
+        inferred = state["inferred"]
+        if not extractor.raw_only:
+            start = max(0, state["emitted"] - post.lookback)
+            post.restore(start, checkpoint.read('raw_keypoints', start, inferred),
+                         checkpoint.read('scores', start, inferred), state["emitted"],
+                         np.array(state["carry"], dtype=float))
+        logger.info(f"Resuming {os.path.basename(video_path)} at frame {inferred} ({state['emitted']} written)")
+        reader.resume_at(inferred)
+    else:
+        logger.info(f"Processing video in chunks of {chunk_frames} frames: {video_path}")
+
+    def write_chunk(result):
+        smoothed, normalized, missing = result
+        with recorder.stage('serialization', len(smoothed)):
+            checkpoint.append(smoothed_keypoints=smoothed, normalized_keypoints=normalized, missing=missing)
+            checkpoint.save(inferred, post)
+        logger.info(f"{os.path.basename(video_path)}: {post.emitted} frames written")
+
+    batches = recorder.iterate('decode', iter_frame_batches(reader, batch_size), count=lambda b: len(b[0]))
+    for _, frames in batches:
+        with recorder.stage('inference', len(frames), per_frame=True):
+            kps, scores = tracker.infer(frames) if tracker is not None else extractor.infer_frames(frames)
+        kps = reader.to_source_coords(kps)
+        checkpoint.append(raw_keypoints=kps, scores=scores)
+        inferred += len(frames)
+        if extractor.raw_only:
+            # Nothing to post-process: checkpoint once per chunk_frames of raw output
+            if inferred // chunk_frames > (inferred - len(frames)) // chunk_frames:
+                checkpoint.save(inferred, post)
+            continue
+        post.push(kps, scores)
+        while post.ready(chunk_frames):
+            with recorder.stage('smoothing', chunk_frames):
+                result = post.emit()
+            write_chunk(result)
+    if tracker is not None:
+        logger.info(f"Tracking: {tracker.summary()}")
+
+    if not extractor.raw_only:
+        with recorder.stage('smoothing', inferred - post.emitted):
+            result = post.emit(final=True)
+        if result is not None:
+            write_chunk(result)
+
+    meta = packet_meta(video_path, inferred, reader.output_info(),
+                       postprocess_params(extractor.score_threshold, extractor.max_gap, window_length, polyorder))
+    with recorder.stage('serialization', inferred):
+        checkpoint.finalize(meta, extractor.raw_only)
+    return meta
@@ -0,0 +1,250 @@
+import os
+import json
+import glob
+import logging
+import argparse
+import numpy as np
+from pose_archive import PoseArchive, load_output, MASK_FIELDS
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = 'index.json'
+STORE_VERSION = 1
+# Per-frame shape of the fields a store can hold
+FIELD_SHAPES = {'raw_keypoints': (17, 2), 'smoothed_keypoints': (17, 2), 'normalized_keypoints': (17, 2),
+                'keypoints_3d': (17, 3), 'scores': (17,), 'missing': (17,), 'inferred': ()}
+DEFAULT_FIELDS = ('smoothed_keypoints', 'normalized_keypoints', 'scores')
+
+def _field_dtype(field):
+    return np.dtype(bool) if field in MASK_FIELDS else np.dtype(np.float32)
+
+class DatasetStore:
+    """
+    All processed videos of a dataset packed back to back: one contiguous,
+    memory-mapped file per field (<field>.bin, [TotalFrames, ...]) plus
+    index.json with each video's start, length, fps and labels. Training
+    loaders slice windows straight out of the page cache instead of parsing
+    thousands of JSON files per epoch.
+
+        store = DatasetStore('dataset/')
+        clip = store.window('squat_001.mp4', 100, 164)          # zero-copy [64, 17, 2] view
+        batch, video_ids, starts = store.sample_windows(32, 64)  # random windows across the dataset
+
+    Build or extend it with DatasetStore.create() / append(), or pack_outputs().
+    The store pickles by path, so DataLoader workers re-map it instead of copying it.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE), 'r') as f:
+            self.index = json.load(f)
+        self.fields = list(self.index["fields"])
+        self.videos = self.index["videos"]
+        self._by_id = {video["video_id"]: video for video in self.videos}
+        self.starts = np.array([video["start"] for video in self.videos], dtype=np.int64)
+        self.lengths = np.array([video["length"] for video in self.videos], dtype=np.int64)
+        self._arrays = {}
+
+    @classmethod
+    def create(cls, path, fields=DEFAULT_FIELDS):
+        """Creates an empty store holding `fields`."""
+        unknown = [f for f in fields if f not in FIELD_SHAPES]
+        if unknown:
+            raise ValueError(f"Unknown fields {unknown}. Available: {sorted(FIELD_SHAPES)}")
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, INDEX_FILE)):
+            raise FileExistsError(f"{path} already holds a dataset store.")
+        for field in fields:
+            open(os.path.join(path, f"{field}.bin"), 'wb').close()
+        index = {"version": STORE_VERSION, "frames": 0, "videos": [],
+                 "fields": {f: {"dtype": _field_dtype(f).str, "shape": list(FIELD_SHAPES[f])} for f in fields}}
+        cls._write_index(path, index)
+        return cls(path)
+
+    @staticmethod
+    def _write_index(path, index):
+        tmp = os.path.join(path, INDEX_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp, os.path.join(path, INDEX_FILE))
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def __len__(self):
+        return len(self.videos)
+
+    def __contains__(self, video_id):
+        return video_id in self._by_id
+
+    @property
+    def frame_count(self):
+        return self.index["frames"]
+
+    def array(self, field):
+        """The whole field as one read-only memory map, [TotalFrames, ...]."""
+        if field not in self._arrays:
+            if field not in self.index["fields"]:
+                raise KeyError(f"Store has no field '{field}'. Available: {self.fields}")
+            spec = self.index["fields"][field]
+            shape = (self.frame_count,) + tuple(spec["shape"])
+            if self.frame_count == 0:
+                self._arrays[field] = np.zeros(shape, dtype=spec["dtype"])
+            else:
+                self._arrays[field] = np.memmap(os.path.join(self.path, f"{field}.bin"), dtype=spec["dtype"],
+                                                mode='r', shape=shape)
+        return self._arrays[field]
+
+    def video(self, video_id):
+        """Index entry of a video: start, length, fps, labels."""
+        return self._by_id[video_id]
+
+    def window(self, video_id, start=0, stop=None, field='smoothed_keypoints'):
+        """Frames [start, stop) of one video as a zero-copy view."""
+        video = self._by_id[video_id]
+        stop = video["length"] if stop is None else min(stop, video["length"])
+        return self.array(field)[video["start"] + start:video["start"] + stop]
+
+    def window_starts(self, length, stride=1):
+        """
+        Global start frame of every full window of `length` frames (within one video),
+        `stride` frames apart. Returns (global_starts, video_indices).
+        """
+        counts = np.maximum(0, (self.lengths - length) // stride + 1)
+        video_indices = np.repeat(np.arange(len(self.videos)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return self.starts[video_indices] + offsets * stride, video_indices
+
+    def gather(self, global_starts, length, field='smoothed_keypoints'):
+        """Windows at the given global start frames, in one gather: [N, length, ...]."""
+        frames = np.asarray(global_starts, dtype=np.int64)[:, None] + np.arange(length)
+        return self.array(field)[frames]
+
+    def sample_windows(self, n, length, field='smoothed_keypoints', rng=None):
+        """
+        n windows drawn uniformly from all full windows of the dataset (so longer
+        videos contribute proportionally more).
+        Returns:
+            windows [n, length, ...], video_ids (list), starts within each video [n].
+        """
+        rng = rng if rng is not None else np.random.default_rng()
+        counts = np.maximum(0, self.lengths - length + 1)
+        if counts.sum() == 0:
+            raise ValueError(f"No video has {length} frames.")
+        picks = rng.integers(0, counts.sum(), size=n)
+        video_indices = np.searchsorted(np.cumsum(counts), picks, side='right')
+        starts = picks - (np.cumsum(counts) - counts)[video_indices]
+        windows = self.gather(self.starts[video_indices] + starts, length, field)
+        return windows, [self.videos[i]["video_id"] for i in video_indices], starts
+
+    def windows(self, length, stride=1, field='smoothed_keypoints'):
+        """A map-style dataset over every full window (len / []), usable with a torch DataLoader."""
+        return WindowDataset(self, length, stride, field)
+
+    def append(self, video_id, arrays, fps=None, labels=None):
+        """
+        Appends one video. `arrays` maps field name to [Frames, ...]; fields the
+        store has but `arrays` lacks are filled with NaN (False for masks).
+        """
+        if video_id in self._by_id:
+            raise ValueError(f"{video_id} is already in the store.")
+        length = len(next(iter(arrays.values()))) if arrays else 0
+        start = self.frame_count
+        for field in self.fields:
+            spec = self.index["fields"][field]
+            path = os.path.join(self.path, f"{field}.bin")
+            # Drop bytes of an append that crashed before its index update
+            with open(path, 'ab') as f:
+                f.truncate(start * np.dtype(spec["dtype"]).itemsize * int(np.prod(spec["shape"], dtype=np.int64)))
+                if field in arrays:
+                    values = np.asarray(arrays[field], dtype=spec["dtype"]).reshape((length,) + tuple(spec["shape"]))
+                else:
+                    values = np.full((length,) + tuple(spec["shape"]), False if field in MASK_FIELDS else np.nan,
+                                     dtype=spec["dtype"])
+                f.write(np.ascontiguousarray(values).tobytes())
+
+        video = {"video_id": video_id, "start": start, "length": length, "fps": fps, "labels": labels or {}}
+        self.index["videos"].append(video)
+        self.index["frames"] = start + length
+        self._write_index(self.path, self.index)
+        self._by_id[video_id] = video
+        self.starts = np.append(self.starts, start)
+        self.lengths = np.append(self.lengths, length)
+        self._arrays = {}   # re-map at the new size
+        return video
+
+class WindowDataset:
+    """Every full window of a DatasetStore; item i is a copied [length, ...] array."""
+    def __init__(self, store, length, stride=1, field='smoothed_keypoints'):
+        self.store = store
+        self.length = length
+        self.field = field
+        self.global_starts, self.video_indices = store.window_starts(length, stride)
+
+    def __len__(self):
+        return len(self.global_starts)
+
+    def __getitem__(self, i):
+        start = self.global_starts[i]
+        return np.array(self.store.array(self.field)[start:start + self.length])
+
+def pack_outputs(paths, store_path, fields=DEFAULT_FIELDS, labels=None):
+    """
+    Appends pipeline outputs (.json or .npz) to a store, creating it if needed.
+    Videos already in the store are skipped, so re-running after more videos
+    were processed only adds the new ones.
+    Args:
+        labels (dict): Optional video_id -> labels (any JSON value) stored in the index.
+    Returns:
+        number of videos added.
+    """
+    if os.path.exists(os.path.join(store_path, INDEX_FILE)):
+        store = DatasetStore(store_path)
+    else:
+        store = DatasetStore.create(store_path, fields)
+    labels = labels or {}
+    added = 0
+    for path in sorted(paths):
+        # Raw-only outputs derive smoothed/normalized keypoints here (see pose_archive.PoseResult)
+        source = PoseArchive(path).result() if path.endswith('.npz') else load_output(path)
+        video_id = source.get("video_id") or os.path.basename(path)
+        if video_id in store:
+            continue
+        arrays = {field: source[field] for field in store.fields if field in source}
+        store.append(video_id, arrays, fps=source.get("fps"), labels=labels.get(video_id))
+        added += 1
+    logger.info(f"Packed {added} new videos into {store_path} ({len(store)} videos, {store.frame_count} frames)")
+    return added
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack pipeline outputs into one memory-mapped training store")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    pack = sub.add_parser("pack", help="Append processed videos (skips ones already packed)")
+    pack.add_argument("input_dir", help="Directory of .json / .npz outputs")
+    pack.add_argument("store", help="Store directory (created if missing)")
+    pack.add_argument("--fields", default=",".join(DEFAULT_FIELDS),
+                      help=f"Fields to store when creating the store (default: {','.join(DEFAULT_FIELDS)})")
+    pack.add_argument("--labels", default=None, help="JSON file mapping video_id to its labels")
+
+    info = sub.add_parser("info", help="Summarize a store")
+    info.add_argument("store", help="Store directory")
+
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        labels = None
+        if args.labels:
+            with open(args.labels, 'r') as f:
+                labels = json.load(f)
+        paths = glob.glob(os.path.join(args.input_dir, "*.json")) + glob.glob(os.path.join(args.input_dir, "*.npz"))
+        pack_outputs(paths, args.store, args.fields.split(","), labels)
+    else:
+        store = DatasetStore(args.store)
+        lengths = store.lengths
+        print(f"{len(store)} videos, {store.frame_count} frames, fields: {', '.join(store.fields)}")
+        if len(lengths):
+            print(f"video length: min {lengths.min()}, median {int(np.median(lengths))}, max {lengths.max()} frames")
@@ -1,6 +1,4 @@
 
-import sys
-from unittest.mock import MagicMock
 import numpy as np
 import matplotlib.pyplot as plt
 import logging
@@ -9,34 +7,9 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# --- BLOCKER BYPASS: Mock Modules BEFORE import ---
-sys.modules['mmpose'] = MagicMock()
-sys.modules['mmpose.apis'] = MagicMock()
-sys.modules['mmcv'] = MagicMock()
-# --------------------------------------------------
-
-# Now it is safe to import
+# The 'stub' pose backend needs no MMPose install, so nothing has to be mocked
 from video_processor import PoseExtractor
-
-def generate_synthetic_squat(frames=100, noise_level=5.0):
-    """
-    Generates a synthetic 'squat' trajectory for a single keypoint (e.g., Hip Y).
-    """
-    t = np.linspace(0, 2*np.pi, frames)
-    # Squat movement: Go down (sin increases) then up
-    clean_movement = np.sin(t - np.pi/2) * 50 + 300 # Center around Y=300
-    
-    # Add Camera Jitter (High frequency noise)
-    noise = np.random.normal(0, noise_level, frames)
-    jittery_movement = clean_movement + noise
-    
-    # Construct Mock Keypoints [Frames, 17, 2]
-    # We will put this movement on the Left Hip (Index 11)
-    keypoints = np.zeros((frames, 17, 2))
-    keypoints[:, :, 0] = 100 # Constant X
-    keypoints[:, 11, 1] = jittery_movement
-    
-    return t, clean_movement, jittery_movement, keypoints
+from synthetic_data import generate_synthetic_squat
 
 def run_simulation():
     print("🚀 Starting Vision Pipeline Simulation...")
@@ -47,13 +20,8 @@ def run_simulation():
     t, clean, raw_y, raw_kps = generate_synthetic_squat(frames=frames, noise_level=3.0)
     print(f"✅ Generated {frames} frames of synthetic 'Squat' data with jitter.")
     
-    # 2. Initialize Processor using a trick to bypass super().__init__ which might use mmpose
-    # Actually, PoseExtractor.__init__ calls MMPoseInferencer. We mocked it, so it should be fine.
-    try:
-        extractor = PoseExtractor(mode='human', device='cpu')
-    except Exception as e:
-        print(f"⚠️  Note: MMPose load failed ({e}), creating bare object.")
-        extractor = object.__new__(PoseExtractor) 
+    # 2. Initialize Processor on the deterministic stub backend (no model weights needed)
+    extractor = PoseExtractor(device='cpu', backend='stub')
     
     # 3. Apply Smoothing (The Logic we want to test)
     print("RUNNING: Savitzky-Golay Smoothing...")
@@ -0,0 +1,194 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+import numpy as np
+from video_io import VideoFrameReader
+from instrumentation import NULL_RECORDER
+from adaptive_sampling import MotionGate, fill_skipped
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+class FrameBatchScheduler:
+    """
+    Packs frames submitted from any number of videos/threads into fixed-size
+    batches for a single model call, and routes each result back to its caller.
+
+    A batch is dispatched as soon as it holds `batch_size` frames, or when the
+    oldest frame in it has waited `max_wait` seconds, whichever comes first.
+    """
+    def __init__(self, infer_fn, batch_size=8, max_wait=0.05, max_pending=None, recorder=None):
+        """
+        Args:
+            infer_fn (callable): Takes a list of BGR frames, returns
+                (keypoints [N, 17, 2], scores [N, 17]).
+            batch_size (int): Maximum frames per model call.
+            max_wait (float): Maximum seconds a frame waits for its batch to fill.
+            max_pending (int): Queue bound; submit() blocks when it is full so
+                decoders cannot run arbitrarily far ahead of inference.
+            recorder (instrumentation.Recorder): Optional; times every model call
+                and records its per-frame latency under 'model'.
+        """
+        self.infer_fn = infer_fn
+        self.recorder = recorder or NULL_RECORDER
+        self.batch_size = max(1, int(batch_size))
+        self.max_wait = max_wait
+        self._queue = queue.Queue(maxsize=max_pending or self.batch_size * 4)
+        self.batches_run = 0
+        self.frames_run = 0
+        self._thread = threading.Thread(target=self._run, name="frame-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, frame):
+        """Queues one frame. Returns a Future resolving to (keypoints [17, 2], scores [17])."""
+        future = Future()
+        self._queue.put((frame, future))
+        return future
+
+    @property
+    def pending(self):
+        """Frames queued and not yet in a model call."""
+        return self._queue.qsize()
+
+    def close(self):
+        """Flushes pending frames and stops the worker thread."""
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        item = self._queue.get(timeout=remaining)
+                    else:
+                        item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        frames = [frame for frame, _ in batch]
+        try:
+            with self.recorder.stage('model', len(frames), per_frame=True):
+                keypoints, scores = self.infer_fn(frames)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        self.batches_run += 1
+        self.frames_run += len(batch)
+        for i, (_, future) in enumerate(batch):
+            future.set_result((keypoints[i], scores[i]))
+
+def _decode_and_submit(scheduler, reader, recorder=NULL_RECORDER, gate=None):
+    """
+    Decodes every frame of a video into the scheduler, keeping futures in frame order.
+    With a MotionGate only the frames it keeps are submitted; the others come back as NaN rows.
+    """
+    # 'decode' includes time blocked on a full scheduler queue (back-pressure)
+    with recorder.stage('decode') as stage:
+        frames = gate.iter_frames(reader) if gate is not None else ((i, frame) for i, (_, frame) in enumerate(reader))
+        futures = [scheduler.submit(frame) for _, frame in frames]
+        stage.frames = len(futures)
+
+    if not futures:
+        return np.zeros((0, 17, 2)), np.zeros((0, 17))
+
+    # Batches are shared with other videos, so this is time spent waiting on them
+    with recorder.stage('inference', len(futures)):
+        results = [f.result() for f in futures]
+    raw_keypoints = reader.to_source_coords(np.array([kps for kps, _ in results]))
+    scores = np.array([s for _, s in results])
+    if gate is not None:
+        raw_keypoints, scores = gate.expand(raw_keypoints, scores)
+        gate.log_summary(os.path.basename(reader.video_path))
+    return raw_keypoints, scores
+
+def process_videos_batched(extractor, video_paths, output_path_fn=None, batch_size=8, max_wait=0.05,
+                           decode_workers=4, ingest=None, recorder_fn=None, recorder=None, sampling=None):
+    """
+    Runs pose inference for many videos through one FrameBatchScheduler, so a
+    single model call can carry frames from several videos at once.
+    Args:
+        extractor: PoseExtractor on any backend (needs infer_frames and postprocess).
+        video_paths (list): Videos to process.
+        output_path_fn (callable): Maps a video path to its output path (None = don't save).
+        batch_size (int): Frames per model call.
+        max_wait (float): Max seconds to wait for a batch to fill.
+        decode_workers (int): Videos decoded concurrently.
+        ingest (dict): VideoFrameReader options (max_side, frame_stride, ...).
+        recorder_fn (callable): Maps a video path to its instrumentation.Recorder (None = no metrics).
+        recorder (instrumentation.Recorder): Job-level recorder for the shared model calls.
+        sampling (dict): MotionGate options (motion_threshold, max_skip) to skip inference
+            on low-motion frames; None runs every frame.
+    Yields:
+        (video_path, data_packet or None, error or None) as each video completes.
+    """
+    def run_one(video_path):
+        if not os.path.exists(video_path):
+            raise FileNotFoundError(f"Video {video_path} not found.")
+
+        recorder = (recorder_fn(video_path) if recorder_fn else None) or NULL_RECORDER
+        reader = VideoFrameReader(video_path, **(ingest or {}))
+        gate = MotionGate(**sampling) if sampling and sampling.get("motion_threshold") else None
+        cache = getattr(extractor, 'cache', None)
+        params = dict(extractor.cache_key["params"], **reader.params)
+        if gate is not None:
+            params["sampling"] = gate.params
+        cache_key = dict(extractor.cache_key, params=params)
+        with recorder.stage('cache_lookup'):
+            cached = cache.load(video_path, **cache_key) if cache is not None else None
+        if cached is not None:
+            raw_keypoints, scores = cached
+        else:
+            raw_keypoints, scores = _decode_and_submit(scheduler, reader, recorder, gate)
+            if cache is not None:
+                with recorder.stage('cache_store'):
+                    cache.store(video_path, raw_keypoints, scores, **cache_key)
+
+        inferred = None
+        if gate is not None:
+            with recorder.stage('interpolation', len(raw_keypoints)):
+                raw_keypoints, scores, inferred = fill_skipped(raw_keypoints, scores)
+        output_path = output_path_fn(video_path) if output_path_fn else None
+        return extractor.postprocess(video_path, raw_keypoints, scores, output_path, reader.output_info(), recorder,
+                                     inferred)
+
+    with FrameBatchScheduler(extractor.infer_frames, batch_size, max_wait, recorder=recorder) as scheduler:
+        with ThreadPoolExecutor(max_workers=max(1, decode_workers)) as pool:
+            futures = {pool.submit(run_one, v): v for v in video_paths}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result(), None
+                except Exception as e:
+                    yield futures[future], None, e
+
+        if scheduler.batches_run:
+            logger.info(f"Ran {scheduler.frames_run} frames in {scheduler.batches_run} batches "
+                        f"(avg {scheduler.frames_run / scheduler.batches_run:.1f} frames/call).")
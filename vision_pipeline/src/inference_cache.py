@@ -0,0 +1,201 @@
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import logging
+import argparse
+import threading
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Bump when the cached payload layout changes
+CACHE_VERSION = 2
+
+_digest_memo = {}
+_digest_lock = threading.Lock()
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    SHA-256 of a file's content. Memoized per (path, size, mtime) so a video
+    is hashed at most once per process.
+    """
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _digest_lock:
+        if memo_key in _digest_memo:
+            return _digest_memo[memo_key]
+
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    digest = h.hexdigest()
+
+    with _digest_lock:
+        _digest_memo[memo_key] = digest
+    return digest
+
+def model_fingerprint(model, framework_version=None):
+    """
+    Identifies the exact model behind a name: the weights' content hash when
+    `model` is a local file (e.g. yolov8s-pose.pt), otherwise the name itself,
+    combined with the framework version that resolves it.
+    """
+    ident = file_digest(model) if isinstance(model, str) and os.path.isfile(model) else str(model)
+    return hashlib.sha256(f"{ident}|{framework_version}".encode('utf-8')).hexdigest()[:16]
+
+def _slug(text):
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', str(text))[:64]
+
+class InferenceCache:
+    """
+    On-disk cache of raw pose-model output (keypoints + scores), keyed by the
+    video's content hash, backend, model fingerprint and inference parameters.
+
+    Extractors describe themselves with a `cache_key` dict (backend, model,
+    fingerprint, params) and call `cache.load(video, **cache_key)` /
+    `cache.store(video, keypoints, scores, **cache_key)`.
+
+    Layout: <cache_dir>/<backend>/<model>/<fingerprint>/<key>.npz
+    Entries for a model whose fingerprint changed live in a sibling directory
+    and are dropped by invalidate_stale(). Total size is bounded with LRU
+    eviction (entry mtime is refreshed on every hit).
+    """
+    def __init__(self, cache_dir, max_bytes=20 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = self._scan_size()
+        self.hits = 0
+        self.misses = 0
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.npz'):
+                    yield os.path.join(root, name)
+
+    def _scan_size(self):
+        total = 0
+        for path in self._entries():
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    def _entry_path(self, video_path, backend, model, fingerprint, params):
+        payload = json.dumps({
+            "video": file_digest(video_path),
+            "params": params or {},
+            "version": CACHE_VERSION,
+        }, sort_keys=True)
+        key = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, _slug(backend), _slug(model), fingerprint, f"{key}.npz")
+
+    def load(self, video_path, backend, model, fingerprint, params=None):
+        """Returns (raw_keypoints, scores) on a hit, None on a miss."""
+        path = self._entry_path(video_path, backend, model, fingerprint, params)
+        try:
+            with np.load(path) as data:
+                keypoints, scores = data['keypoints'], data['scores']
+            os.utime(path)  # LRU: mark as recently used
+        except (OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        logger.info(f"Inference cache hit for {os.path.basename(video_path)} ({backend}/{model})")
+        return keypoints, scores
+
+    def store(self, video_path, keypoints, scores, backend, model, fingerprint, params=None):
+        """Writes one entry atomically (safe with concurrent worker processes)."""
+        path = self._entry_path(video_path, backend, model, fingerprint, params)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            # Full precision, so a cache hit post-processes exactly what a fresh run would
+            np.savez(f, keypoints=np.asarray(keypoints, dtype=np.float64),
+                     scores=np.asarray(scores, dtype=np.float64),
+                     created=np.float64(time.time()))
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._size += os.path.getsize(path)
+            over_budget = self._size > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def evict(self):
+        """Removes least-recently-used entries until the cache fits in max_bytes."""
+        with self._lock:
+            entries = []
+            for path in self._entries():
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                    removed += 1
+                except OSError:
+                    pass
+            self._size = total
+
+        if removed:
+            logger.info(f"Evicted {removed} inference cache entries ({total / 1024 ** 2:.0f} MB remain)")
+
+    def invalidate_stale(self, backend, model, fingerprint):
+        """Drops cached entries of `backend`/`model` produced by any other model fingerprint."""
+        model_dir = os.path.join(self.cache_dir, _slug(backend), _slug(model))
+        if not os.path.isdir(model_dir):
+            return
+        for name in os.listdir(model_dir):
+            if name != fingerprint:
+                logger.info(f"Model {backend}/{model} changed; dropping cache entries for fingerprint {name}")
+                shutil.rmtree(os.path.join(model_dir, name), ignore_errors=True)
+        with self._lock:
+            self._size = self._scan_size()
+
+    def clear(self, backend=None, model=None):
+        """Removes all entries, or only those of one backend (and model)."""
+        target = self.cache_dir
+        if backend:
+            target = os.path.join(target, _slug(backend))
+            if model:
+                target = os.path.join(target, _slug(model))
+        if target == self.cache_dir:
+            for name in os.listdir(target):
+                shutil.rmtree(os.path.join(target, name), ignore_errors=True)
+        else:
+            shutil.rmtree(target, ignore_errors=True)
+        with self._lock:
+            self._size = self._scan_size()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or clear the pose inference cache")
+    parser.add_argument("cache_dir", help="Cache directory")
+    parser.add_argument("--clear", action="store_true", help="Remove entries (all, or filtered by --backend/--model)")
+    parser.add_argument("--backend", default=None, help="Limit --clear to one backend")
+    parser.add_argument("--model", default=None, help="Limit --clear to one model")
+
+    args = parser.parse_args()
+
+    cache = InferenceCache(args.cache_dir, max_bytes=float('inf'))
+    if args.clear:
+        cache.clear(args.backend, args.model)
+    print(f"{sum(1 for _ in cache._entries())} entries, {cache._size / 1024 ** 2:.1f} MB in {args.cache_dir}")
@@ -0,0 +1,311 @@
+import os
+import sys
+import time
+import queue
+import heapq
+import select
+import signal
+import struct
+import ctypes
+import ctypes.util
+import logging
+import argparse
+import threading
+from batch_runner import build_extractor, process_single_video, output_path_for, run_version, limit_threads
+from manifest_index import ManifestIndex, VIDEO_EXTENSIONS
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# inotify(7) event bits
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+_EVENT_HEADER = struct.Struct('iIII')   # wd, mask, cookie, len
+
+class InotifyWatcher:
+    """
+    Linux inotify through ctypes (no extra dependency): reports files created,
+    closed after writing or moved into the watched directories.
+    Raises OSError where inotify is unavailable; use PollingWatcher there.
+    """
+    def __init__(self, directories):
+        if not sys.platform.startswith('linux'):
+            raise OSError("inotify needs Linux")
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs = {}
+        for directory in directories:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+            self._dirs[wd] = directory
+
+    def events(self, timeout):
+        """
+        Paths touched within `timeout` seconds.
+        Returns:
+            (paths, overflowed); after an overflow events were lost and the caller should rescan.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return [], False
+        paths, overflowed = [], False
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return [], False
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + _EVENT_HEADER.size:offset + _EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += _EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                overflowed = True
+            elif wd in self._dirs and name:
+                paths.append(os.path.join(self._dirs[wd], os.fsdecode(name)))
+        return paths, overflowed
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher:
+    """Fallback for non-Linux hosts and network mounts: every poll_interval asks for a full rescan."""
+    def __init__(self, directories, poll_interval=10.0):
+        self.poll_interval = poll_interval
+
+    def events(self, timeout):
+        time.sleep(min(timeout, self.poll_interval))
+        return [], False
+
+    def close(self):
+        pass
+
+class IngestDaemon:
+    """
+    Watches input directories and processes each video as soon as it has
+    finished landing, with one warm extractor, so extraction overlaps with
+    downloads/uploads instead of waiting for a nightly batch_runner run.
+
+    A file is taken once its size and mtime have been stable for `settle`
+    seconds. Stable files wait in a priority queue (earlier input directories
+    first, then oldest first); at most `max_queue` are admitted at a time, the
+    rest stay as plain paths until there is room. Outcomes go to the manifest
+    index (see manifest_index.py) under the same pipeline version batch_runner
+    uses, so after a restart completed files are skipped and a file whose
+    content changed is redone.
+
+        daemon = IngestDaemon(['uploads/', 'downloads/'], 'out/', extractor, version, index)
+        daemon.run()         # until SIGINT/SIGTERM (or idle_exit seconds without work)
+    """
+    def __init__(self, input_dirs, output_dir, extractor, version, index, output_format='json', video_options=None,
+                 settle=5.0, poll_interval=10.0, rescan_interval=60.0, max_queue=64, idle_exit=None,
+                 extensions=VIDEO_EXTENSIONS, use_inotify=True):
+        self.input_dirs = [os.path.abspath(d) for d in input_dirs]
+        self.output_dir = output_dir
+        self.extractor = extractor
+        self.version = version
+        self.index = index
+        self.output_format = output_format
+        self.video_options = video_options or {}
+        self.settle = settle
+        self.rescan_interval = rescan_interval
+        self.idle_exit = idle_exit
+        self.extensions = tuple(extensions)
+        self.queue = queue.PriorityQueue(maxsize=max_queue)
+        self.stats = {"processed": 0, "failed": 0, "skipped": 0}
+        self._stop = threading.Event()
+        self._candidates = {}   # path -> (size, mtime_ns, unchanged since)
+        self._backlog = []      # heap of stable files waiting for queue room
+        self._seen = set()      # (path, size, mtime_ns) already queued in this run
+        self._busy = False
+        self._last_work = time.monotonic()
+
+        self.watcher = None
+        if use_inotify:
+            try:
+                self.watcher = InotifyWatcher(self.input_dirs)
+                logger.info(f"Watching {', '.join(self.input_dirs)} with inotify")
+            except OSError as e:
+                logger.warning(f"inotify unavailable ({e}), polling every {poll_interval:.0f}s instead")
+        if self.watcher is None:
+            self.watcher = PollingWatcher(self.input_dirs, poll_interval)
+            self.rescan_interval = poll_interval
+
+    def stop(self):
+        self._stop.set()
+
+    def _priority(self, path, mtime_ns):
+        return (self.input_dirs.index(os.path.dirname(path)), mtime_ns, path)
+
+    def _consider(self, path):
+        if not path.lower().endswith(self.extensions) or os.path.basename(path).startswith('.'):
+            return
+        if os.path.dirname(path) in self.input_dirs and path not in self._candidates:
+            self._candidates[path] = None
+
+    def _rescan(self):
+        for directory in self.input_dirs:
+            for entry in os.scandir(directory):
+                if entry.is_file():
+                    st = entry.stat()
+                    if (entry.path, st.st_size, st.st_mtime_ns) not in self._seen:
+                        self._consider(entry.path)
+
+    def _settle(self):
+        """Moves files whose size and mtime held still for `settle` seconds to the backlog."""
+        now = time.monotonic()
+        for path, previous in list(self._candidates.items()):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                del self._candidates[path]
+                continue
+            signature = (st.st_size, st.st_mtime_ns)
+            if previous is None or previous[:2] != signature:
+                self._candidates[path] = signature + (now,)
+            elif now - previous[2] >= self.settle and st.st_size > 0:
+                del self._candidates[path]
+                if (path,) + signature not in self._seen:
+                    self._seen.add((path,) + signature)
+                    heapq.heappush(self._backlog, self._priority(path, st.st_mtime_ns))
+
+    def _admit(self):
+        # Back-pressure: only as many files as the queue holds are handed to the worker
+        while self._backlog and not self.queue.full():
+            self.queue.put_nowait(heapq.heappop(self._backlog))
+
+    def _process(self, path):
+        output_path = output_path_for(path, self.output_dir, self.output_format)
+        try:
+            self.index.video_info(path, hash_contents=True)
+        except FileNotFoundError:
+            return
+        if self.index.is_done(path, self.version) and os.path.exists(output_path):
+            self.stats["skipped"] += 1
+            return
+        if os.path.exists(output_path):
+            # Not done under this version: the output is stale, so it is redone rather than skipped
+            logger.info(f"{os.path.basename(path)} has a stale output, redoing it.")
+            os.remove(output_path)
+
+        result = process_single_video(self.extractor, path, self.output_dir, output_format=self.output_format,
+                                      ingest=self.video_options)
+        if result["status"] == "skipped":
+            self.stats["skipped"] += 1
+            return
+        self.index.record(path, self.version, result["status"], result.get("output"), result.get("error"),
+                          result.get("seconds"))
+        self.stats["processed" if result["status"] == "done" else "failed"] += 1
+        logger.info(f"{result['status']} {os.path.basename(path)} in {result['seconds']:.1f}s "
+                    f"({self.queue.qsize() + len(self._backlog)} waiting)")
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                _, _, path = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            self._busy = True
+            try:
+                self._process(path)
+            finally:
+                self._busy = False
+                self._last_work = time.monotonic()
+                self.queue.task_done()
+
+    def _idle(self):
+        return (not self._busy and self.queue.empty() and not self._backlog and not self._candidates
+                and time.monotonic() - self._last_work >= self.idle_exit)
+
+    def run(self):
+        worker = threading.Thread(target=self._work, name='ingest-worker', daemon=True)
+        worker.start()
+        self._rescan()   # files that landed while the daemon was down
+        last_rescan = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                paths, overflowed = self.watcher.events(timeout=min(1.0, self.settle / 2) if self._candidates else 1.0)
+                for path in paths:
+                    self._consider(path)
+                if overflowed or time.monotonic() - last_rescan >= self.rescan_interval:
+                    self._rescan()
+                    last_rescan = time.monotonic()
+                self._settle()
+                self._admit()
+                if self.idle_exit is not None and self._idle():
+                    logger.info(f"No new videos for {self.idle_exit:.0f}s, exiting.")
+                    break
+        finally:
+            self._stop.set()
+            worker.join()
+            self.watcher.close()
+        logger.info(f"Ingest stopped: {self.stats['processed']} processed, {self.stats['skipped']} skipped, "
+                    f"{self.stats['failed']} failed")
+        return self.stats
+
+if __name__ == "__main__":
+    from pose_backends import available_backends
+    from autotune import tuned_settings
+
+    parser = argparse.ArgumentParser(description="Process videos as they land in watched directories")
+    parser.add_argument("--input_dir", "-i", action="append", required=True,
+                        help="Directory to watch (repeatable; earlier ones are processed first)")
+    parser.add_argument("--output_dir", "-o", required=True, help="Directory to save JSON/.npz output")
+    parser.add_argument("--format", "-f", choices=["json", "npz"], default="json", help="Output format")
+    parser.add_argument("--backend", "-b", choices=available_backends(), default=None,
+                        help="Pose backend (default: tuning profile, else mmpose)")
+    parser.add_argument("--model", "-m", default=None, help="Model for the backend (default: backend default)")
+    parser.add_argument("--device", "-d", default=None, help="Inference device (default: tuning profile, else cpu)")
+    parser.add_argument("--threads", "-t", type=int, default=None, help="CPU threads for inference")
+    parser.add_argument("--batch-size", type=int, default=None, help="Frames per model call (default: tuning profile, else 8)")
+    parser.add_argument("--max-side", type=int, default=None, help="Downscale frames to this longer side before inference")
+    parser.add_argument("--frame-stride", type=int, default=1, help="Run inference on every n-th frame")
+    parser.add_argument("--track", action="store_true", help="Follow one athlete (see tracking.py)")
+    parser.add_argument("--keyframe-interval", type=int, default=30, help="Frames between full-frame detections with --track")
+    parser.add_argument("--score-threshold", type=float, default=0.3, help="Drop keypoints scoring below this before smoothing")
+    parser.add_argument("--max-gap", type=int, default=10,
+                        help="Interpolate dropped runs up to this many frames; longer ones stay NaN")
+    parser.add_argument("--chunk-frames", type=int, default=None,
+                        help="Process long uploads in chunks of this many frames (bounded memory, resumable)")
+    parser.add_argument("--raw-only", action="store_true", help="Store only raw keypoints + scores (see README)")
+    parser.add_argument("--index", default=None, help="Manifest index (default: <output_dir>/manifest.sqlite)")
+    parser.add_argument("--settle", type=float, default=5.0, help="Seconds a file's size/mtime must hold still")
+    parser.add_argument("--poll-interval", type=float, default=10.0, help="Rescan interval without inotify")
+    parser.add_argument("--no-inotify", action="store_true", help="Always poll (e.g. NFS/SMB mounts)")
+    parser.add_argument("--max-queue", type=int, default=64, help="Stable files admitted to the work queue at once")
+    parser.add_argument("--idle-exit", type=float, default=None, help="Exit after this many seconds without new videos")
+    parser.add_argument("--no-tuning-profile", action="store_true", help="Ignore this host's autotune profile")
+
+    args = parser.parse_args()
+
+    requested_backend = args.backend or ("mmpose" if args.model else None)
+    tuned = {} if args.no_tuning_profile else tuned_settings(requested_backend)
+    backend = requested_backend or tuned.get("backend", "mmpose")
+    model = args.model or tuned.get("model")
+    if args.threads or tuned.get("threads"):
+        limit_threads(args.threads or tuned["threads"])
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    ingest = {"max_side": args.max_side, "frame_stride": args.frame_stride}
+    sampling = {"motion_threshold": 0.0, "max_skip": 4}
+    video_options = dict(ingest, batch_size=args.batch_size or tuned.get("batch_size", 8), track=args.track,
+                         keyframe_interval=args.keyframe_interval, chunk_frames=args.chunk_frames)
+    version = run_version(backend, model, args.format, args.track, args.keyframe_interval, args.score_threshold,
+                          args.max_gap, ingest, sampling, args.raw_only)
+
+    extractor = build_extractor(backend, model, args.device or tuned.get("device", "cpu"),
+                                score_threshold=args.score_threshold, max_gap=args.max_gap, raw_only=args.raw_only)
+    index = ManifestIndex(args.index or os.path.join(args.output_dir, "manifest.sqlite"))
+    daemon = IngestDaemon(args.input_dir, args.output_dir, extractor, version, index, args.format, video_options,
+                          settle=args.settle, poll_interval=args.poll_interval, max_queue=args.max_queue,
+                          idle_exit=args.idle_exit, use_inotify=not args.no_inotify)
+    # Finish the current video, then exit (a chunked one would resume anyway)
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: daemon.stop())
+    daemon.run()
+    index.close()
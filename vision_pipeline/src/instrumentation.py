@@ -0,0 +1,349 @@
+import os
+import sys
+import json
+import time
+import socket
+import bisect
+import logging
+import cProfile
+import threading
+import contextlib
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the per-frame latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+def max_rss_mb():
+    """High-water mark of this process's resident memory, in MB."""
+    if resource is None:
+        return 0.0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss / 1024 ** 2 if sys.platform == 'darwin' else rss / 1024
+
+class LatencyHistogram:
+    """Fixed-bucket histogram (Prometheus-compatible) of per-frame latencies."""
+    def __init__(self, counts=None, total=0.0, count=0):
+        self.counts = list(counts) if counts else [0] * (len(LATENCY_BUCKETS) + 1)  # last = +Inf
+        self.sum = total
+        self.count = count
+
+    def observe(self, seconds, n=1):
+        """Records n observations of `seconds` (e.g. every frame of a batch)."""
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += n
+        self.sum += seconds * n
+        self.count += n
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (inf if it is in the overflow bucket)."""
+        if not self.count:
+            return None
+        target, seen = q * self.count, 0
+        for bound, n in zip(LATENCY_BUCKETS + (float('inf'),), self.counts):
+            seen += n
+            if seen >= target:
+                return bound
+        return float('inf')
+
+    def to_dict(self):
+        return {"buckets": list(LATENCY_BUCKETS), "counts": self.counts, "sum": self.sum, "count": self.count,
+                "p50": self.quantile(0.5), "p90": self.quantile(0.9), "p99": self.quantile(0.99)}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["counts"], data["sum"], data["count"])
+
+class _Stage:
+    """Context manager timing one pass through a stage; `frames` may be updated inside the block."""
+    __slots__ = ('recorder', 'name', 'frames', 'per_frame', '_wall', '_cpu')
+
+    def __init__(self, recorder, name, frames, per_frame):
+        self.recorder = recorder
+        self.name = name
+        self.frames = frames
+        self.per_frame = per_frame
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self._wall
+        self.recorder._add(self.name, wall, time.process_time() - self._cpu, self.frames)
+        if self.per_frame and self.frames:
+            self.recorder.observe(self.name, wall / self.frames, self.frames)
+
+class Recorder:
+    """
+    Collects per-stage wall time, CPU time, frames, peak memory and per-frame
+    latency histograms for one unit of work (usually one video):
+
+        recorder = Recorder('squat_001.mp4')
+        with recorder.stage('inference', frames=len(batch), per_frame=True):
+            model(batch)
+        recorder.write_sidecar('squat_001.metrics.json')
+
+    CPU time is process-wide, so stages that overlap with other threads'
+    work (thread pools, the decode-ahead reader) include that work too.
+    Peak memory is the process high-water mark when the stage last finished.
+    """
+    enabled = True
+
+    def __init__(self, name=None):
+        self.name = name
+        self.started = time.time()
+        self.stages = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def stage(self, name, frames=0, per_frame=False):
+        """
+        Args:
+            frames (int): Frames handled by this pass.
+            per_frame (bool): Also add wall / frames to the stage's latency histogram.
+        """
+        return _Stage(self, name, frames, per_frame)
+
+    def iterate(self, name, iterable, count=None):
+        """
+        Yields from `iterable`, charging the time spent waiting for each item to
+        stage `name`. count(item) gives the frames per item (default 1).
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name) as stage:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                stage.frames = count(item) if count else 1
+            yield item
+
+    def observe(self, name, seconds, n=1):
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = LatencyHistogram()
+            self.histograms[name].observe(seconds, n)
+
+    def _add(self, name, wall, cpu, frames):
+        with self._lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = {"wall_s": 0.0, "cpu_s": 0.0, "calls": 0, "frames": 0, "peak_rss_mb": 0.0}
+            stats["wall_s"] += wall
+            stats["cpu_s"] += cpu
+            stats["calls"] += 1
+            stats["frames"] += frames
+            stats["peak_rss_mb"] = max(stats["peak_rss_mb"], max_rss_mb())
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "name": self.name,
+                "started": self.started,
+                "elapsed_s": time.time() - self.started,
+                "peak_rss_mb": max_rss_mb(),
+                "stages": {k: dict(v) for k, v in self.stages.items()},
+                "latency": {k: h.to_dict() for k, h in self.histograms.items()},
+            }
+
+    def write_sidecar(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+class _NullStage:
+    __slots__ = ('frames',)
+
+    def __init__(self):
+        self.frames = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return None
+
+class NullRecorder:
+    """Disabled recorder: every call is a no-op, so instrumented code pays (almost) nothing."""
+    enabled = False
+    _stage = _NullStage()
+
+    def stage(self, name, frames=0, per_frame=False):
+        return self._stage
+
+    def iterate(self, name, iterable, count=None):
+        return iterable
+
+    def observe(self, name, seconds, n=1):
+        pass
+
+    def to_dict(self):
+        return None
+
+    def write_sidecar(self, path):
+        pass
+
+NULL_RECORDER = NullRecorder()
+
+class StageTracker:
+    """
+    Recorder wrapper that reports every stage as it is entered to on_stage(name),
+    so a supervisor can tell where a video that hangs is stuck. Timing still goes
+    to the wrapped recorder (NULL_RECORDER for none).
+    """
+    def __init__(self, recorder, on_stage):
+        self.recorder = recorder
+        self.on_stage = on_stage
+        self.enabled = recorder.enabled
+
+    def stage(self, name, frames=0, per_frame=False):
+        self.on_stage(name)
+        return self.recorder.stage(name, frames, per_frame)
+
+    def iterate(self, name, iterable, count=None):
+        iterator = iter(self.recorder.iterate(name, iterable, count))
+        while True:
+            self.on_stage(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            yield item
+
+    def observe(self, name, seconds, n=1):
+        self.recorder.observe(name, seconds, n)
+
+    def to_dict(self):
+        return self.recorder.to_dict()
+
+    def write_sidecar(self, path):
+        self.recorder.write_sidecar(path)
+
+class JobMetrics:
+    """Aggregates per-video Recorder dicts into a job summary and a Prometheus textfile."""
+    def __init__(self, job='pose_pipeline'):
+        self.job = job
+        self.started = time.time()
+        self.videos = {}
+        self.stages = {}
+        self.histograms = {}
+        self.peak_rss_mb = 0.0
+
+    def add(self, metrics, status='done'):
+        """
+        Adds one video's Recorder.to_dict() (None for videos run without metrics).
+        status=None adds job-level metrics without counting a video.
+        """
+        if status:
+            self.videos[status] = self.videos.get(status, 0) + 1
+        if not metrics:
+            return
+        self.peak_rss_mb = max(self.peak_rss_mb, metrics.get("peak_rss_mb", 0.0))
+        for name, stats in metrics["stages"].items():
+            total = self.stages.setdefault(name, {"wall_s": 0.0, "cpu_s": 0.0, "calls": 0, "frames": 0,
+                                                   "peak_rss_mb": 0.0})
+            for key in ("wall_s", "cpu_s", "calls", "frames"):
+                total[key] += stats[key]
+            total["peak_rss_mb"] = max(total["peak_rss_mb"], stats["peak_rss_mb"])
+        for name, data in metrics["latency"].items():
+            self.histograms.setdefault(name, LatencyHistogram()).merge(LatencyHistogram.from_dict(data))
+
+    def summary(self):
+        elapsed = time.time() - self.started
+        stages = {}
+        for name, stats in self.stages.items():
+            stages[name] = dict(stats, fps=stats["frames"] / stats["wall_s"] if stats["wall_s"] > 0 else None)
+        return {
+            "job": self.job,
+            "host": socket.gethostname(),
+            "started": self.started,
+            "elapsed_s": elapsed,
+            "videos": dict(self.videos),
+            "peak_rss_mb": self.peak_rss_mb,
+            "stages": stages,
+            "latency": {k: h.to_dict() for k, h in self.histograms.items()},
+        }
+
+    def write_summary(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def log_summary(self):
+        total = sum(s["wall_s"] for s in self.stages.values()) or 1.0
+        for name, stats in sorted(self.stages.items(), key=lambda kv: -kv[1]["wall_s"]):
+            logger.info(f"  {name:<14} {stats['wall_s']:9.1f}s wall ({stats['wall_s'] / total:5.1%})  "
+                        f"{stats['cpu_s']:9.1f}s cpu  {stats['frames']:>9} frames")
+
+    def write_prometheus(self, path):
+        """
+        Writes the textfile-collector format read by node_exporter. The file is
+        replaced atomically so a scrape never sees it half-written.
+        """
+        prefix = self.job
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for labels, value in samples:
+                label_str = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"{prefix}_{name}{{{label_str}}} {value}" if label_str else f"{prefix}_{name} {value}")
+
+        metric("videos_total", "counter", "Videos by final status.",
+               [({"status": s}, n) for s, n in sorted(self.videos.items())])
+        metric("stage_seconds_total", "counter", "Wall-clock seconds spent per stage.",
+               [({"stage": s}, v["wall_s"]) for s, v in sorted(self.stages.items())])
+        metric("stage_cpu_seconds_total", "counter", "Process CPU seconds while each stage ran.",
+               [({"stage": s}, v["cpu_s"]) for s, v in sorted(self.stages.items())])
+        metric("stage_frames_total", "counter", "Frames handled per stage.",
+               [({"stage": s}, v["frames"]) for s, v in sorted(self.stages.items())])
+        metric("peak_rss_bytes", "gauge", "Highest resident memory of any worker.",
+               [({}, int(self.peak_rss_mb * 1024 ** 2))])
+
+        lines.append(f"# HELP {prefix}_frame_latency_seconds Per-frame latency by stage.")
+        lines.append(f"# TYPE {prefix}_frame_latency_seconds histogram")
+        for stage, hist in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS + ('+Inf',), hist.counts):
+                cumulative += n
+                lines.append(f'{prefix}_frame_latency_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_frame_latency_seconds_sum{{stage="{stage}"}} {hist.sum}')
+            lines.append(f'{prefix}_frame_latency_seconds_count{{stage="{stage}"}} {hist.count}')
+
+        metric("last_run_timestamp_seconds", "gauge", "When this job finished.", [({}, time.time())])
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+@contextlib.contextmanager
+def profiled(output_path=None):
+    """
+    Runs the enclosed block under cProfile and dumps the stats to output_path
+    (inspect with `python -m pstats` or snakeviz). The PID is logged so a
+    sampling profiler can be attached instead: `py-spy record --pid <pid>`.
+    """
+    logger.info(f"Profiling in PID {os.getpid()} -> {output_path or '(not saved)'}")
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if output_path:
+            profiler.dump_stats(output_path)
+            logger.info(f"Profile written to {output_path}")
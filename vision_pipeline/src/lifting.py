@@ -0,0 +1,213 @@
+import os
+import sys
+import time
+import logging
+import argparse
+import numpy as np
+from signal_processing import gate_and_fill
+from pose_archive import load_output, save_output
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# COCO input (what the 2D backends produce) and Human3.6M output joint symmetry
+COCO_LEFT, COCO_RIGHT = [1, 3, 5, 7, 9, 11, 13, 15], [2, 4, 6, 8, 10, 12, 14, 16]
+H36M_LEFT, H36M_RIGHT = [4, 5, 6, 11, 12, 13], [1, 2, 3, 14, 15, 16]
+# Camera orientation VideoPose3D uses to render custom videos (common/custom_dataset.py)
+RENDER_ORIENTATION = np.array([0.1407056450843811, -0.1500701755285263, -0.755240797996521, 0.6223280429840088],
+                              dtype=np.float32)
+RENDER_AZIMUTH = 70
+
+def normalize_screen_coordinates(keypoints, width, height):
+    """Pixels -> [-1, 1] along x with the aspect ratio kept, as VideoPose3D was trained on."""
+    return keypoints / width * 2 - np.array([1, height / width])
+
+def _import_videopose3d(videopose_root):
+    """Makes VideoPose3D's `common` package importable from a clone of the repository."""
+    if videopose_root and videopose_root not in sys.path:
+        sys.path.insert(0, os.path.abspath(videopose_root))
+
+class PoseLifter:
+    """
+    VideoPose3D's temporal convolution model, loaded once and run in-process on
+    many 2D sequences at a time:
+
+        lifter = PoseLifter('pretrained_h36m_detectron_coco.bin', videopose_root='VideoPose3D')
+        keypoints_3d = lifter.lift(keypoints_2d, width, height)      # [T, 17, 2] px -> [T, 17, 3]
+        lifted = lifter.lift_many(sequences, resolutions)           # batched over videos
+
+    Input is COCO-ordered pixel keypoints (PoseExtractor output); output is
+    root-relative camera-space joints in Human3.6M order, in metres.
+    """
+    def __init__(self, checkpoint, videopose_root=None, filter_widths=(3, 3, 3, 3, 3), channels=1024, device='cpu',
+                 window=1024, batch_size=8, flip_augment=True):
+        """
+        Args:
+            checkpoint (str): VideoPose3D checkpoint, e.g. pretrained_h36m_detectron_coco.bin.
+            videopose_root (str): Clone of facebookresearch/VideoPose3D (for `common.model`).
+            filter_widths (tuple): Architecture of the checkpoint (run.py's -arc 3,3,3,3,3).
+            channels (int): Conv channels of the checkpoint (run.py's -ch).
+            window (int): Output frames per model input; long videos are split into
+                windows overlapping by the receptive field, so results are exact.
+            batch_size (int): Windows per forward pass (from any mix of videos).
+            flip_augment (bool): Average with the horizontally flipped input, like run.py's evaluation.
+        """
+        import torch
+        _import_videopose3d(videopose_root)
+        from common.model import TemporalModel
+
+        self.torch = torch
+        self.device = device
+        self.window = window
+        self.batch_size = batch_size
+        self.flip_augment = flip_augment
+        self.model = TemporalModel(17, 2, 17, filter_widths=list(filter_widths), causal=False, dropout=0.25,
+                                   channels=channels)
+        state = torch.load(checkpoint, map_location='cpu')
+        self.model.load_state_dict(state['model_pos'])
+        self.model.to(device).eval()
+        self.pad = (self.model.receptive_field() - 1) // 2
+        logger.info(f"Loaded VideoPose3D from {checkpoint} (receptive field {self.model.receptive_field()} frames)")
+
+    def _forward(self, inputs):
+        """[B, W + 2 * pad, 17, 2] normalized inputs -> [B, W, 17, 3]."""
+        torch = self.torch
+        batch = torch.from_numpy(inputs.astype(np.float32)).to(self.device)
+        if self.flip_augment:
+            flipped = batch.clone()
+            flipped[..., 0] *= -1
+            flipped[:, :, COCO_LEFT + COCO_RIGHT] = flipped[:, :, COCO_RIGHT + COCO_LEFT]
+            batch = torch.cat([batch, flipped])
+        with torch.no_grad():
+            output = self.model(batch).cpu().numpy()
+        if self.flip_augment:
+            output, mirrored = np.split(output, 2)
+            mirrored[..., 0] *= -1
+            mirrored[:, :, H36M_LEFT + H36M_RIGHT] = mirrored[:, :, H36M_RIGHT + H36M_LEFT]
+            output = (output + mirrored) / 2
+        return output
+
+    def lift_many(self, sequences, resolutions):
+        """
+        Lifts several videos in shared batches.
+        Args:
+            sequences (list): [T_i, 17, 2] pixel keypoints per video (NaN gaps are interpolated first).
+            resolutions (list): (width, height) of each video.
+        Returns:
+            list of [T_i, 17, 3] arrays.
+        """
+        padded = []
+        for keypoints, (width, height) in zip(sequences, resolutions):
+            keypoints = np.asarray(keypoints, dtype=float)
+            if np.isnan(keypoints).any():
+                keypoints = np.nan_to_num(gate_and_fill(keypoints, np.ones(keypoints.shape[:2]), max_gap=None)[0])
+            normalized = normalize_screen_coordinates(keypoints, width, height)
+            padded.append(np.pad(normalized, ((self.pad, self.pad), (0, 0), (0, 0)), mode='edge')
+                          if len(normalized) else normalized)
+
+        # (video, first output frame, last output frame) for every window, similar lengths batched together
+        windows = [(i, start, min(start + self.window, len(seq)))
+                   for i, seq in enumerate(sequences) for start in range(0, len(seq), self.window)]
+        windows.sort(key=lambda w: w[2] - w[1], reverse=True)
+
+        results = [np.zeros((len(seq), 17, 3)) for seq in sequences]
+        for b in range(0, len(windows), self.batch_size):
+            group = windows[b:b + self.batch_size]
+            length = max(end - start for _, start, end in group)
+            inputs = np.stack([
+                # Frames past a video's end repeat its last frame; their outputs are discarded
+                np.pad(padded[i][start:end + 2 * self.pad], ((0, length - (end - start)), (0, 0), (0, 0)), mode='edge')
+                for i, start, end in group])
+            outputs = self._forward(inputs)
+            for (i, start, end), output in zip(group, outputs):
+                results[i][start:end] = output[:end - start]
+        return results
+
+    def lift(self, keypoints, width, height):
+        """Lifts one video: [T, 17, 2] pixel keypoints -> [T, 17, 3]."""
+        return self.lift_many([keypoints], [(width, height)])[0]
+
+def lift_outputs(paths, lifter, field='smoothed_keypoints', files_per_batch=64):
+    """
+    Adds `keypoints_3d` [T, 17, 3] to pipeline outputs (.json or .npz), in place.
+    Files are read, lifted together and rewritten in groups of files_per_batch.
+    Returns:
+        number of outputs lifted.
+    """
+    lifted = 0
+    for g in range(0, len(paths), files_per_batch):
+        group, packets = [], []
+        for path in paths[g:g + files_per_batch]:
+            packet = load_output(path)
+            if not packet.get('resolution') or field not in packet:
+                logger.warning(f"Skipping {path}: needs '{field}' and 'resolution'.")
+                continue
+            group.append(path)
+            packets.append(packet)
+
+        start = time.time()
+        results = lifter.lift_many([np.asarray(p[field]).reshape(-1, 17, 2) for p in packets],
+                                   [p['resolution'] for p in packets])
+        frames = sum(len(r) for r in results)
+        logger.info(f"Lifted {len(packets)} videos ({frames} frames) in {time.time() - start:.1f}s")
+
+        for path, packet, keypoints_3d in zip(group, packets, results):
+            packet['keypoints_3d'] = keypoints_3d
+            packet['keypoints_3d_layout'] = 'h36m'
+            save_output(packet, path)
+        lifted += len(packets)
+    return lifted
+
+def render_3d(video_path, keypoints_2d, keypoints_3d, output_path, fps, resolution, videopose_root=None, size=6):
+    """
+    Renders the input video next to the 3D skeleton with VideoPose3D's
+    render_animation (needs matplotlib and ffmpeg). Separate from lifting, so a
+    dataset can be lifted without paying for rendering.
+    """
+    _import_videopose3d(videopose_root)
+    from common.camera import camera_to_world
+    from common.h36m_dataset import h36m_skeleton
+    from common.visualization import render_animation
+    import copy
+
+    # Same 17-joint skeleton VideoPose3D's custom dataset derives from Human3.6M
+    skeleton = copy.deepcopy(h36m_skeleton)
+    skeleton.remove_joints([4, 5, 9, 10, 11, 16, 20, 21, 22, 23, 24, 28, 29, 30, 31])
+
+    prediction = camera_to_world(np.asarray(keypoints_3d, dtype=np.float32), R=RENDER_ORIENTATION, t=0)
+    prediction[:, :, 2] -= np.min(prediction[:, :, 2])
+    metadata = {'layout_name': 'coco', 'num_joints': 17, 'keypoints_symmetry': [COCO_LEFT, COCO_RIGHT]}
+    render_animation(np.asarray(keypoints_2d), metadata, {'Reconstruction': prediction}, skeleton, fps, 3000,
+                     RENDER_AZIMUTH, output_path, viewport=tuple(resolution), size=size, input_video_path=video_path)
+    logger.info(f"Rendered {output_path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lift 2D pipeline outputs to 3D with VideoPose3D, in-process")
+    parser.add_argument("inputs", nargs="+", help="Pipeline outputs (.json or .npz); keypoints_3d is added in place")
+    parser.add_argument("--checkpoint", "-c", required=True, help="VideoPose3D checkpoint (e.g. pretrained_h36m_detectron_coco.bin)")
+    parser.add_argument("--videopose-root", default="VideoPose3D", help="Clone of the VideoPose3D repository")
+    parser.add_argument("--arc", default="3,3,3,3,3", help="Filter widths of the checkpoint")
+    parser.add_argument("--field", default="smoothed_keypoints", help="2D field to lift")
+    parser.add_argument("--device", "-d", default="cpu", help="Inference device")
+    parser.add_argument("--batch-size", type=int, default=8, help="Windows per forward pass")
+    parser.add_argument("--window", type=int, default=1024, help="Output frames per window")
+    parser.add_argument("--no-flip", action="store_true", help="Skip flip test-time augmentation (2x faster)")
+    parser.add_argument("--render-dir", default=None, help="Also render each lifted video here (needs --video-dir)")
+    parser.add_argument("--video-dir", default=None, help="Directory of the source videos, for rendering")
+
+    args = parser.parse_args()
+
+    lifter = PoseLifter(args.checkpoint, args.videopose_root, [int(w) for w in args.arc.split(',')], device=args.device,
+                        window=args.window, batch_size=args.batch_size, flip_augment=not args.no_flip)
+    lift_outputs(args.inputs, lifter, args.field)
+
+    if args.render_dir:
+        os.makedirs(args.render_dir, exist_ok=True)
+        for path in args.inputs:
+            packet = load_output(path)
+            if 'keypoints_3d' not in packet:
+                continue
+            video_path = os.path.join(args.video_dir or '.', packet['video_id'])
+            output_path = os.path.join(args.render_dir, os.path.splitext(packet['video_id'])[0] + '_3d.mp4')
+            render_3d(video_path, np.asarray(packet[args.field]).reshape(-1, 17, 2), packet['keypoints_3d'],
+                      output_path, packet['fps'], packet['resolution'], args.videopose_root)
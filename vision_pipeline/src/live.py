@@ -0,0 +1,371 @@
+import os
+import sys
+import json
+import time
+import math
+import logging
+import argparse
+import threading
+import contextlib
+from collections import deque
+import numpy as np
+import cv2
+from signal_processing import normalize_keypoints
+from pose_backends import create_backend, available_backends
+from tracking import PoseTracker
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class OneEuroFilter:
+    """
+    Causal One-Euro filter (Casiez et al., CHI 2012), vectorised over any array
+    shape, e.g. [17, 2] keypoints. A low-pass filter whose cutoff rises with the
+    speed of the signal: heavy smoothing while a joint is still (jitter), little
+    lag when it moves fast.
+
+        f = OneEuroFilter(min_cutoff=1.0, beta=0.007)
+        smoothed = f(keypoints, timestamp, valid=scores >= 0.3)
+
+    Elements that are not `valid` keep their previous state (and output).
+    """
+    def __init__(self, min_cutoff=1.0, beta=0.007, d_cutoff=1.0):
+        """
+        Args:
+            min_cutoff (float): Cutoff (Hz) at rest. Lower = less jitter, more lag.
+            beta (float): Cutoff increase per unit/s of speed (pixels/s for keypoints).
+                Higher = less lag on fast movement.
+            d_cutoff (float): Cutoff (Hz) of the speed estimate.
+        """
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset()
+
+    def reset(self):
+        self._x = None
+        self._dx = None
+        self._t = None
+
+    @staticmethod
+    def _alpha(cutoff, dt):
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def __call__(self, x, t, valid=None):
+        """Filters one sample taken at time t (seconds). Returns the filtered array."""
+        x = np.asarray(x, dtype=float)
+        valid = np.isfinite(x) if valid is None else np.asarray(valid, dtype=bool)
+        if valid.ndim < x.ndim:
+            valid = valid[..., None]    # per-joint flags for [17, 2] coordinates
+        valid = np.broadcast_to(valid, x.shape) & np.isfinite(x)
+        if self._x is None:
+            self._x = np.where(valid, x, np.nan)
+            self._dx = np.zeros_like(x)
+            self._t = t
+            return self._x.copy()
+
+        dt = max(t - self._t, 1e-6)
+        self._t = t
+        fresh = valid & np.isnan(self._x)      # first valid sample of an element: start from it
+        update = valid & ~fresh
+
+        dx = np.where(update, (x - np.nan_to_num(self._x)) / dt, 0.0)
+        a_d = self._alpha(self.d_cutoff, dt)
+        dx_hat = a_d * dx + (1 - a_d) * self._dx
+        a = self._alpha(self.min_cutoff + self.beta * np.abs(dx_hat), dt)
+        x_hat = a * x + (1 - a) * np.nan_to_num(self._x)
+
+        self._x = np.where(update, x_hat, np.where(fresh, x, self._x))
+        self._dx = np.where(update, dx_hat, np.where(fresh, 0.0, self._dx))
+        return self._x.copy()
+
+class LiveSource:
+    """
+    Captures frames on a background thread into a short queue, stamped with the
+    capture time. The consumer always gets the oldest frame that is still within
+    the latency budget; staler frames are dropped, so a slow model falls back to
+    fewer, fresh frames instead of an ever-growing delay.
+
+    Sources: a camera index ('0'), a video file replayed at its own frame rate
+    (realtime=True, for testing without a camera), or a file that is still
+    being written (follow=True; waits for new frames until idle_timeout).
+    """
+    def __init__(self, source, realtime=False, follow=False, max_side=None, max_queue=8, idle_timeout=5.0):
+        self.source = int(source) if str(source).isdigit() else source
+        self.is_camera = isinstance(self.source, int)
+        self.realtime = realtime
+        self.follow = follow
+        self.max_side = max_side
+        self.max_queue = max(1, int(max_queue))
+        self.idle_timeout = idle_timeout
+        self.fps = None
+        self.resolution = None
+        self.scale = np.ones(2)
+        self.captured = 0
+        self.overflow = 0
+        self._frames = deque()
+        self._cond = threading.Condition()
+        self._done = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _open(self, position=0):
+        cap = cv2.VideoCapture(self.source)
+        if not cap.isOpened():
+            raise IOError(f"Could not open {self.source}")
+        if position:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, position)
+        return cap
+
+    def start(self):
+        cap = self._open()
+        self.fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        width, height = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.resolution = (width, height)
+        self._size = None
+        if self.max_side and max(width, height) > self.max_side:
+            ratio = self.max_side / float(max(width, height))
+            self._size = (max(1, int(round(width * ratio))), max(1, int(round(height * ratio))))
+            self.scale = np.array([self._size[0] / float(width), self._size[1] / float(height)])
+        self._thread = threading.Thread(target=self._capture, args=(cap,), name="live-capture", daemon=True)
+        self._thread.start()
+        return self
+
+    def _read_more(self, cap, position):
+        """For follow=True: reopens the file until frames past `position` appear or it stops growing."""
+        size, idle_since = -1, time.monotonic()
+        while not self._stop.is_set() and time.monotonic() - idle_since < self.idle_timeout:
+            time.sleep(0.05)
+            current = os.path.getsize(self.source)
+            if current == size:
+                continue
+            size, idle_since = current, time.monotonic()
+            cap.release()
+            cap = self._open(position)
+            ret, frame = cap.read()
+            if ret:
+                return cap, frame
+        return cap, None
+
+    def _capture(self, cap):
+        start = time.monotonic()
+        index = 0
+        try:
+            while not self._stop.is_set():
+                ret, frame = cap.read()
+                if not ret and self.follow and not self.is_camera:
+                    cap, frame = self._read_more(cap, index)
+                    ret = frame is not None
+                if not ret:
+                    break
+                media_time = index / self.fps
+                if self.realtime and not self.is_camera:
+                    # Replay: a frame is "captured" when its timestamp comes round
+                    delay = start + media_time - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                if self._size is not None:
+                    frame = cv2.resize(frame, self._size, interpolation=cv2.INTER_AREA)
+                captured_at = time.monotonic()
+                with self._cond:
+                    if len(self._frames) >= self.max_queue:
+                        self._frames.popleft()
+                        self.overflow += 1
+                    self._frames.append((index, media_time if not self.is_camera else captured_at - start,
+                                         captured_at, frame))
+                    self.captured += 1
+                    self._cond.notify()
+                index += 1
+        finally:
+            cap.release()
+            with self._cond:
+                self._done = True
+                self._cond.notify()
+
+    def get(self, budget=None):
+        """
+        Next frame to process as (index, media_time, captured_at, frame), or None at the end.
+        Returns:
+            frame tuple and the number of stale frames dropped to get it.
+        """
+        with self._cond:
+            while not self._frames and not self._done:
+                self._cond.wait(0.1)
+            if not self._frames:
+                return None, 0
+            dropped = 0
+            now = time.monotonic()
+            while budget is not None and len(self._frames) > 1 and now - self._frames[0][2] > budget:
+                self._frames.popleft()
+                dropped += 1
+            return self._frames.popleft(), dropped
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+class LivePoseRunner:
+    """
+    Per-frame pose for live feedback: inference, causal gating, One-Euro
+    smoothing and per-frame normalization, each frame emitted as soon as it is
+    ready. Reports end-to-end latency (capture to result) percentiles.
+
+        runner = LivePoseRunner(backend, latency_budget=0.1)
+        for result in runner.run(LiveSource('squat.mp4', realtime=True).start()):
+            ...
+    """
+    def __init__(self, backend, score_threshold=0.3, max_gap=10, min_cutoff=1.0, beta=0.007, latency_budget=0.1,
+                 track=False, keyframe_interval=30, window=10000):
+        """
+        Args:
+            backend (pose_backends.PoseBackend): Loaded backend.
+            score_threshold (float): Joints below this are not fed to the filter.
+            max_gap (int): Processed frames a gated joint keeps its last filtered position
+                before it is reported missing (null).
+            min_cutoff, beta (float): One-Euro parameters (see OneEuroFilter).
+            latency_budget (float): Target seconds from capture to result. Frames that could no
+                longer make it (given the recent processing time) are dropped while newer ones wait.
+            track (bool): Follow one athlete with tracking.PoseTracker.
+            window (int): Latency percentiles cover the last this many frames.
+        """
+        self.backend = backend
+        self.score_threshold = score_threshold
+        self.max_gap = max_gap
+        self.latency_budget = latency_budget
+        self.filter = OneEuroFilter(min_cutoff, beta)
+        self.tracker = PoseTracker(backend, keyframe_interval) if track else None
+        self.latencies = deque(maxlen=window)
+        self.processed = 0
+        self.dropped = 0
+        self._since_valid = None
+        self._process_time = 0.0   # running estimate of inference + filtering time per frame
+        self._started = None
+
+    def process(self, frame, media_time, scale=None):
+        """Pose for one frame. Returns (keypoints, normalized, scores, missing) in source pixels."""
+        if self.tracker is not None:
+            keypoints, scores = self.tracker.infer([frame])
+        else:
+            keypoints, scores = self.backend.infer([frame])
+        keypoints, scores = keypoints[0], scores[0]
+        if scale is not None:
+            keypoints = keypoints / scale
+
+        valid = scores >= self.score_threshold
+        self._since_valid = np.where(valid, 0, (self._since_valid if self._since_valid is not None
+                                                else np.full(len(valid), self.max_gap + 1)) + 1)
+        filtered = self.filter(keypoints, media_time, valid)
+        missing = (self._since_valid > self.max_gap) | np.isnan(filtered).any(axis=-1)
+        filtered[missing] = np.nan
+        return filtered, normalize_keypoints(filtered[None])[0], scores, missing
+
+    def run(self, source):
+        """Yields one result dict per processed frame until the source ends."""
+        self._started = time.monotonic()
+        while True:
+            # A frame is stale if it could not be finished within the budget anymore
+            budget = max(0.0, self.latency_budget - self._process_time) if self.latency_budget is not None else None
+            item, dropped = source.get(budget)
+            self.dropped += dropped
+            if item is None:
+                break
+            index, media_time, captured_at, frame = item
+            started = time.monotonic()
+            keypoints, normalized, scores, missing = self.process(frame, media_time, source.scale)
+            finished = time.monotonic()
+            self._process_time = 0.8 * self._process_time + 0.2 * (finished - started) if self.processed else \
+                finished - started
+            latency = finished - captured_at
+            self.latencies.append(latency)
+            self.processed += 1
+            yield {"frame": index, "time": media_time, "latency_ms": latency * 1000.0,
+                   "keypoints": keypoints, "normalized": normalized, "scores": scores, "missing": missing}
+
+    def stats(self, source=None):
+        """Frames processed/dropped, achieved fps and end-to-end latency percentiles (ms)."""
+        elapsed = time.monotonic() - self._started if self._started else 0.0
+        dropped = self.dropped + (source.overflow if source is not None else 0)
+        stats = {"processed": self.processed, "dropped": dropped,
+                 "drop_ratio": dropped / max(1, self.processed + dropped),
+                 "fps": self.processed / elapsed if elapsed else 0.0}
+        if self.latencies:
+            p50, p90, p99 = np.percentile(np.array(self.latencies) * 1000.0, [50, 90, 99]).tolist()
+            stats.update(latency_p50_ms=p50, latency_p90_ms=p90, latency_p99_ms=p99,
+                         latency_max_ms=max(self.latencies) * 1000.0)
+        return stats
+
+def _format_stats(stats):
+    text = f"{stats['processed']} frames at {stats['fps']:.1f} fps, {stats['dropped']} dropped ({stats['drop_ratio']:.1%})"
+    if "latency_p50_ms" in stats:
+        text += (f", latency p50 {stats['latency_p50_ms']:.0f} ms / p90 {stats['latency_p90_ms']:.0f} ms"
+                 f" / p99 {stats['latency_p99_ms']:.0f} ms")
+    return text
+
+def _to_json(result):
+    """NDJSON line for a result; NaN (missing joints) becomes null."""
+    def clean(values):
+        return [clean(v) for v in values] if isinstance(values, list) else (None if values != values else values)
+    return json.dumps({k: clean(v.tolist()) if isinstance(v, np.ndarray) else v for k, v in result.items()})
+
+if __name__ == "__main__":
+    from autotune import tuned_settings
+
+    parser = argparse.ArgumentParser(description="Live pose with causal smoothing: camera, growing file or real-time replay")
+    parser.add_argument("--source", "-s", required=True, help="Camera index (e.g. 0) or video file")
+    parser.add_argument("--replay", action="store_true", help="Play a file at its real frame rate, like a camera")
+    parser.add_argument("--follow", action="store_true", help="The file is still being written: wait for new frames")
+    parser.add_argument("--output", "-o", default=None, help="Write one JSON line per frame here ('-' = stdout)")
+    parser.add_argument("--backend", "-b", choices=available_backends(), default=None,
+                        help="Pose backend (default: tuning profile, else mmpose)")
+    parser.add_argument("--model", "-m", default=None, help="Model for the backend (default: backend default)")
+    parser.add_argument("--device", "-d", default=None, help="Inference device (default: tuning profile, else cpu)")
+    parser.add_argument("--no-tuning-profile", action="store_true", help="Ignore this host's autotune profile")
+    parser.add_argument("--max-side", type=int, default=None, help="Downscale frames to this longer side before inference")
+    parser.add_argument("--latency-budget-ms", type=float, default=100.0,
+                        help="Drop captured frames that waited longer than this (default: 100)")
+    parser.add_argument("--min-cutoff", type=float, default=1.0, help="One-Euro cutoff at rest, Hz (lower = smoother)")
+    parser.add_argument("--beta", type=float, default=0.007, help="One-Euro speed coefficient (higher = less lag)")
+    parser.add_argument("--score-threshold", type=float, default=0.3, help="Ignore keypoints scoring below this")
+    parser.add_argument("--max-gap", type=int, default=10, help="Frames a low-score joint is held before it is reported missing")
+    parser.add_argument("--track", action="store_true", help="Follow one athlete (detect on keyframes, crop in between)")
+    parser.add_argument("--keyframe-interval", type=int, default=30, help="Frames between full-frame detections with --track")
+    parser.add_argument("--stats-every", type=float, default=5.0, help="Log throughput and latency every N seconds")
+    parser.add_argument("--metrics", default=None, help="Write the final stats to this JSON file")
+
+    args = parser.parse_args()
+
+    requested_backend = args.backend or ("mmpose" if args.model else None)
+    tuned = {} if args.no_tuning_profile else tuned_settings(requested_backend)
+    backend = create_backend(requested_backend or tuned.get("backend", "mmpose"), args.model or tuned.get("model"),
+                             args.device or tuned.get("device", "cpu"), warmup=True)
+    runner = LivePoseRunner(backend, args.score_threshold, args.max_gap, args.min_cutoff, args.beta,
+                            args.latency_budget_ms / 1000.0, args.track, args.keyframe_interval)
+    source = LiveSource(args.source, realtime=args.replay, follow=args.follow, max_side=args.max_side).start()
+    logger.info(f"Live from {args.source} ({source.resolution[0]}x{source.resolution[1]} @ {source.fps:.1f} fps)")
+
+    if args.output in (None, '-'):
+        sink = contextlib.nullcontext(sys.stdout if args.output == '-' else None)
+    else:
+        sink = open(args.output, 'w')
+    last_report = time.monotonic()
+    try:
+        with sink as out:
+            for result in runner.run(source):
+                if out is not None:
+                    out.write(_to_json(result) + '\n')
+                    out.flush()
+                if time.monotonic() - last_report >= args.stats_every:
+                    logger.info(_format_stats(runner.stats(source)))
+                    last_report = time.monotonic()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        source.stop()
+        stats = runner.stats(source)
+        logger.info(f"Live session: {_format_stats(stats)}")
+        if args.metrics:
+            with open(args.metrics, 'w') as f:
+                json.dump(stats, f, indent=2)
@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import logging
+import argparse
+import threading
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    digest TEXT,
+    duration REAL,
+    fps REAL,
+    width INTEGER,
+    height INTEGER,
+    frame_count INTEGER,
+    codec TEXT,
+    scanned_at REAL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    path TEXT,
+    version TEXT,
+    status TEXT,
+    digest TEXT,
+    output TEXT,
+    error TEXT,
+    seconds REAL,
+    updated_at REAL,
+    PRIMARY KEY (path, version)
+);
+"""
+
+_VIDEO_COLUMNS = ('path', 'size', 'mtime_ns', 'digest', 'duration', 'fps', 'width', 'height', 'frame_count', 'codec',
+                  'scanned_at')
+
+def pipeline_version(**settings):
+    """Short stable id for the settings that change a video's output (backend, model, gating, ...)."""
+    text = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:12]
+
+class ManifestIndex:
+    """
+    Persistent SQLite index of a video collection: size, mtime, content hash
+    and container metadata per video, plus processing status per pipeline
+    version. Rescans are incremental: a file whose size and mtime are unchanged
+    is neither hashed nor opened again.
+
+        index = ManifestIndex('out/manifest.sqlite')
+        index.scan('videos/')                          # added / changed / unchanged / removed
+        for video in index.videos('videos/'):          # longest first
+            if index.is_done(video['path'], version): ...
+        index.record(path, version, 'done', output='out/x.json')
+    """
+    def __init__(self, path):
+        self.path = path
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _row(self, path):
+        row = self._conn.execute("SELECT * FROM videos WHERE path = ?", (os.path.abspath(path),)).fetchone()
+        return dict(row) if row is not None else None
+
+    def _describe(self, path, st, hash_contents):
+        """Probes and (optionally) hashes one file; the only place videos are opened."""
+        from video_io import try_probe_video
+        from inference_cache import file_digest
+
+        info = try_probe_video(path) or {}
+        fps, frames = info.get('fps'), info.get('frame_count')
+        return {
+            'path': os.path.abspath(path),
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'digest': file_digest(path) if hash_contents else None,
+            'duration': frames / fps if fps and frames else None,
+            'fps': fps,
+            'width': info.get('width'),
+            'height': info.get('height'),
+            'frame_count': frames,
+            'codec': info.get('codec'),
+            'scanned_at': time.time(),
+        }
+
+    def _upsert(self, row):
+        self._conn.execute(f"INSERT OR REPLACE INTO videos ({', '.join(_VIDEO_COLUMNS)}) "
+                           f"VALUES ({', '.join('?' * len(_VIDEO_COLUMNS))})", [row[c] for c in _VIDEO_COLUMNS])
+
+    def scan(self, input_dir, extensions=VIDEO_EXTENSIONS, hash_contents=True):
+        """
+        Brings the index up to date with the videos directly in input_dir.
+        Only new files and files whose size or mtime changed are probed/hashed;
+        entries for deleted files are dropped.
+        Returns:
+            dict with 'added', 'changed', 'unchanged' and 'removed' counts.
+        """
+        counts = {'added': 0, 'changed': 0, 'unchanged': 0, 'removed': 0}
+        root = os.path.abspath(input_dir)
+        with self._lock:
+            known = {row['path']: (row['size'], row['mtime_ns'])
+                     for row in self._conn.execute("SELECT path, size, mtime_ns FROM videos")
+                     if os.path.dirname(row['path']) == root}
+            seen = set()
+            with self._conn:
+                for entry in os.scandir(root):
+                    if not entry.is_file() or not entry.name.endswith(tuple(extensions)):
+                        continue
+                    path = os.path.join(root, entry.name)
+                    seen.add(path)
+                    st = entry.stat()
+                    if known.get(path) == (st.st_size, st.st_mtime_ns):
+                        counts['unchanged'] += 1
+                        continue
+                    counts['changed' if path in known else 'added'] += 1
+                    self._upsert(self._describe(path, st, hash_contents))
+
+                removed = [path for path in known if path not in seen]
+                for path in removed:
+                    self._conn.execute("DELETE FROM videos WHERE path = ?", (path,))
+                    self._conn.execute("DELETE FROM runs WHERE path = ?", (path,))
+                counts['removed'] = len(removed)
+        logger.info(f"Indexed {input_dir}: {counts['added']} added, {counts['changed']} changed, "
+                    f"{counts['unchanged']} unchanged, {counts['removed']} removed")
+        return counts
+
+    def videos(self, input_dir=None, longest_first=True):
+        """Indexed videos (optionally only those directly in input_dir) as dicts, longest duration first."""
+        rows = [dict(row) for row in self._conn.execute("SELECT * FROM videos")]
+        if input_dir is not None:
+            root = os.path.abspath(input_dir)
+            rows = [row for row in rows if os.path.dirname(row['path']) == root]
+        # Unreadable videos (no duration) go last, larger files first among them
+        key = (lambda row: (row['duration'] or 0.0, row['size'])) if longest_first else (lambda row: row['path'])
+        return sorted(rows, key=key, reverse=longest_first)
+
+    def video_info(self, path, hash_contents=False):
+        """
+        probe_video()-style metadata (fps, width, height, frame_count, codec) from
+        the index; the file is only opened when it is new or changed.
+        """
+        st = os.stat(path)
+        with self._lock:
+            row = self._row(path)
+            if row is None or (row['size'], row['mtime_ns']) != (st.st_size, st.st_mtime_ns):
+                row = self._describe(path, st, hash_contents)
+                with self._conn:
+                    self._upsert(row)
+        return {k: row[k] for k in ('fps', 'width', 'height', 'frame_count', 'codec')}
+
+    def record(self, path, version, status, output=None, error=None, seconds=None):
+        """Stores the outcome of processing `path` under a pipeline version, with the content hash it had."""
+        path = os.path.abspath(path)
+        with self._lock, self._conn:
+            row = self._row(path)
+            self._conn.execute("INSERT OR REPLACE INTO runs (path, version, status, digest, output, error, seconds, "
+                               "updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                               (path, version, status, row['digest'] if row else None, output, error, seconds,
+                                time.time()))
+
+    def run(self, path, version):
+        row = self._conn.execute("SELECT * FROM runs WHERE path = ? AND version = ?",
+                                 (os.path.abspath(path), version)).fetchone()
+        return dict(row) if row is not None else None
+
+    def is_done(self, path, version):
+        """True if `path` was processed under `version` and its content has not changed since."""
+        run = self.run(path, version)
+        row = self._row(path)
+        return bool(run and row and run['status'] == 'done' and run['digest'] == row['digest'])
+
+    def changed_since_run(self, path):
+        """True if the video was processed before (under any version) and its content differs now."""
+        row = self._row(path)
+        digests = {r['digest'] for r in self._conn.execute("SELECT digest FROM runs WHERE path = ? AND status = 'done'",
+                                                           (os.path.abspath(path),))}
+        return bool(row and digests and row['digest'] not in digests)
+
+    def status(self):
+        """Video count, total duration and per-version run counts."""
+        videos = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(duration), 0), COALESCE(SUM(size), 0) "
+                                    "FROM videos").fetchone()
+        runs = {}
+        for row in self._conn.execute("SELECT version, status, COUNT(*) AS n FROM runs GROUP BY version, status"):
+            runs.setdefault(row['version'], {})[row['status']] = row['n']
+        return {'videos': videos[0], 'hours': videos[1] / 3600.0, 'bytes': videos[2], 'runs': runs}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incremental SQLite index of a video collection")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    scan = sub.add_parser("scan", help="Add new/changed videos to the index, drop deleted ones")
+    scan.add_argument("index", help="Index file (e.g. out/manifest.sqlite)")
+    scan.add_argument("--input_dir", "-i", required=True, help="Directory containing video files")
+    scan.add_argument("--no-hash", action="store_true", help="Skip content hashing (faster, no change detection by content)")
+
+    status = sub.add_parser("status", help="Summarize the index")
+    status.add_argument("index", help="Index file")
+    status.add_argument("--list", action="store_true", help="Also list videos, longest first")
+
+    args = parser.parse_args()
+
+    with ManifestIndex(args.index) as index:
+        if args.command == "scan":
+            index.scan(args.input_dir, hash_contents=not args.no_hash)
+        else:
+            summary = index.status()
+            print(f"{summary['videos']} videos, {summary['hours']:.1f} h, {summary['bytes'] / 1024 ** 3:.1f} GB")
+            for version, counts in sorted(summary['runs'].items()):
+                print(f"  pipeline {version}: " + ", ".join(f"{n} {s}" for s, n in sorted(counts.items())))
+            if args.list:
+                for video in index.videos():
+                    duration = f"{video['duration']:.1f}s" if video['duration'] else "unreadable"
+                    print(f"  {duration:>10}  {video['width']}x{video['height']} @ {video['fps']} fps  "
+                          f"{video['codec']}  {video['path']}")
@@ -1,16 +1,17 @@
-import cv2
 import numpy as np
-from mmpose.apis import MMPoseInferencer
 import shutil
 import os
+from pose_backends import create_backend
+from video_io import VideoFrameReader, iter_frame_batches
 
 class VisionPipeline:
-    def __init__(self, output_dir="output_data"):
+    def __init__(self, output_dir="output_data", backend='mmpose', model=None, device='cpu', batch_size=8):
         self.output_dir = output_dir
+        self.batch_size = batch_size
         os.makedirs(self.output_dir, exist_ok=True)
-        # Load the SOTA model (RTMPose-Large)
+        # Load the SOTA model (RTMPose-Large by default) once, through the backend registry
         print("Loading AI Models...")
-        self.inferencer = MMPoseInferencer('human')
+        self.backend = create_backend(backend, model, device, warmup=True)
     
     def process_video(self, video_path):
         """
@@ -19,29 +20,20 @@ class VisionPipeline:
         print(f"Processing: {video_path}")
         video_name = os.path.splitext(os.path.basename(video_path))[0]
         
-        # 1. Run Inference (Video -> Raw Keypoints)
-        # returns variable is a generator
-        result_generator = self.inferencer(video_path, return_vis=True)
-        
+        # 1. Run Inference (Video -> Raw Keypoints), a batch of frames per model call
         all_keypoints = []
         all_scores = []
         
         # 2. Extract Data Frame-by-Frame
-        for i, result in enumerate(result_generator):
-            # result is a dictionary containing 'predictions' and 'visualization'
-            predictions = result['predictions']
-            
-            # Assuming single person for now (index 0)
-            if predictions and len(predictions) > 0:
-                keypoints = predictions[0]['keypoints'] # List of [x, y] coordinates
-                scores = predictions[0]['keypoint_scores']
-                
-                all_keypoints.append(keypoints)
-                all_scores.append(scores)
-            else:
-                # Handle missing detection (interpolation needed later)
-                all_keypoints.append([]) 
-                all_scores.append([])
+        for _, frames in iter_frame_batches(VideoFrameReader(video_path), self.batch_size):
+            # Assuming single person for now (first detection).
+            # Missing detections stay NaN (interpolation needed later)
+            keypoints, scores = self.backend.infer(frames, fill_value=np.nan)
+            all_keypoints.append(keypoints)
+            all_scores.append(scores)
+
+        all_keypoints = np.concatenate(all_keypoints) if all_keypoints else np.zeros((0, 17, 2))
+        all_scores = np.concatenate(all_scores) if all_scores else np.zeros((0, 17))
 
         # 3. Save Raw Signal (The "handoff" to Data Team)
         save_path = os.path.join(self.output_dir, f"{video_name}_raw.npy")
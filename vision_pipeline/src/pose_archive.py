@@ -0,0 +1,322 @@
+import os
+import json
+import struct
+import zipfile
+import logging
+import argparse
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Array fields of a processed video, all indexed [Frames, ...]
+KEYPOINT_FIELDS = ('raw_keypoints', 'smoothed_keypoints', 'normalized_keypoints')
+# keypoints_3d [Frames, 17, 3] (Human3.6M joint order) is added by lifting.py
+ARRAY_FIELDS = KEYPOINT_FIELDS + ('scores', 'keypoints_3d')
+# Boolean fields, stored as bool arrays in .npz: inferred [Frames], missing [Frames, 17]
+MASK_FIELDS = ('inferred', 'missing')
+# Computed from raw_keypoints + scores by post-processing; raw-only outputs leave them out (see PoseResult)
+DERIVED_FIELDS = ('smoothed_keypoints', 'normalized_keypoints', 'missing')
+# Parameters of that post-processing, stored under "postprocess" (see signal_processing.postprocess_params)
+POSTPROCESS_SETTINGS = ('score_threshold', 'max_gap', 'window_length', 'polyorder')
+META_MEMBER = '__meta__'
+
+def packet_meta(video_path, frame_count, video_info=None, postprocess=None):
+    """The non-array fields of a data packet (see make_data_packet), in output order."""
+    video_info = video_info or {}
+    resolution = [video_info['width'], video_info['height']] if video_info.get('width') else None
+    meta = {
+        "video_id": os.path.basename(video_path),
+        "frame_count": frame_count,
+        "fps": video_info.get('fps'),
+        "resolution": resolution,
+    }
+    # Present when frames were strided/trimmed at ingestion (see video_io.VideoFrameReader)
+    for key in ('source_fps', 'frame_stride', 'start_frame'):
+        if key in video_info:
+            meta[key] = video_info[key]
+    if postprocess is not None:
+        meta["postprocess"] = postprocess
+    return meta
+
+def make_data_packet(video_path, raw_keypoints, smoothed_keypoints, normalized_keypoints, scores, video_info=None,
+                     inferred=None, missing=None, postprocess=None):
+    """
+    Assembles the per-video output dict shared by every extractor.
+    Args:
+        video_info (dict): Optional probe_video() / VideoFrameReader.output_info() result;
+            adds fps (effective, after any frame stride) and source resolution.
+        inferred (np.ndarray): Optional [Frames] bool mask from adaptive sampling:
+            True where the model ran, False where keypoints were interpolated.
+        missing (np.ndarray): Optional [Frames, 17] bool mask from confidence gating:
+            joints left NaN in the smoothed/normalized keypoints.
+        postprocess (dict): signal_processing.postprocess_params() the derived fields were made with.
+    Passing None for smoothed/normalized keypoints (and missing) gives a raw-only packet.
+    """
+    packet = packet_meta(video_path, len(raw_keypoints), video_info, postprocess)
+    packet["raw_keypoints"] = raw_keypoints
+    if smoothed_keypoints is not None:
+        packet["smoothed_keypoints"] = smoothed_keypoints # Optional: keep raw for debug
+    if normalized_keypoints is not None:
+        packet["normalized_keypoints"] = normalized_keypoints
+    packet["scores"] = scores
+    if inferred is not None:
+        inferred = np.asarray(inferred, dtype=bool)
+        packet["inferred"] = inferred
+        packet["skip_ratio"] = float(1.0 - inferred.mean()) if len(inferred) else 0.0
+    if missing is not None:
+        packet["missing"] = np.asarray(missing, dtype=bool)
+    return packet
+
+def json_safe(value):
+    """Arrays to lists and NaN (joints missing after gating) to null, so JSON outputs are strict JSON."""
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    if isinstance(value, (list, tuple)):
+        return [json_safe(v) for v in value]
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+def save_output(data_packet, output_path):
+    """Writes a data packet as .npz (typed arrays) or JSON, chosen by the file extension."""
+    if output_path.endswith('.npz'):
+        save_npz(data_packet, output_path)
+    else:
+        packet = {k: json_safe(v) for k, v in data_packet.items()}
+        with open(output_path, 'w') as f:
+            json.dump(packet, f, allow_nan=False)
+    logger.info(f"Saved processed data to {output_path}")
+
+def save_npz(data_packet, output_path):
+    """
+    Writes the array fields as float32 members of an *uncompressed* .npz, plus a
+    small JSON metadata member. Members are stored, not deflated, so PoseArchive
+    can memory-map them in place; np.load() also reads the file as usual.
+    """
+    # Stored fields only: a raw-only PoseResult stays raw-only
+    stored = data_packet.keys()
+    meta = {k: v for k, v in data_packet.items() if k not in ARRAY_FIELDS + MASK_FIELDS}
+    arrays = {k: np.asarray(data_packet[k], dtype=np.float32) for k in ARRAY_FIELDS if k in stored}
+    arrays.update({k: np.asarray(data_packet[k], dtype=bool) for k in MASK_FIELDS if k in stored})
+    arrays[META_MEMBER] = np.frombuffer(json.dumps(meta).encode('utf-8'), dtype=np.uint8)
+    np.savez(output_path, **arrays)
+
+class PoseArchive:
+    """
+    Lazy, memory-mapped reader for .npz pipeline outputs.
+
+    Nothing is read until a field is accessed, and then only the pages that are
+    actually sliced are touched:
+        archive = PoseArchive('squat_001.npz')
+        archive.meta['fps']
+        left_elbow = archive.read('smoothed_keypoints', frames=(100, 200), joints=7)  # [100, 2] view
+    """
+    def __init__(self, path):
+        self.path = path
+        self._members = {}
+        self._arrays = {}
+
+        with zipfile.ZipFile(path) as zf, open(path, 'rb') as f:
+            for info in zf.infolist():
+                if info.compress_type != zipfile.ZIP_STORED:
+                    raise ValueError(f"{path}: member {info.filename} is compressed and cannot be memory-mapped. "
+                                     f"Re-save it with save_npz().")
+                name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+                self._members[name] = self._locate(f, info)
+
+        self.meta = json.loads(bytes(self._map(META_MEMBER)).decode('utf-8')) if META_MEMBER in self._members else {}
+
+    @staticmethod
+    def _locate(f, info):
+        """Returns (data_offset, dtype, shape, fortran_order) of a stored .npy member."""
+        # Local file header: 30 fixed bytes, then file name and extra field
+        f.seek(info.header_offset)
+        header = f.read(30)
+        name_len, extra_len = struct.unpack('<HH', header[26:30])
+        f.seek(info.header_offset + 30 + name_len + extra_len)
+
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        return f.tell(), dtype, shape, fortran_order
+
+    def _map(self, name):
+        if name not in self._arrays:
+            if name not in self._members:
+                raise KeyError(f"{self.path} has no field '{name}'. Available: {self.fields}")
+            offset, dtype, shape, fortran_order = self._members[name]
+            if int(np.prod(shape)) == 0:
+                self._arrays[name] = np.zeros(shape, dtype=dtype)
+            else:
+                self._arrays[name] = np.memmap(self.path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                                               order='F' if fortran_order else 'C')
+        return self._arrays[name]
+
+    @property
+    def fields(self):
+        return [name for name in self._members if name != META_MEMBER]
+
+    @property
+    def frame_count(self):
+        return self.meta.get('frame_count', len(self._map(self.fields[0])) if self.fields else 0)
+
+    def __getitem__(self, field):
+        return self._map(field)
+
+    def __contains__(self, field):
+        return field in self._members and field != META_MEMBER
+
+    def read(self, field, frames=None, joints=None):
+        """
+        Zero-copy slice of one field.
+        Args:
+            field (str): e.g. 'smoothed_keypoints' or 'scores'.
+            frames: None (all), a slice, or a (start, stop) tuple.
+            joints: None (all), an int, or a slice. Lists of joints are supported
+                but, as with any numpy fancy index, return a copy.
+        """
+        array = self._map(field)
+        if isinstance(frames, tuple):
+            frames = slice(*frames)
+        view = array[frames if frames is not None else slice(None)]
+        if joints is not None:
+            view = view[:, joints]
+        return view
+
+    def to_packet(self):
+        """Loads everything into an in-memory data packet (same keys as the JSON output)."""
+        packet = dict(self.meta)
+        for field in self.fields:
+            packet[field] = np.array(self._map(field))
+        return packet
+
+    def result(self, **overrides):
+        """The archive as a PoseResult over its memory-mapped fields (nothing is copied)."""
+        packet = dict(self.meta)
+        packet.update({field: self._map(field) for field in self.fields})
+        return PoseResult(packet, **overrides)
+
+class PoseResult(dict):
+    """
+    A data packet whose derived fields (smoothed_keypoints, normalized_keypoints,
+    missing) are computed from raw_keypoints + scores on first access and then
+    memoised. Raw-only outputs store just the raw fields and the post-processing
+    parameters; read through a PoseResult they give the same packet a full
+    output would have held:
+        result = load_output('squat_001.json')           # raw-only or full
+        result['normalized_keypoints']                    # derived once, then cached
+        wider = result.with_params(window_length=9)       # same raw data, different smoothing
+    Overriding parameters drops any stored derived fields, which are then
+    re-derived. Only stored fields are serialized: save_output() writes a
+    raw-only result back raw-only.
+    """
+    def __init__(self, packet, **overrides):
+        super().__init__(packet)
+        unknown = sorted(set(overrides) - set(POSTPROCESS_SETTINGS))
+        if unknown:
+            raise TypeError(f"Unknown post-processing parameters {unknown}. Available: {list(POSTPROCESS_SETTINGS)}")
+        self._derived = {}
+        params = dict(self.params, **overrides)
+        if overrides and params != self.params:
+            from signal_processing import POSTPROCESS_VERSION
+
+            for field in DERIVED_FIELDS:
+                self.pop(field, None)
+            self["postprocess"] = dict(params, version=POSTPROCESS_VERSION)
+
+    @property
+    def params(self):
+        """Post-processing parameters of the derived fields (the pipeline defaults for older outputs)."""
+        from signal_processing import postprocess_params
+
+        return dict(postprocess_params(), **(dict.get(self, "postprocess") or {}))
+
+    @property
+    def raw_only(self):
+        return not dict.__contains__(self, "smoothed_keypoints")
+
+    def __missing__(self, field):
+        if field not in DERIVED_FIELDS or not dict.__contains__(self, "raw_keypoints"):
+            raise KeyError(field)
+        if not self._derived:
+            self._derive()
+        return self._derived[field]
+
+    def __contains__(self, field):
+        return dict.__contains__(self, field) or (field in DERIVED_FIELDS and dict.__contains__(self, "raw_keypoints")
+                                                  and dict.__contains__(self, "scores"))
+
+    def get(self, field, default=None):
+        return self[field] if field in self else default
+
+    def _derive(self):
+        from signal_processing import derive_views, POSTPROCESS_VERSION
+
+        params = self.params
+        if params["version"] != POSTPROCESS_VERSION:
+            logger.warning(f"{self.get('video_id')}: stored with post-processing v{params['version']}, "
+                           f"deriving with v{POSTPROCESS_VERSION}.")
+        raw_keypoints = np.asarray(self["raw_keypoints"], dtype=float).reshape(-1, 17, 2)
+        scores = np.asarray(self["scores"], dtype=float).reshape(-1, 17)
+        smoothed, normalized, missing = derive_views(raw_keypoints, scores,
+                                                     **{k: params[k] for k in POSTPROCESS_SETTINGS})
+        self._derived = {"smoothed_keypoints": smoothed, "normalized_keypoints": normalized, "missing": missing}
+
+    def with_params(self, **overrides):
+        """A new result over the same raw data with some post-processing parameters changed."""
+        return PoseResult(self, **overrides)
+
+    def to_packet(self):
+        """A plain dict with the derived fields filled in (what a full output stores)."""
+        packet = dict(self)
+        packet.update({field: self[field] for field in DERIVED_FIELDS if field in self})
+        return packet
+
+def load_output(path, **overrides):
+    """
+    Loads a pipeline output (.json or .npz) as a PoseResult with numpy array fields.
+    Raw-only outputs derive their smoothed/normalized keypoints on first access;
+    `overrides` (e.g. window_length=9) re-derive them with other parameters.
+    """
+    if path.endswith('.npz'):
+        return PoseResult(PoseArchive(path).to_packet(), **overrides)
+    with open(path, 'r') as f:
+        packet = json.load(f)
+    # null entries (see json_safe) become NaN again
+    for field in ARRAY_FIELDS:
+        if field in packet:
+            packet[field] = np.asarray(packet[field], dtype=float)
+    for field in MASK_FIELDS:
+        if field in packet:
+            packet[field] = np.asarray(packet[field], dtype=bool)
+    return PoseResult(packet, **overrides)
+
+def convert_json_to_npz(json_path, npz_path=None):
+    """Converts an existing JSON output into the .npz container. Returns the new path."""
+    npz_path = npz_path or os.path.splitext(json_path)[0] + '.npz'
+    packet = load_output(json_path)
+    for field, tail in (('raw_keypoints', (17, 2)), ('smoothed_keypoints', (17, 2)),
+                        ('normalized_keypoints', (17, 2)), ('scores', (17,)), ('keypoints_3d', (17, 3))):
+        if field in packet.keys():   # stored fields only, so raw-only outputs stay raw-only
+            packet[field] = packet[field].reshape((-1,) + tail)
+    save_npz(packet, npz_path)
+    return npz_path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert pipeline JSON outputs to the memory-mappable .npz format")
+    parser.add_argument("inputs", nargs="+", help="JSON output files")
+    parser.add_argument("--output_dir", "-o", default=None, help="Directory for .npz files (default: next to input)")
+
+    args = parser.parse_args()
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    for json_path in args.inputs:
+        npz_path = None
+        if args.output_dir:
+            npz_path = os.path.join(args.output_dir, os.path.splitext(os.path.basename(json_path))[0] + '.npz')
+        npz_path = convert_json_to_npz(json_path, npz_path)
+        logger.info(f"{json_path} -> {npz_path} ({os.path.getsize(json_path) / os.path.getsize(npz_path):.1f}x smaller)")
@@ -0,0 +1,330 @@
+import os
+import time
+import logging
+from collections import namedtuple
+import numpy as np
+from inference_cache import model_fingerprint
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+NUM_KEYPOINTS = 17  # COCO
+
+# Every detected person in one frame: keypoints [P, 17, 2], scores [P, 17], bboxes [P, 4] (x1, y1, x2, y2)
+Instances = namedtuple('Instances', ['keypoints', 'scores', 'bboxes'])
+
+BACKENDS = {}
+
+def register_backend(name):
+    """Class decorator adding a PoseBackend subclass to the registry under `name`."""
+    def register(cls):
+        cls.name = name
+        BACKENDS[name] = cls
+        return cls
+    return register
+
+def available_backends():
+    return sorted(BACKENDS)
+
+def create_backend(name, model=None, device='cpu', load=True, warmup=False, **options):
+    """
+    Builds a registered backend.
+    Args:
+        name (str): 'mmpose', 'yolo', 'stub', or anything added with register_backend.
+        model (str): Backend-specific model name/weights (None = the backend default).
+        device (str): 'cpu', 'cuda', 'cuda:0', 'mps'...
+        load (bool): Load the model now. Pass False to read `fingerprint` first
+            (e.g. to check an inference cache) and call load() only when needed.
+        warmup (bool): Run one dummy batch after loading.
+        **options: Extra backend constructor arguments.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend '{name}'. Available: {available_backends()}")
+    backend = BACKENDS[name](model, device, **options)
+    if load:
+        backend.load()
+        if warmup:
+            backend.warmup()
+    return backend
+
+def empty_instances():
+    return Instances(np.zeros((0, NUM_KEYPOINTS, 2)), np.zeros((0, NUM_KEYPOINTS)), np.zeros((0, 4)))
+
+def bboxes_from_keypoints(keypoints):
+    """Tight (x1, y1, x2, y2) boxes around [P, 17, 2] keypoints."""
+    keypoints = np.asarray(keypoints, dtype=float)
+    if not len(keypoints):
+        return np.zeros((0, 4))
+    return np.concatenate([keypoints.min(axis=1), keypoints.max(axis=1)], axis=1)
+
+def crop_rois(frames, bboxes):
+    """
+    Cuts one (x1, y1, x2, y2) box out of each frame, clipped to the frame.
+    Degenerate boxes fall back to the whole frame.
+    Returns:
+        crops (list): Cropped BGR frames (views, not copies).
+        offsets (np.ndarray): [N, 2] top-left corner of each crop in frame pixels.
+    """
+    crops, offsets = [], []
+    for frame, bbox in zip(frames, bboxes):
+        h, w = frame.shape[:2]
+        x1, y1 = (int(max(0, min(v, lim))) for v, lim in zip(np.floor(bbox[:2]), (w, h)))
+        x2, y2 = (int(max(0, min(v, lim))) for v, lim in zip(np.ceil(bbox[2:4]), (w, h)))
+        if x2 - x1 < 2 or y2 - y1 < 2:
+            x1, y1, x2, y2 = 0, 0, w, h
+        crops.append(frame[y1:y2, x1:x2])
+        offsets.append((x1, y1))
+    return crops, np.array(offsets, dtype=float).reshape(-1, 2)
+
+def shift_instances(instances, offset):
+    """Moves Instances found in a crop back to frame coordinates."""
+    offset = np.asarray(offset, dtype=float)
+    return Instances(instances.keypoints + offset, instances.scores, instances.bboxes + np.tile(offset, 2))
+
+def select_person(instances, person='first'):
+    """
+    Picks one person per frame from a list of Instances.
+    Args:
+        person (str): 'first' (detector order) or 'best_score' (highest mean keypoint score).
+    Returns:
+        keypoints (np.ndarray): [N, 17, 2], NaN for frames without a detection.
+        scores (np.ndarray): [N, 17], zeros for frames without a detection.
+    """
+    if person not in ('first', 'best_score'):
+        raise ValueError(f"Unknown person selection '{person}'. Expected 'first' or 'best_score'.")
+    keypoints = np.full((len(instances), NUM_KEYPOINTS, 2), np.nan)
+    scores = np.zeros((len(instances), NUM_KEYPOINTS))
+    for i, inst in enumerate(instances):
+        if not len(inst.keypoints):
+            continue
+        idx = 0 if person == 'first' else int(np.argmax(np.nanmean(inst.scores, axis=1)))
+        keypoints[i] = inst.keypoints[idx]
+        scores[i] = inst.scores[idx]
+    return keypoints, scores
+
+class PoseBackend:
+    """
+    Common contract for 2D pose models:
+        backend = create_backend('yolo', 'yolov8s-pose.pt', device='cuda')
+        keypoints, scores = backend.infer(frames)   # [N, 17, 2], [N, 17]
+
+    Subclasses implement load() and infer_instances(); everything else
+    (person selection, warmup, cache fingerprints) is shared.
+    """
+    name = None
+    default_model = None
+
+    def __init__(self, model=None, device='cpu'):
+        self.model = model or self.default_model
+        self.device = device
+        # Hashed into the cache fingerprint; load() may resolve it to the actual weights file
+        self.weights_path = self.model
+        self.loaded = False
+
+    def load(self):
+        raise NotImplementedError
+
+    def framework_version(self):
+        return None
+
+    @property
+    def model_id(self):
+        return os.path.basename(str(self.model))
+
+    @property
+    def fingerprint(self):
+        """Changes whenever the weights or the framework version change (see inference_cache)."""
+        return model_fingerprint(self.weights_path, self.framework_version())
+
+    def cache_key(self, person='first'):
+        """InferenceCache key fields for raw output of this backend."""
+        return {"backend": self.name, "model": self.model_id, "fingerprint": self.fingerprint,
+                "params": {"person": person}}
+
+    def warmup(self, batch_size=1, size=(640, 480)):
+        """Runs one dummy batch so lazy init (CUDA context, cudnn autotune, allocator) is not charged to the first video."""
+        start = time.time()
+        self.infer([np.zeros((size[1], size[0], 3), dtype=np.uint8)] * batch_size)
+        logger.info(f"Warmed up {self.name}/{self.model_id} in {time.time() - start:.2f}s")
+
+    def infer_instances(self, frames):
+        """
+        Runs the model on a batch of BGR frames.
+        Returns:
+            list of Instances, one per frame.
+        """
+        raise NotImplementedError
+
+    def infer_rois(self, frames, bboxes):
+        """
+        Runs the model on one region of interest per frame (see tracking.PoseTracker),
+        skipping full-frame person detection where the backend allows it.
+        The default crops each frame to its box and runs infer_instances on the crops.
+        Args:
+            bboxes (np.ndarray): [N, 4] (x1, y1, x2, y2) in frame pixels.
+        Returns:
+            list of Instances in frame coordinates, one per frame.
+        """
+        crops, offsets = crop_rois(frames, bboxes)
+        return [shift_instances(inst, offset) for inst, offset in zip(self.infer_instances(crops), offsets)]
+
+    def infer(self, frames, person='first', fill_value=0.0):
+        """
+        Runs the model on a batch of BGR frames and keeps one person per frame.
+        Args:
+            person (str): See select_person().
+            fill_value (float): Keypoint value for frames without a detection
+                (0 matches the extractors' JSON outputs, NaN suits interpolation).
+        Returns:
+            keypoints (np.ndarray): [N, 17, 2]
+            scores (np.ndarray): [N, 17]
+        """
+        keypoints, scores = select_person(self.infer_instances(list(frames)), person)
+        if not np.isnan(fill_value):
+            keypoints[np.isnan(keypoints)] = fill_value
+        return keypoints, scores
+
+@register_backend('mmpose')
+class MMPoseBackend(PoseBackend):
+    """MMPose inferencer. `model` is an alias ('human' = RTMPose-Large) or a pose2d config name."""
+    default_model = 'human'
+
+    def __init__(self, model=None, device='cpu', **inferencer_args):
+        super().__init__(model, device)
+        self.inferencer_args = inferencer_args
+        self.inferencer = None
+
+    def framework_version(self):
+        import mmpose
+        return mmpose.__version__
+
+    def load(self):
+        from mmpose.apis import MMPoseInferencer
+        logger.info(f"Initializing MMPoseInferencer (model={self.model}, device={self.device})...")
+        self.inferencer = MMPoseInferencer(self.model, device=self.device, **self.inferencer_args)
+        self.loaded = True
+
+    def infer_instances(self, frames):
+        instances = []
+        for result in self.inferencer(frames, batch_size=len(frames), return_vis=False):
+            # One list of persons per input image
+            for frame_preds in result['predictions']:
+                instances.append(self._parse(frame_preds))
+        return instances
+
+    def infer_rois(self, frames, bboxes):
+        """Top-down models get the boxes directly, so the person detector is skipped entirely."""
+        pose2d = self.inferencer.inferencer
+        if getattr(pose2d.cfg, 'data_mode', None) != 'topdown':
+            return super().infer_rois(frames, bboxes)
+        from mmpose.apis import inference_topdown
+        instances = []
+        for frame, bbox in zip(frames, bboxes):
+            samples = inference_topdown(pose2d.model, frame, np.asarray(bbox, dtype=float)[None, :4], bbox_format='xyxy')
+            if not samples:
+                instances.append(empty_instances())
+                continue
+            pred = samples[0].pred_instances
+            keypoints = np.asarray(pred.keypoints, dtype=float)[:, :NUM_KEYPOINTS, :2]
+            scores = np.asarray(pred.keypoint_scores, dtype=float)[:, :NUM_KEYPOINTS]
+            instances.append(Instances(keypoints, scores, np.asarray(bbox, dtype=float)[None, :4]))
+        return instances
+
+    @staticmethod
+    def _parse(frame_preds):
+        """Structure: [{'keypoints': [[x,y], ...], 'keypoint_scores': [...], 'bbox': ...}, ...]"""
+        if not frame_preds:
+            return empty_instances()
+        keypoints = np.array([p['keypoints'] for p in frame_preds], dtype=float)[:, :NUM_KEYPOINTS, :2]
+        scores = np.array([p['keypoint_scores'] for p in frame_preds], dtype=float)[:, :NUM_KEYPOINTS]
+        if all('bbox' in p for p in frame_preds):
+            bboxes = np.array([np.asarray(p['bbox'], dtype=float).reshape(-1)[:4] for p in frame_preds])
+        else:
+            bboxes = bboxes_from_keypoints(keypoints)
+        return Instances(keypoints, scores, bboxes)
+
+@register_backend('yolo')
+class YOLOBackend(PoseBackend):
+    """Ultralytics YOLO pose. `model` is a weights file: yolov8n-pose.pt (fast) ... yolov8x-pose.pt (accurate)."""
+    default_model = 'yolov8n-pose.pt'
+
+    def __init__(self, model=None, device='cpu', roi_imgsz=320):
+        """
+        Args:
+            roi_imgsz (int): Network input size for tracked crops. The athlete fills
+                most of a crop, so it keeps roughly the detail of a 640 full frame.
+        """
+        super().__init__(model, device)
+        self.roi_imgsz = roi_imgsz
+        self.net = None
+
+    def framework_version(self):
+        import ultralytics
+        return ultralytics.__version__
+
+    def load(self):
+        from ultralytics import YOLO
+        logger.info(f"Initializing YOLO Pose (model={self.model}, device={self.device})...")
+        self.net = YOLO(self.model)
+        # YOLO() downloads missing weights, so the resolved file can be hashed by now
+        self.weights_path = getattr(self.net, 'ckpt_path', None) or self.model
+        self.loaded = True
+
+    def infer_instances(self, frames):
+        return [self._parse(result) for result in self.net(frames, device=self.device, verbose=False)]
+
+    def infer_rois(self, frames, bboxes):
+        crops, offsets = crop_rois(frames, bboxes)
+        results = self.net(crops, device=self.device, imgsz=self.roi_imgsz, verbose=False)
+        return [shift_instances(self._parse(result), offset) for result, offset in zip(results, offsets)]
+
+    @staticmethod
+    def _parse(result):
+        if result.keypoints is None or len(result.keypoints.data) == 0:
+            return empty_instances()
+        data = result.keypoints.data.cpu().numpy().astype(float)  # [P, 17, 3]: x, y, conf
+        scores = result.keypoints.conf.cpu().numpy() if result.keypoints.conf is not None else data[..., 2]
+        bboxes = result.boxes.xyxy.cpu().numpy() if result.boxes is not None else bboxes_from_keypoints(data[..., :2])
+        return Instances(data[:, :NUM_KEYPOINTS, :2], np.asarray(scores, dtype=float)[:, :NUM_KEYPOINTS],
+                         np.asarray(bboxes, dtype=float))
+
+@register_backend('stub')
+class StubBackend(PoseBackend):
+    """
+    Deterministic stand-in for tests and benchmarks: a fixed standing skeleton,
+    sized to the frame and centred on its brightest region. Needs no model.
+    Args:
+        cost_ms (float): Simulated per-frame model latency.
+    """
+    default_model = 'stub'
+
+    def __init__(self, model=None, device='cpu', cost_ms=0.0):
+        super().__init__(model, device)
+        self.cost_ms = cost_ms
+
+    def framework_version(self):
+        return 'stub-1'
+
+    def load(self):
+        from synthetic_data import STANDING_POSE
+        # Relative to the mid-hip, in torso lengths; a torso is ~22% of the frame height
+        self._template = STANDING_POSE * 0.22
+        self.loaded = True
+
+    def infer_instances(self, frames):
+        import cv2
+        instances = []
+        for frame in frames:
+            h, w = frame.shape[:2]
+            small = cv2.resize(frame, (32, 32), interpolation=cv2.INTER_AREA)
+            small = small.mean(axis=2) if small.ndim == 3 else small
+            y, x = np.unravel_index(np.argmax(small), small.shape)
+            keypoints = self._template[None] * h + [(x + 0.5) * w / 32, (y + 0.5) * h / 32]
+            instances.append(Instances(keypoints, np.full((1, NUM_KEYPOINTS), 0.9), bboxes_from_keypoints(keypoints)))
+        if self.cost_ms:
+            time.sleep(self.cost_ms * len(frames) / 1000.0)
+        return instances
+
+    def infer_rois(self, frames, bboxes):
+        # The fake skeleton is sized to the image, so it is always placed on the full frame
+        return self.infer_instances(frames)
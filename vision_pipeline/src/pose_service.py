@@ -0,0 +1,348 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import numpy as np
+import cv2
+from frame_scheduler import FrameBatchScheduler
+from video_io import VideoFrameReader
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+MAX_BODY_BYTES = 64 * 1024 ** 2
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+            500: 'Internal Server Error'}
+# process_video ingestion options a /video request may set
+VIDEO_OPTIONS = ('max_side', 'frame_stride', 'start_time', 'end_time')
+
+def _jsonable(value):
+    """Arrays to lists, NaN (missing joints) to null, so responses are strict JSON."""
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    if isinstance(value, dict):
+        return {k: _jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+def _encode(obj):
+    return json.dumps(_jsonable(obj)).encode('utf-8')
+
+def _percentiles(values):
+    if not values:
+        return None
+    p50, p90, p99 = np.percentile(np.array(values) * 1000.0, [50, 90, 99]).tolist()
+    return {"p50_ms": p50, "p90_ms": p90, "p99_ms": p99, "count": len(values)}
+
+class PoseService:
+    """
+    Long-running local HTTP service around one loaded, warmed-up PoseExtractor.
+    Frames from all concurrent requests go through a single FrameBatchScheduler,
+    so clients share model calls instead of each paying a cold start.
+
+        GET  /health   liveness, backend and uptime
+        GET  /stats    queue depth, batching and latency percentiles
+        POST /frame    an encoded image (JPEG/PNG body) -> keypoints and scores
+        POST /video    {"path": ..., "stream": bool, "output": path, "max_side": ...}
+                       -> NDJSON per frame while streaming, then the processed video
+    """
+    def __init__(self, extractor, batch_size=16, max_wait=0.01, decode_workers=4, window=10000):
+        self.extractor = extractor
+        self.scheduler = FrameBatchScheduler(extractor.infer_frames, batch_size, max_wait)
+        # Decoding, image decoding and post-processing stay off the event loop
+        self.pool = ThreadPoolExecutor(max_workers=max(2, decode_workers), thread_name_prefix="pose-service")
+        self.started = time.time()
+        self.requests = {"frame": 0, "video": 0, "errors": 0}
+        self.active = 0
+        self.waiting_frames = 0
+        self.frame_latency = deque(maxlen=window)
+        self.request_latency = {"frame": deque(maxlen=window), "video": deque(maxlen=window)}
+
+    def close(self):
+        self.scheduler.close()
+        self.pool.shutdown()
+
+    # ---------------- inference ----------------
+
+    async def _infer(self, frame):
+        """One frame through the shared scheduler; returns (keypoints [17, 2], scores [17])."""
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        self.waiting_frames += 1
+        try:
+            # submit() blocks while the scheduler queue is full (back-pressure), so not on the loop
+            future = await loop.run_in_executor(self.pool, self.scheduler.submit, frame)
+            result = await asyncio.wrap_future(future)
+        finally:
+            self.waiting_frames -= 1
+        self.frame_latency.append(time.monotonic() - start)
+        return result
+
+    async def _video_frames(self, reader):
+        """
+        Decodes on a pool thread and yields (position, keypoints, scores) in frame order.
+        Closing the generator early (a streaming client that disconnected) stops the decode
+        before its next frame is submitted, so the rest of the video never reaches the model.
+        """
+        loop = asyncio.get_running_loop()
+        futures = asyncio.Queue()
+        cancelled = threading.Event()
+
+        def decode():
+            try:
+                for position, (_, frame) in enumerate(reader):
+                    if cancelled.is_set():
+                        break
+                    submitted = time.monotonic()
+                    loop.call_soon_threadsafe(futures.put_nowait, (position, submitted, self.scheduler.submit(frame)))
+            except Exception as e:
+                loop.call_soon_threadsafe(futures.put_nowait, e)
+            loop.call_soon_threadsafe(futures.put_nowait, None)
+
+        decoding = loop.run_in_executor(self.pool, decode)
+        try:
+            while True:
+                item = await futures.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                position, submitted, future = item
+                self.waiting_frames += 1
+                try:
+                    keypoints, scores = await asyncio.wrap_future(future)
+                finally:
+                    self.waiting_frames -= 1
+                self.frame_latency.append(time.monotonic() - submitted)
+                yield position, reader.to_source_coords(keypoints), scores
+        finally:
+            cancelled.set()
+            await decoding
+            reader.close()
+
+    # ---------------- handlers ----------------
+
+    def health(self):
+        key = self.extractor.cache_key
+        return {"status": "ok", "backend": key["backend"], "model": key["model"],
+                "uptime_s": time.time() - self.started}
+
+    def stats(self):
+        scheduler = self.scheduler
+        return {
+            "queue_depth": scheduler.pending,
+            "frames_in_flight": self.waiting_frames,
+            "active_requests": self.active,
+            "requests": dict(self.requests),
+            "frames_run": scheduler.frames_run,
+            "batches_run": scheduler.batches_run,
+            "avg_batch_size": scheduler.frames_run / scheduler.batches_run if scheduler.batches_run else 0.0,
+            "frame_latency": _percentiles(self.frame_latency),
+            "request_latency": {name: _percentiles(values) for name, values in self.request_latency.items()},
+        }
+
+    async def handle_frame(self, body):
+        loop = asyncio.get_running_loop()
+        frame = await loop.run_in_executor(self.pool, cv2.imdecode, np.frombuffer(body, dtype=np.uint8),
+                                           cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError("Body is not a decodable image (send JPEG or PNG bytes).")
+        keypoints, scores = await self._infer(frame)
+        return {"keypoints": keypoints, "scores": scores}
+
+    async def handle_video(self, request, send_line=None):
+        """
+        Runs one video through the shared scheduler. With send_line, every frame's raw
+        result is sent as soon as it is ready. Returns the processed data packet (or a
+        summary of it when the request names an output file).
+        """
+        path = request.get("path")
+        if not path:
+            raise ValueError("Request needs a video 'path'.")
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Video {path} not found.")
+        loop = asyncio.get_running_loop()
+        options = {k: request[k] for k in VIDEO_OPTIONS if request.get(k) is not None}
+        reader = await loop.run_in_executor(self.pool, lambda: VideoFrameReader(path, **options))
+
+        extractor = self.extractor
+        cache = extractor.cache
+        cache_key = dict(extractor.cache_key, params=dict(extractor.cache_key["params"], **reader.params))
+        cached = await loop.run_in_executor(self.pool, lambda: cache.load(path, **cache_key)) if cache else None
+        if cached is not None:
+            raw_keypoints, scores = cached
+            if send_line is not None:
+                for position in range(len(raw_keypoints)):
+                    await send_line({"frame": position, "keypoints": raw_keypoints[position],
+                                     "scores": scores[position]})
+        else:
+            raw_keypoints, scores = [], []
+            frames = self._video_frames(reader)
+            try:
+                async for position, keypoints, frame_scores in frames:
+                    raw_keypoints.append(keypoints)
+                    scores.append(frame_scores)
+                    if send_line is not None:
+                        await send_line({"frame": position, "keypoints": keypoints, "scores": frame_scores})
+            finally:
+                # Runs the generator's cleanup now, not at garbage collection, when the client went away
+                await frames.aclose()
+            raw_keypoints = np.array(raw_keypoints).reshape(-1, 17, 2)
+            scores = np.array(scores).reshape(-1, 17)
+            if cache is not None:
+                await loop.run_in_executor(self.pool, lambda: cache.store(path, raw_keypoints, scores, **cache_key))
+
+        output = request.get("output")
+        packet = await loop.run_in_executor(self.pool, lambda: extractor.postprocess(
+            path, raw_keypoints, scores, output, reader.output_info()))
+        if output:
+            return {"video_id": packet["video_id"], "frame_count": packet["frame_count"], "output": output}
+        return packet
+
+    # ---------------- HTTP ----------------
+
+    async def _respond(self, writer, status, payload, content_type='application/json'):
+        body = payload if isinstance(payload, bytes) else _encode(payload)
+        writer.write(f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\n\r\n".encode('latin-1') + body)
+        await writer.drain()
+
+    async def _stream_video(self, writer, request):
+        """Chunked NDJSON: one line per frame, then the processed video (or an error line)."""
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\n\r\n")
+
+        async def send_line(obj):
+            line = _encode(obj) + b'\n'
+            writer.write(f"{len(line):x}\r\n".encode('latin-1') + line + b"\r\n")
+            await writer.drain()
+
+        try:
+            await send_line({"done": True, "result": await self.handle_video(request, send_line)})
+        except Exception as e:
+            self.requests["errors"] += 1
+            logger.error(f"Video request failed: {e}")
+            await send_line({"done": True, "error": str(e)})
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _route(self, method, path, body, writer):
+        if path in ('/health', '/stats'):
+            if method != 'GET':
+                return await self._respond(writer, 405, {"error": f"{path} takes GET"})
+            return await self._respond(writer, 200, self.health() if path == '/health' else self.stats())
+        if path not in ('/frame', '/video'):
+            return await self._respond(writer, 404, {"error": f"No route {path}"})
+        if method != 'POST':
+            return await self._respond(writer, 405, {"error": f"{path} takes POST"})
+
+        name = path[1:]
+        self.requests[name] += 1
+        self.active += 1
+        start = time.monotonic()
+        try:
+            if name == 'frame':
+                return await self._respond(writer, 200, await self.handle_frame(body))
+            request = json.loads(body or b'{}')
+            if request.get("stream"):
+                return await self._stream_video(writer, request)
+            return await self._respond(writer, 200, await self.handle_video(request))
+        except (ValueError, FileNotFoundError) as e:
+            self.requests["errors"] += 1
+            return await self._respond(writer, 404 if isinstance(e, FileNotFoundError) else 400, {"error": str(e)})
+        except Exception as e:
+            self.requests["errors"] += 1
+            logger.error(f"{path} request failed: {e}")
+            return await self._respond(writer, 500, {"error": str(e)})
+        finally:
+            self.active -= 1
+            self.request_latency[name].append(time.monotonic() - start)
+
+    async def handle_connection(self, reader, writer):
+        """HTTP/1.1 with keep-alive: one request after another on the same connection."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target = request_line.decode('latin-1').split()[:2]
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, 413, {"error": f"Body larger than {MAX_BODY_BYTES} bytes"})
+                    break
+                body = await reader.readexactly(length) if length else b''
+                await self._route(method.upper(), urlsplit(target).path, body, writer)
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError, BrokenPipeError):
+            pass
+        except ValueError:
+            await self._respond(writer, 400, {"error": "Malformed request"})
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8765):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        logger.info(f"Pose service listening on http://{host}:{port} (backend {self.extractor.cache_key['backend']})")
+        async with server:
+            await server.serve_forever()
+
+if __name__ == "__main__":
+    from pose_backends import available_backends
+    from autotune import tuned_settings
+    from batch_runner import build_extractor, limit_threads
+
+    parser = argparse.ArgumentParser(description="Local pose-inference service: keeps the model loaded, batches across clients")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to bind (default: localhost only)")
+    parser.add_argument("--port", "-p", type=int, default=8765, help="Port (default: 8765)")
+    parser.add_argument("--backend", "-b", choices=available_backends(), default=None,
+                        help="Pose backend (default: tuning profile, else mmpose)")
+    parser.add_argument("--model", "-m", default=None, help="Model for the backend (default: backend default)")
+    parser.add_argument("--device", "-d", default=None, help="Inference device (default: tuning profile, else cpu)")
+    parser.add_argument("--threads", "-t", type=int, default=None, help="CPU threads for inference")
+    parser.add_argument("--no-tuning-profile", action="store_true", help="Ignore this host's autotune profile")
+    parser.add_argument("--batch-size", type=int, default=None,
+                        help="Max frames per model call, across all clients (default: tuning profile, else 16)")
+    parser.add_argument("--max-wait-ms", type=float, default=10.0,
+                        help="Max time a frame waits for its batch to fill (default: 10ms)")
+    parser.add_argument("--decode-workers", type=int, default=4, help="Threads decoding videos and images")
+    parser.add_argument("--cache-dir", default=None, help="Inference cache shared with batch_runner.py")
+    parser.add_argument("--cache-max-gb", type=float, default=20.0, help="Inference cache size limit (default: 20)")
+    parser.add_argument("--score-threshold", type=float, default=0.3, help="Drop keypoints scoring below this before smoothing")
+    parser.add_argument("--max-gap", type=int, default=10,
+                        help="Interpolate dropped runs up to this many frames; longer ones stay NaN")
+
+    args = parser.parse_args()
+
+    requested_backend = args.backend or ("mmpose" if args.model else None)
+    tuned = {} if args.no_tuning_profile else tuned_settings(requested_backend)
+    if args.threads:
+        limit_threads(args.threads)
+    extractor = build_extractor(requested_backend or tuned.get("backend", "mmpose"), args.model or tuned.get("model"),
+                                args.device or tuned.get("device", "cpu"), args.cache_dir, args.cache_max_gb,
+                                score_threshold=args.score_threshold, max_gap=args.max_gap)
+    service = PoseService(extractor, args.batch_size or tuned.get("batch_size", 16), args.max_wait_ms / 1000.0,
+                          args.decode_workers)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+        logger.info(f"Served {service.requests['frame']} frame and {service.requests['video']} video requests.")
@@ -0,0 +1,291 @@
+import os
+import glob
+import logging
+import argparse
+import numpy as np
+from scipy.ndimage import convolve1d
+from scipy.signal import savgol_coeffs, savgol_filter
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# COCO Indices: 5,6 (shoulders), 11,12 (hips)
+L_SHOULDER, R_SHOULDER, L_HIP, R_HIP = 5, 6, 11, 12
+
+# Bump when a change to gating/smoothing/normalization alters the output for the same parameters
+POSTPROCESS_VERSION = 1
+
+def _segment_bounds(length, offsets=None):
+    """Per-frame [start, end) of the video each frame belongs to (one video if offsets is None)."""
+    if offsets is None:
+        return np.zeros(length, dtype=np.int64), np.full(length, length, dtype=np.int64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.diff(offsets)
+    return np.repeat(offsets[:-1], lengths), np.repeat(offsets[1:], lengths)
+
+def _valid_neighbours(valid, offsets=None):
+    """
+    For a [Frames, C] validity mask, the index of the last valid frame at or before
+    and the first valid frame at or after every frame, per column and within the
+    same video. -1 / Frames where there is none.
+    """
+    length = len(valid)
+    frames = np.arange(length)[:, None]
+    prev = np.maximum.accumulate(np.where(valid, frames, -1), axis=0)
+    nxt = np.minimum.accumulate(np.where(valid, frames, length)[::-1], axis=0)[::-1]
+    if offsets is not None:
+        starts, ends = _segment_bounds(length, offsets)
+        prev = np.where(prev >= starts[:, None], prev, -1)
+        nxt = np.where(nxt < ends[:, None], nxt, length)
+    return prev, nxt
+
+def _hold_missing(values, offsets=None):
+    """
+    Replaces NaNs with the previous valid value of the same column (the next one at
+    the start of a video), and with 0 in columns without any valid value.
+    """
+    flat = values.reshape(len(values), -1)
+    missing = np.isnan(flat)
+    prev, nxt = _valid_neighbours(~missing, offsets)
+    source = np.where(prev >= 0, prev, nxt)
+    found = missing & (source < len(values))
+    held = flat.copy()
+    held[found] = flat[np.clip(source, 0, len(values) - 1), np.arange(flat.shape[1])][found]
+    held[missing & ~found] = 0.0
+    return held.reshape(values.shape)
+
+def gate_and_fill(keypoints, scores, score_threshold=0.3, max_gap=10, offsets=None):
+    """
+    Confidence gating: drops keypoints scoring below score_threshold (including the
+    zero fill of frames without a detection), then linearly interpolates each joint's
+    gaps of up to max_gap frames from the valid frames on either side, for all joints
+    and axes at once. Gaps at the start/end of a video hold the nearest valid value.
+    Longer gaps are left NaN and flagged rather than invented.
+    Args:
+        keypoints (np.ndarray): [Frames, 17, 2]
+        scores (np.ndarray): [Frames, 17]
+        max_gap (int): Longest run of dropped frames to fill (None = fill every gap).
+        offsets (np.ndarray): Video boundaries when several videos are packed back to
+            back (see pack_sequences); gaps are never bridged across two videos.
+    Returns:
+        filled (np.ndarray): [Frames, 17, 2], NaN where a joint stays unknown.
+        missing (np.ndarray): [Frames, 17] bool, True where filled is NaN.
+    """
+    keypoints = np.array(keypoints, dtype=float)
+    scores = np.asarray(scores, dtype=float)
+    valid = (scores >= score_threshold) & np.isfinite(keypoints).all(axis=-1)
+    if valid.all():
+        return keypoints, np.zeros(valid.shape, dtype=bool)
+
+    length = len(keypoints)
+    frames = np.arange(length)[:, None]
+    prev, nxt = _valid_neighbours(valid, offsets)
+    has_prev, has_next = prev >= 0, nxt < length
+
+    # Length of the run of dropped frames each frame sits in
+    starts, ends = _segment_bounds(length, offsets)
+    gap = np.where(has_next, nxt, ends[:, None]) - np.where(has_prev, prev, starts[:, None] - 1) - 1
+    fill = ~valid & (has_prev | has_next)
+    if max_gap is not None:
+        fill &= gap <= max_gap
+
+    # Interior gaps blend both sides; edge gaps use the one side they have
+    lo = np.where(has_prev, prev, nxt).clip(0, length - 1)
+    hi = np.where(has_next, nxt, prev).clip(0, length - 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weight = np.where(hi > lo, (frames - lo) / (hi - lo), 0.0)
+    joints = np.arange(keypoints.shape[1])[None]
+    interpolated = keypoints[lo, joints] * (1 - weight)[..., None] + keypoints[hi, joints] * weight[..., None]
+
+    filled = np.where(fill[..., None], interpolated, keypoints)
+    missing = ~valid & ~fill
+    filled[missing] = np.nan
+    return filled, missing
+
+def smooth_keypoints(keypoints, window_length=5, polyorder=2):
+    """
+    Savitzky-Golay smoothing of every joint and axis in one call.
+    Keypoints shape: [Frames, Num_Points, 2] (any trailing shape works).
+    Sequences shorter than window_length are returned unchanged. NaN gaps (see
+    gate_and_fill) stay NaN without spreading into the frames around them.
+    """
+    keypoints = np.asarray(keypoints)
+    if len(keypoints) < window_length:
+        return keypoints
+    missing = np.isnan(keypoints)
+    if not missing.any():
+        return savgol_filter(keypoints, window_length, polyorder, axis=0)
+    smoothed = savgol_filter(_hold_missing(keypoints), window_length, polyorder, axis=0)
+    smoothed[missing] = np.nan
+    return smoothed
+
+def mid_hip(keypoints):
+    """Mid-point of the two hips per frame. [..., 17, 2] -> [..., 2]"""
+    return (keypoints[..., L_HIP, :] + keypoints[..., R_HIP, :]) / 2
+
+def torso_length(keypoints):
+    """Distance between mid-shoulder and mid-hip per frame. [..., 17, 2] -> [...]"""
+    mid_shoulder = (keypoints[..., L_SHOULDER, :] + keypoints[..., R_SHOULDER, :]) / 2
+    return np.linalg.norm(mid_shoulder - mid_hip(keypoints), axis=-1)
+
+def center_on_mid_hip(keypoints):
+    """Translates every frame so the mid-hip sits at (0, 0)."""
+    keypoints = np.asarray(keypoints)
+    return keypoints - mid_hip(keypoints)[..., None, :]
+
+def normalize_keypoints(keypoints):
+    """
+    Centers every frame on the mid-hip and scales it by 1 / torso length.
+    Frames with a near-zero torso (failed detection) are only centered.
+    Works on [Frames, 17, 2] or any stack of frames [..., 17, 2].
+    """
+    keypoints = np.asarray(keypoints)
+    torso_len = torso_length(keypoints)
+    scale = np.where(torso_len < 1e-3, 1.0, 1.0 / np.maximum(torso_len, 1e-3))
+    return center_on_mid_hip(keypoints) * scale[..., None, None]
+
+def postprocess_params(score_threshold=0.3, max_gap=10, window_length=5, polyorder=2):
+    """The settings that turn raw keypoints into the derived fields, as stored with every output."""
+    return {"version": POSTPROCESS_VERSION, "score_threshold": score_threshold, "max_gap": max_gap,
+            "window_length": window_length, "polyorder": polyorder}
+
+def derive_views(raw_keypoints, scores, score_threshold=0.3, max_gap=10, window_length=5, polyorder=2):
+    """
+    Gating, smoothing and normalization of one video, exactly as PoseExtractor.postprocess runs them.
+    Returns:
+        smoothed, normalized ([Frames, 17, 2]) and missing ([Frames, 17] bool).
+    """
+    gated, missing = gate_and_fill(raw_keypoints, scores, score_threshold, max_gap)
+    smoothed = smooth_keypoints(gated, window_length, polyorder)
+    return smoothed, normalize_keypoints(smoothed), missing
+
+def pack_sequences(sequences):
+    """
+    Concatenates ragged per-video arrays along the frame axis.
+    Returns:
+        flat (np.ndarray): [Total_Frames, ...]
+        offsets (np.ndarray): [Num_Videos + 1], video i is flat[offsets[i]:offsets[i+1]].
+    """
+    lengths = [len(s) for s in sequences]
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    flat = np.concatenate([np.asarray(s, dtype=float) for s in sequences], axis=0) if sequences else np.zeros((0, 17, 2))
+    return flat, offsets
+
+def unpack_sequences(flat, offsets):
+    """Splits a packed array back into per-video views (no copy)."""
+    return [flat[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+def smooth_packed(flat, offsets, window_length=5, polyorder=2):
+    """
+    Savitzky-Golay smoothing of many videos stored back to back in `flat`.
+    Gives exactly the per-video result of smooth_keypoints: the interior is one
+    convolution over the whole buffer, and the first/last window_length // 2
+    frames of every video are re-fitted from that video's own edge window
+    (scipy's mode='interp'). Videos shorter than the window are left raw.
+    NaN gaps stay NaN, as in smooth_keypoints.
+    """
+    flat = np.asarray(flat, dtype=float)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    starts, lengths = offsets[:-1], np.diff(offsets)
+    half = window_length // 2
+
+    missing = np.isnan(flat)
+    if missing.any():
+        raw = flat
+        flat = _hold_missing(flat, offsets)
+
+    smoothed = convolve1d(flat, savgol_coeffs(window_length, polyorder), axis=0, mode='nearest')
+
+    # Frames of videos too short to smooth keep their raw values
+    too_short = np.repeat(lengths < window_length, lengths)
+    smoothed[too_short] = flat[too_short]
+
+    long_enough = lengths >= window_length
+    starts, ends = starts[long_enough], offsets[1:][long_enough]
+    if len(starts) and half:
+        window = np.arange(window_length)
+        head_fit = np.stack([savgol_coeffs(window_length, polyorder, pos=k, use='dot') for k in range(half)])
+        tail_fit = np.stack([savgol_coeffs(window_length, polyorder, pos=window_length - half + k, use='dot')
+                             for k in range(half)])
+
+        head_windows = flat[starts[:, None] + window]                      # [V, W, ...]
+        tail_windows = flat[(ends - window_length)[:, None] + window]
+        smoothed[starts[:, None] + np.arange(half)] = np.einsum('kw,vw...->vk...', head_fit, head_windows)
+        smoothed[(ends - half)[:, None] + np.arange(half)] = np.einsum('kw,vw...->vk...', tail_fit, tail_windows)
+
+    if missing.any():
+        smoothed[missing] = np.nan
+        smoothed[too_short] = raw[too_short]
+    return smoothed
+
+def process_batch(sequences, window_length=5, polyorder=2, scores=None, score_threshold=0.3, max_gap=10):
+    """
+    Gates, smooths and normalizes a ragged batch of [T_i, 17, 2] sequences in one pass.
+    Args:
+        scores (list): Matching [T_i, 17] score arrays. Enables confidence gating
+            (see gate_and_fill); None smooths the sequences as they are.
+    Returns:
+        list of (smoothed, normalized, missing) per input sequence; missing is the
+        [T_i, 17] mask of joints left NaN.
+    """
+    if not sequences:
+        return []
+    flat, offsets = pack_sequences(sequences)
+    if scores is not None:
+        flat, missing = gate_and_fill(flat, pack_sequences(scores)[0], score_threshold, max_gap, offsets)
+    else:
+        missing = np.isnan(flat).any(axis=-1)
+    smoothed = smooth_packed(flat, offsets, window_length, polyorder)
+    normalized = normalize_keypoints(smoothed)
+    return list(zip(unpack_sequences(smoothed, offsets), unpack_sequences(normalized, offsets),
+                    unpack_sequences(missing, offsets)))
+
+def reprocess_outputs(input_dir, output_dir=None, window_length=5, polyorder=2, score_threshold=0.3, max_gap=10):
+    """
+    Re-derives smoothed_keypoints / normalized_keypoints (and the confidence-gating
+    `missing` mask) for every output in input_dir (.json and .npz) from its
+    raw_keypoints and scores, without re-running pose inference. Each file is
+    written back in the format it was read in. Raw-only outputs (see
+    pose_archive.PoseResult) derive these on read, so only their stored
+    parameters are updated.
+    """
+    from pose_archive import load_output, save_output
+
+    output_dir = output_dir or input_dir
+    os.makedirs(output_dir, exist_ok=True)
+
+    paths = sorted(glob.glob(os.path.join(input_dir, "*.json")) + glob.glob(os.path.join(input_dir, "*.npz")))
+    packets = [load_output(path) for path in paths]
+    logger.info(f"Loaded {len(packets)} outputs from {input_dir}")
+
+    full = [p for p in packets if not p.raw_only]
+    raws = [np.asarray(p['raw_keypoints'], dtype=float).reshape(-1, 17, 2) for p in full]
+    scores = [np.asarray(p['scores'], dtype=float).reshape(-1, 17) for p in full]
+    results = process_batch(raws, window_length, polyorder, scores, score_threshold, max_gap)
+    for packet, (smoothed, normalized, missing) in zip(full, results):
+        packet['smoothed_keypoints'] = smoothed
+        packet['normalized_keypoints'] = normalized
+        packet['missing'] = missing
+    for path, packet in zip(paths, packets):
+        packet['postprocess'] = postprocess_params(score_threshold, max_gap, window_length, polyorder)
+        # Written beside the target and swapped in, so an in-place rewrite never truncates a file being read.
+        # JSON outputs saved before gaps became null also lose their bare NaN tokens here.
+        target = os.path.join(output_dir, os.path.basename(path))
+        base, ext = os.path.splitext(target)
+        save_output(packet, f"{base}.tmp{ext}")
+        os.replace(f"{base}.tmp{ext}", target)
+
+    logger.info(f"Re-processed {len(packets)} outputs into {output_dir}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-run smoothing/normalization over existing pipeline outputs")
+    parser.add_argument("--input_dir", "-i", required=True, help="Directory of processed .json / .npz outputs")
+    parser.add_argument("--output_dir", "-o", default=None, help="Where to write updated outputs (default: in place)")
+    parser.add_argument("--window", type=int, default=5, help="Savitzky-Golay window length")
+    parser.add_argument("--polyorder", type=int, default=2, help="Savitzky-Golay polynomial order")
+    parser.add_argument("--score-threshold", type=float, default=0.3, help="Drop keypoints scoring below this")
+    parser.add_argument("--max-gap", type=int, default=10,
+                        help="Interpolate dropped runs up to this many frames; longer ones stay NaN")
+
+    args = parser.parse_args()
+    reprocess_outputs(args.input_dir, args.output_dir, args.window, args.polyorder, args.score_threshold, args.max_gap)
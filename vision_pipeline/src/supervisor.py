@@ -0,0 +1,266 @@
+import os
+import json
+import time
+import signal
+import logging
+import argparse
+import collections
+import multiprocessing
+from multiprocessing.connection import wait
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+_STAGE_BYTES = 32
+# Hidden, so globs over the output directory (*.json) do not take it for a pipeline output
+QUARANTINE_FILE = '.quarantine.json'
+
+def video_budget(frames, per_frame, minimum=60.0):
+    """Wall-clock seconds a video may take: per_frame for every expected frame, at least `minimum`."""
+    return max(minimum, (frames or 0) * per_frame)
+
+def _worker_main(conn, stage, initializer, initargs, task):
+    """Worker process: load once via initializer, then run tasks sent by the pool until told to stop."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)   # Ctrl-C is the supervisor's to handle
+
+    def on_stage(name):
+        stage.value = name.encode('utf-8')[:_STAGE_BYTES - 1]
+
+    if initializer is not None:
+        initializer(*initargs)
+    conn.send(('ready', None, None))
+    while True:
+        item = conn.recv()
+        if item is None:
+            return
+        key, args = item
+        on_stage('start')
+        conn.send(('result', key, task(*args, on_stage=on_stage)))
+
+class _Worker:
+    def __init__(self, ctx, initializer, initargs, task):
+        self.conn, child_conn = ctx.Pipe()
+        self.stage = ctx.Array('c', _STAGE_BYTES)
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, self.stage, initializer, initargs, task),
+                                   daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.spawned = time.monotonic()
+        self.ready = False
+        self.task = None        # (key, started, deadline)
+
+    @property
+    def current_stage(self):
+        return self.stage.value.decode('utf-8', 'replace') or None
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+class SupervisedPool:
+    """
+    Process pool where every task has a wall-clock deadline. Each worker
+    process loads its model once (initializer) and runs one task at a time; a
+    worker whose task misses its deadline, or that dies (segfault, OOM kill),
+    is killed and replaced, and only that task fails. The stage the task last
+    entered is reported with it. Healthy tasks keep flowing on the other workers.
+
+        pool = SupervisedPool(4, _init_worker, initargs, _process_in_worker)
+        for key, result, failure, stage in pool.run([(video, args, budget_s), ...]):
+            ...
+
+    `task` is called as task(*args, on_stage=callback) in the worker.
+    """
+    def __init__(self, workers, initializer, initargs, task, start_timeout=600.0, max_start_failures=3):
+        self.workers = max(1, int(workers))
+        self.initializer = initializer
+        self.initargs = initargs
+        self.task = task
+        self.start_timeout = start_timeout
+        self.max_start_failures = max_start_failures
+        self._ctx = multiprocessing.get_context('spawn')
+        self._start_failures = 0
+
+    def _spawn(self):
+        return _Worker(self._ctx, self.initializer, self.initargs, self.task)
+
+    def _replace(self, pool, worker, started, respawn=True):
+        worker.kill()
+        if not started:
+            self._start_failures += 1
+            if self._start_failures >= self.max_start_failures:
+                raise RuntimeError(f"{self._start_failures} workers failed to start (model load error?)")
+        if respawn:
+            pool[pool.index(worker)] = self._spawn()
+        else:
+            pool.remove(worker)
+
+    def run(self, tasks):
+        """
+        Args:
+            tasks: iterable of (key, args, timeout_seconds).
+        Yields:
+            (key, result, failure, stage): result is the task's return value, or None
+            when the worker timed out or died; failure is then a dict with 'error' and
+            'seconds'. stage is the last stage the task entered.
+        """
+        pending = collections.deque(tasks)
+        pool = [self._spawn() for _ in range(min(self.workers, len(pending)) or 1)]
+        try:
+            while pending or any(w.task for w in pool):
+                for worker in pool:
+                    if worker.ready and worker.task is None and pending:
+                        key, args, timeout = pending.popleft()
+                        worker.task = (key, time.monotonic(), time.monotonic() + timeout)
+                        worker.conn.send((key, args))
+
+                now = time.monotonic()
+                deadlines = [w.task[2] for w in pool if w.task] + [w.spawned + self.start_timeout
+                                                                   for w in pool if not w.ready]
+                timeout = max(0.0, min(deadlines) - now) if deadlines else 1.0
+                ready = wait([w.conn for w in pool] + [w.process.sentinel for w in pool], timeout=min(timeout, 1.0))
+
+                for worker in list(pool):
+                    if worker.conn in ready:
+                        try:
+                            kind, key, result = worker.conn.recv()
+                        except (EOFError, OSError):
+                            kind = None
+                        if kind == 'ready':
+                            worker.ready = True
+                            self._start_failures = 0
+                            continue
+                        if kind == 'result':
+                            worker.task = None
+                            yield key, result, None, worker.current_stage
+                            continue
+                    if worker.process.sentinel in ready or (worker.conn in ready and kind is None):
+                        worker.process.join(timeout=1.0)
+                        if worker.task:
+                            key, started, _ = worker.task
+                            stage, exitcode = worker.current_stage, worker.process.exitcode
+                            self._replace(pool, worker, worker.ready, bool(pending))
+                            yield key, None, {"error": f"worker died (exit code {exitcode})",
+                                              "seconds": time.monotonic() - started}, stage
+                        else:
+                            self._replace(pool, worker, worker.ready, bool(pending))
+
+                now = time.monotonic()
+                for worker in list(pool):
+                    if worker.task and now > worker.task[2]:
+                        key, started, deadline = worker.task
+                        stage = worker.current_stage
+                        self._replace(pool, worker, True, bool(pending))
+                        yield key, None, {"error": f"timed out after {deadline - started:.1f}s",
+                                          "seconds": now - started}, stage
+                    elif not worker.ready and now > worker.spawned + self.start_timeout:
+                        logger.error(f"Worker did not start within {self.start_timeout:.0f}s, replacing it.")
+                        self._replace(pool, worker, False)
+        finally:
+            # Idle workers exit cleanly; busy ones (the caller stopped early) and ones still loading are killed
+            for worker in pool:
+                if worker.process.is_alive() and worker.task is None and worker.ready:
+                    try:
+                        worker.conn.send(None)
+                    except OSError:
+                        worker.process.kill()
+                else:
+                    worker.process.kill()
+            for worker in pool:
+                worker.process.join(timeout=5.0)
+                if worker.process.is_alive():
+                    worker.process.kill()
+                    worker.process.join()
+
+class Quarantine:
+    """
+    Persistent record of videos that failed, timed out or crashed their worker,
+    with the failing stage of each attempt (a JSON report, by default
+    <output_dir>/.quarantine.json). After max_strikes failures in a row a video
+    is quarantined: batch runs skip it until the file changes or it is released.
+    A successful run clears its record.
+    """
+    def __init__(self, path, max_strikes=2, history=5):
+        self.path = path
+        self.max_strikes = max_strikes
+        self.history = history
+        self.videos = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.videos = json.load(f).get("videos", {})
+
+    def _entry(self, video_path):
+        """The record of video_path, dropped first if the file changed since it was written."""
+        path = os.path.abspath(video_path)
+        entry = self.videos.get(path)
+        if entry is not None:
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                return entry
+            if (entry["size"], entry["mtime_ns"]) != (st.st_size, st.st_mtime_ns):
+                del self.videos[path]
+                return None
+        return entry
+
+    def is_quarantined(self, video_path):
+        entry = self._entry(video_path)
+        return bool(entry and entry["quarantined"])
+
+    def strike(self, video_path, error, stage=None, seconds=None, budget=None):
+        """Records a failure; returns True if the video is now quarantined."""
+        path = os.path.abspath(video_path)
+        try:
+            st = os.stat(path)
+            size, mtime_ns = st.st_size, st.st_mtime_ns
+        except FileNotFoundError:   # deleted while it ran; a file reappearing under this name starts afresh
+            size = mtime_ns = None
+        entry = self._entry(path) or {"strikes": 0, "quarantined": False, "size": size,
+                                      "mtime_ns": mtime_ns, "failures": []}
+        entry["strikes"] += 1
+        entry["failures"] = (entry["failures"] + [{"at": time.time(), "error": error, "stage": stage,
+                                                   "seconds": seconds, "budget": budget}])[-self.history:]
+        newly = not entry["quarantined"] and entry["strikes"] >= self.max_strikes
+        entry["quarantined"] = entry["quarantined"] or newly
+        self.videos[path] = entry
+        if newly:
+            logger.warning(f"Quarantined {os.path.basename(path)} after {entry['strikes']} failures "
+                           f"(last: {error}, stage: {stage})")
+        return entry["quarantined"]
+
+    def clear(self, video_path):
+        self.videos.pop(os.path.abspath(video_path), None)
+
+    def release(self, video_paths=None):
+        """Lets quarantined videos (all if None) be tried again; their failure history is kept."""
+        for path, entry in self.videos.items():
+            if video_paths is None or path in {os.path.abspath(p) for p in video_paths}:
+                entry["quarantined"] = False
+                entry["strikes"] = 0
+
+    def quarantined(self):
+        return {path: entry for path, entry in self.videos.items() if entry["quarantined"]}
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({"max_strikes": self.max_strikes, "videos": self.videos}, f, indent=2)
+        os.replace(tmp, self.path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show or release quarantined videos")
+    parser.add_argument("report", help="Quarantine report (e.g. out/.quarantine.json)")
+    parser.add_argument("--release", nargs="*", default=None,
+                        help="Release these videos (all quarantined ones if none are given)")
+
+    args = parser.parse_args()
+
+    quarantine = Quarantine(args.report)
+    if args.release is not None:
+        quarantine.release(args.release or None)
+        quarantine.save()
+    for path, entry in sorted(quarantine.videos.items()):
+        last = entry["failures"][-1] if entry["failures"] else {}
+        state = "QUARANTINED" if entry["quarantined"] else f"{entry['strikes']} strike(s)"
+        print(f"{state:>12}  {path}\n              last: {last.get('error')} (stage: {last.get('stage')})")
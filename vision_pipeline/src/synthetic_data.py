@@ -0,0 +1,88 @@
+import numpy as np
+import cv2
+
+# Standing pose in COCO order, relative to the mid-hip, in torso lengths (y points down)
+STANDING_POSE = np.array([
+    [0.00, -1.45],                  # 0 nose
+    [-0.06, -1.52], [0.06, -1.52],  # 1,2 eyes
+    [-0.12, -1.48], [0.12, -1.48],  # 3,4 ears
+    [-0.25, -1.00], [0.25, -1.00],  # 5,6 shoulders
+    [-0.30, -0.55], [0.30, -0.55],  # 7,8 elbows
+    [-0.32, -0.10], [0.32, -0.10],  # 9,10 wrists
+    [-0.15, 0.00], [0.15, 0.00],    # 11,12 hips
+    [-0.17, 0.60], [0.17, 0.60],    # 13,14 knees
+    [-0.18, 1.20], [0.18, 1.20],    # 15,16 ankles
+])
+
+def generate_synthetic_squat(frames=100, noise_level=5.0):
+    """
+    Generates a synthetic 'squat' trajectory for a single keypoint (e.g., Hip Y).
+    """
+    t = np.linspace(0, 2*np.pi, frames)
+    # Squat movement: Go down (sin increases) then up
+    clean_movement = np.sin(t - np.pi/2) * 50 + 300 # Center around Y=300
+
+    # Add Camera Jitter (High frequency noise)
+    noise = np.random.normal(0, noise_level, frames)
+    jittery_movement = clean_movement + noise
+
+    # Construct Mock Keypoints [Frames, 17, 2]
+    # We will put this movement on the Left Hip (Index 11)
+    keypoints = np.zeros((frames, 17, 2))
+    keypoints[:, :, 0] = 100 # Constant X
+    keypoints[:, 11, 1] = jittery_movement
+
+    return t, clean_movement, jittery_movement, keypoints
+
+def generate_synthetic_skeletons(frames=100, persons=1, width=640, height=480, reps=2, noise_level=2.0, seed=0):
+    """
+    Full 17-joint squat sequences for one or more people side by side.
+    Returns:
+        keypoints (np.ndarray): [Persons, Frames, 17, 2] pixel coordinates.
+        scores (np.ndarray): [Persons, Frames, 17] in (0, 1].
+    """
+    rng = np.random.default_rng(seed)
+    torso = height * 0.22
+    # 0 = standing, 1 = bottom of the squat
+    depth = (1 - np.cos(np.linspace(0, 2 * np.pi * reps, frames))) / 2
+
+    keypoints = np.empty((persons, frames, 17, 2))
+    for p in range(persons):
+        pose = np.broadcast_to(STANDING_POSE, (frames, 17, 2)).copy()
+        # Hips drop and knees push forward; everything above the hips follows the hips
+        pose[:, :13, 1] += depth[:, None] * 0.45
+        pose[:, 13:15, 0] *= 1 + depth[:, None] * 0.8
+        pose[:, 13:15, 1] += depth[:, None] * 0.15
+
+        center_x = width * (p + 1) / (persons + 1)
+        center_y = height * 0.55
+        keypoints[p] = pose * torso + [center_x, center_y]
+
+    keypoints += rng.normal(0, noise_level, keypoints.shape)
+    scores = np.clip(rng.normal(0.9, 0.05, keypoints.shape[:-1]), 0.05, 1.0)
+    return keypoints, scores
+
+def write_synthetic_video(path, keypoints, width=640, height=480, fps=30.0):
+    """
+    Renders stick figures for [Persons, Frames, 17, 2] keypoints into a video,
+    giving decode/visualization benchmarks a real file to work on.
+    """
+    from visualizer import SKELETON
+
+    keypoints = np.asarray(keypoints)
+    if keypoints.ndim == 3:
+        keypoints = keypoints[None]
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    pts = np.rint(keypoints).astype(np.int32)
+    edges = np.array(SKELETON)
+    try:
+        for f in range(keypoints.shape[1]):
+            frame = np.full((height, width, 3), 40, dtype=np.uint8)
+            for person in pts[:, f]:
+                cv2.polylines(frame, person[edges], False, (230, 230, 230), max(2, width // 200))
+                for x, y in person:
+                    cv2.circle(frame, (int(x), int(y)), max(3, width // 160), (200, 120, 60), -1)
+            writer.write(frame)
+    finally:
+        writer.release()
+    return path
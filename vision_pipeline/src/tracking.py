@@ -0,0 +1,198 @@
+import logging
+import numpy as np
+from pose_backends import NUM_KEYPOINTS
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def visible_bbox(keypoints, scores, min_score=0.3):
+    """(x1, y1, x2, y2) around the joints scoring at least min_score (all joints if none do)."""
+    visible = scores >= min_score
+    points = keypoints[visible] if visible.any() else keypoints
+    return np.concatenate([points.min(axis=0), points.max(axis=0)])
+
+def match_costs(track_keypoints, track_scores, keypoints, scores, min_score=0.3):
+    """
+    Distance from one tracked pose to every candidate person in a frame, in one vectorised pass.
+    Args:
+        track_keypoints (np.ndarray): [17, 2] (predicted) pose of the track.
+        track_scores (np.ndarray): [17]
+        keypoints (np.ndarray): [P, 17, 2] candidates.
+        scores (np.ndarray): [P, 17]
+    Returns:
+        costs (np.ndarray): [P] mean distance over joints visible in both poses, in units of
+            the track's box diagonal. inf for candidates sharing no visible joint.
+    """
+    visible = (np.asarray(scores) >= min_score) & (np.asarray(track_scores) >= min_score)
+    distances = np.linalg.norm(np.asarray(keypoints) - track_keypoints, axis=-1)
+    bbox = visible_bbox(track_keypoints, track_scores, min_score)
+    scale = max(np.hypot(bbox[2] - bbox[0], bbox[3] - bbox[1]), 1.0)
+    counts = visible.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        costs = np.where(visible, distances, 0.0).sum(axis=1) / counts / scale
+    costs[counts == 0] = np.inf
+    return costs
+
+class PoseTracker:
+    """
+    Follows one athlete through a video. The person detector runs only on
+    keyframes or when the track is lost; in between, pose runs on a crop
+    predicted from the previous frames (PoseBackend.infer_rois), and each
+    frame's detections are associated with the track by pose distance, so the
+    output stays on the same person instead of whoever the detector lists first.
+
+        tracker = PoseTracker(backend, keyframe_interval=30)
+        for frames in consecutive_batches:
+            keypoints, scores = tracker.infer(frames)
+
+    Use one tracker per video; it carries state between calls.
+    """
+    def __init__(self, backend, keyframe_interval=30, min_confidence=0.3, max_match_cost=0.5, margin=0.25,
+                 min_score=0.3, initial='largest'):
+        """
+        Args:
+            backend (pose_backends.PoseBackend): Loaded backend.
+            keyframe_interval (int): Frames between forced full-frame detections (1 = every frame).
+            min_confidence (float): Mean keypoint score below which a crop result counts as
+                lost and the frame is re-run with full-frame detection.
+            max_match_cost (float): Largest match_costs() value (against the predicted pose)
+                accepted as the same person. Someone further away is treated as a different person.
+            margin (float): Crop padding on each side, as a fraction of the predicted box size.
+            min_score (float): Keypoint score for a joint to count as visible.
+            initial (str): Who to lock on to when there is no track: 'largest' box or 'best_score'.
+        """
+        if initial not in ('largest', 'best_score'):
+            raise ValueError(f"Unknown initial selection '{initial}'. Expected 'largest' or 'best_score'.")
+        self.backend = backend
+        self.keyframe_interval = max(1, int(keyframe_interval))
+        self.min_confidence = min_confidence
+        self.max_match_cost = max_match_cost
+        self.margin = margin
+        self.min_score = min_score
+        self.initial = initial
+        self.reset()
+
+    @property
+    def params(self):
+        """Settings that change the output, for inference cache keys."""
+        return {"keyframe_interval": self.keyframe_interval, "min_confidence": self.min_confidence,
+                "max_match_cost": self.max_match_cost, "margin": self.margin, "min_score": self.min_score,
+                "initial": self.initial}
+
+    def reset(self):
+        """Forgets the track (call between videos when reusing a tracker)."""
+        self._keypoints = None
+        self._scores = None
+        self._velocity = np.zeros((NUM_KEYPOINTS, 2))
+        self._gap = 0            # frames since the last matched frame
+        self._since_detect = 0   # frames since the last full-frame detection
+        self._force_detect = True
+        self.stats = {"detections": 0, "redetections": 0, "roi_frames": 0, "lost_frames": 0}
+
+    def summary(self):
+        s = self.stats
+        return (f"{s['detections']} full-frame detections ({s['redetections']} after losing the track), "
+                f"{s['roi_frames']} crop-only frames, {s['lost_frames']} frames without the athlete")
+
+    def _predict(self, steps):
+        """Constant-velocity poses `steps` frames after the last match. [M] -> [M, 17, 2]"""
+        return self._keypoints[None] + np.asarray(steps, dtype=float)[:, None, None] * self._velocity[None]
+
+    def _rois(self, poses):
+        """Padded crop boxes around predicted poses. [M, 17, 2] -> [M, 4]"""
+        visible = self._scores >= self.min_score
+        points = poses[:, visible] if visible.any() else poses
+        lo, hi = points.min(axis=1), points.max(axis=1)
+        pad = (hi - lo) * self.margin
+        return np.concatenate([lo - pad, hi + pad], axis=1)
+
+    def _associate(self, instances, steps=1):
+        """Index of the tracked person among `instances`, or None if nobody matches."""
+        if not len(instances.keypoints):
+            return None
+        if self._keypoints is None:
+            if self.initial == 'best_score':
+                return int(np.argmax(instances.scores.mean(axis=1)))
+            bboxes = instances.bboxes
+            return int(np.argmax((bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])))
+        costs = match_costs(self._predict([steps])[0], self._scores, instances.keypoints, instances.scores,
+                            self.min_score)
+        best = int(np.argmin(costs))
+        return best if costs[best] <= self.max_match_cost else None
+
+    def _update(self, keypoints, scores):
+        if self._keypoints is not None:
+            step_velocity = (keypoints - self._keypoints) / max(self._gap, 1)
+            self._velocity = 0.5 * self._velocity + 0.5 * step_velocity
+        self._keypoints = np.array(keypoints, dtype=float)
+        self._scores = np.array(scores, dtype=float)
+        self._gap = 1
+
+    def _detect(self, frame):
+        """Full-frame detection for one frame; (keypoints, scores) of the tracked person or None."""
+        instances = self.backend.infer_instances([frame])[0]
+        self.stats["detections"] += 1
+        if self._keypoints is not None and self._force_detect:
+            self.stats["redetections"] += 1
+        self._since_detect = 0
+
+        idx = self._associate(instances, self._gap)
+        if idx is None and self._keypoints is not None and self._gap >= self.keyframe_interval:
+            # Gone for a whole keyframe interval: start over on whoever is there now
+            logger.info("Lost the tracked athlete, re-initializing the track.")
+            self._keypoints = None
+            self._velocity[:] = 0
+            idx = self._associate(instances)
+        if idx is None:
+            self._force_detect = True
+            return None
+
+        keypoints, scores = instances.keypoints[idx], instances.scores[idx]
+        self._update(keypoints, scores)
+        # A weak detection is still reported, but the next frame is detected again
+        self._force_detect = scores.mean() < self.min_confidence
+        return keypoints, scores
+
+    def infer(self, frames, fill_value=0.0):
+        """
+        Tracks the athlete through the next consecutive frames of the video.
+        Args:
+            frames (list): BGR frames following the previous call's.
+            fill_value (float): Keypoint value for frames without the athlete.
+        Returns:
+            keypoints (np.ndarray): [N, 17, 2]
+            scores (np.ndarray): [N, 17]
+        """
+        frames = list(frames)
+        keypoints = np.full((len(frames), NUM_KEYPOINTS, 2), fill_value, dtype=float)
+        scores = np.zeros((len(frames), NUM_KEYPOINTS))
+
+        i = 0
+        while i < len(frames):
+            if self._force_detect or self._keypoints is None or self._since_detect >= self.keyframe_interval:
+                found = self._detect(frames[i])
+                if found is None:
+                    self.stats["lost_frames"] += 1
+                    self._gap += 1
+                else:
+                    keypoints[i], scores[i] = found
+                self._since_detect += 1
+                i += 1
+                continue
+
+            # Crop-only run up to the next keyframe, all crops predicted from the last match
+            end = min(len(frames), i + self.keyframe_interval - self._since_detect)
+            steps = self._gap + np.arange(end - i)
+            rois = self._rois(self._predict(steps))
+            for k, instances in enumerate(self.backend.infer_rois(frames[i:end], rois)):
+                idx = self._associate(instances, self._gap)
+                if idx is None or instances.scores[idx].mean() < self.min_confidence:
+                    # Re-run this frame with full detection; later crops were predicted from a stale pose
+                    self._force_detect = True
+                    break
+                keypoints[i], scores[i] = instances.keypoints[idx], instances.scores[idx]
+                self._update(keypoints[i], scores[i])
+                self.stats["roi_frames"] += 1
+                self._since_detect += 1
+                i += 1
+        return keypoints, scores
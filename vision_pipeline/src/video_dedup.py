@@ -0,0 +1,375 @@
+import os
+import sqlite3
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fingerprints (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    duration REAL,
+    pixels INTEGER,
+    hashes BLOB,
+    informative BLOB,
+    fps REAL,
+    frame_count INTEGER,
+    width INTEGER,
+    height INTEGER
+);
+CREATE TABLE IF NOT EXISTS duplicates (
+    path TEXT PRIMARY KEY,
+    canonical TEXT,
+    scale_x REAL,
+    scale_y REAL
+);
+"""
+
+# Columns added after the first release; fingerprint rows without them are fingerprinted again
+_ADDED_COLUMNS = {
+    "fingerprints": (("fps", "REAL"), ("frame_count", "INTEGER"), ("width", "INTEGER"), ("height", "INTEGER")),
+    "duplicates": (("scale_x", "REAL"), ("scale_y", "REAL")),
+}
+
+# Copies are aligned by time, not frame number. Their frame rates may differ by this
+# fraction (29.97 vs 30 fps) and their durations by FRAME_TOLERANCE frames (a re-mux
+# dropping or repeating a frame at either end); beyond that they are processed on their own.
+FPS_TOLERANCE = 0.01
+FRAME_TOLERANCE = 2
+
+# Frames whose grey levels barely vary (black, fades, title cards) hash to noise and are ignored
+_MIN_FRAME_STD = 4.0
+
+def frame_hash(frame):
+    """
+    64-bit DCT perceptual hash of one BGR frame: the 8x8 lowest frequencies of a
+    32x32 grey thumbnail, thresholded at their median. Stable under rescaling,
+    re-encoding and bitrate changes.
+    Returns:
+        (hash as np.uint64, informative) where informative is False for near-uniform frames.
+    """
+    grey = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    thumb = cv2.resize(grey, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(thumb)[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    return np.packbits(bits).view('>u8')[0].astype(np.uint64), float(thumb.std()) >= _MIN_FRAME_STD
+
+def video_fingerprint(video_path, samples=16):
+    """
+    Hashes `samples` frames taken at the same fractions of the video's duration,
+    so copies at another frame rate or resolution sample the same moments.
+    Returns:
+        dict with 'duration', 'pixels', 'fps', 'frame_count', 'width', 'height',
+        'hashes' [samples] uint64 and 'informative' [samples] bool, or None if the
+        video cannot be read.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return None
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if frame_count <= 0:
+            return None
+        hashes = np.zeros(samples, dtype=np.uint64)
+        informative = np.zeros(samples, dtype=bool)
+        for i in range(samples):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, min(frame_count - 1, int((i + 0.5) / samples * frame_count)))
+            ok, frame = cap.read()
+            if ok:
+                hashes[i], informative[i] = frame_hash(frame)
+        width, height = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        return {
+            "duration": frame_count / fps,
+            "pixels": width * height,
+            "fps": fps,
+            "frame_count": frame_count,
+            "width": width,
+            "height": height,
+            "hashes": hashes,
+            "informative": informative,
+        }
+    finally:
+        cap.release()
+
+def same_timing(a, b):
+    """
+    True when two fingerprints cover the same time span frame for frame: frame rates
+    within FPS_TOLERANCE and durations within FRAME_TOLERANCE frames. Resolution may
+    differ, since a shared result is rescaled to the copy's pixels (see share_result).
+    """
+    fps = max(a["fps"], b["fps"])
+    return (abs(a["fps"] - b["fps"]) <= FPS_TOLERANCE * fps
+            and abs(a["frame_count"] / a["fps"] - b["frame_count"] / b["fps"]) * fps <= FRAME_TOLERANCE)
+
+def share_result(packet, alignment, video_path):
+    """
+    A duplicate's result made from its canonical copy's data packet. Frames are
+    matched by time (the nearest canonical frame, over the canonical's time span)
+    and keypoints are rescaled to the duplicate's resolution.
+    Args:
+        packet (dict): The canonical output (see pose_archive.load_output).
+        alignment (dict): VideoDeduplicator.alignment() of the duplicate.
+        video_path (str): The duplicate video.
+    Returns:
+        PoseResult with the same stored fields as `packet` (raw-only stays raw-only).
+    """
+    from pose_archive import PoseResult, ARRAY_FIELDS, MASK_FIELDS
+    from signal_processing import normalize_keypoints
+
+    frames = len(packet["raw_keypoints"])
+    # Canonical frames per duplicate frame; frame strides cancel out
+    ratio = alignment["canonical_fps"] / alignment["fps"]
+    count = int(round(frames / ratio))
+    index = np.minimum(np.round(np.arange(count) * ratio).astype(int), frames - 1)
+
+    shared = dict(packet.items())    # stored fields only
+    for field in ARRAY_FIELDS + MASK_FIELDS:
+        if field in shared:
+            shared[field] = np.asarray(shared[field])[index]
+    scale = np.array([alignment["scale_x"], alignment["scale_y"]])
+    for field in ("raw_keypoints", "smoothed_keypoints"):
+        if field in shared:
+            shared[field] = shared[field].reshape(count, 17, 2) * scale
+    if "normalized_keypoints" in shared:
+        # Torso normalization is not invariant to an aspect-ratio change
+        shared["normalized_keypoints"] = normalize_keypoints(shared["smoothed_keypoints"])
+
+    shared["video_id"] = os.path.basename(video_path)
+    shared["frame_count"] = count
+    for key in ("fps", "source_fps"):
+        if shared.get(key):
+            shared[key] = shared[key] / ratio
+    if alignment["width"]:
+        shared["resolution"] = [alignment["width"], alignment["height"]]
+    if "inferred" in shared:
+        shared["skip_ratio"] = float(1.0 - shared["inferred"].mean()) if count else 0.0
+    return PoseResult(shared)
+
+def fingerprint_distance(a, b):
+    """
+    Median Hamming distance (0-64 bits) between the hashes of frames informative
+    in both fingerprints, or None when fewer than half of them are.
+    """
+    both = a["informative"] & b["informative"]
+    if both.sum() < len(both) / 2:
+        return None
+    xor = (a["hashes"][both] ^ b["hashes"][both]).astype('>u8').view(np.uint8).reshape(-1, 8)
+    return float(np.median(np.unpackbits(xor, axis=1).sum(axis=1)))
+
+class VideoDeduplicator:
+    """
+    Finds re-encodes and renamed copies of the same clip before inference, and
+    maps each to one canonical video whose result they share. Fingerprints and
+    the duplicate -> canonical mapping live in the manifest's SQLite file (see
+    manifest_index.py); fingerprints are only recomputed for new or changed files.
+
+        dedup = VideoDeduplicator('out/manifest.sqlite')
+        duplicates = dedup.deduplicate(paths)      # {duplicate path: canonical path}
+        dedup.canonical('videos/clip (1).mp4')
+
+    Two videos are duplicates when they cover the same time span at about the
+    same frame rate (see same_timing) and the median Hamming distance of their
+    frame hashes is at most max_distance bits; resolutions may differ. The
+    canonical copy of a group is the one already canonical from an earlier run,
+    else the one with the most pixels (then the largest file). Each duplicate
+    stores its x/y scale to the canonical copy, applied by share_result().
+    """
+    def __init__(self, path, samples=16, max_distance=10, duration_tolerance=0.02, workers=4):
+        self.path = path
+        self.samples = samples
+        self.max_distance = max_distance
+        self.duration_tolerance = duration_tolerance
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+            for table, added in _ADDED_COLUMNS.items():
+                columns = {row['name'] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+                for name, kind in added:
+                    if name not in columns:
+                        self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {kind}")
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def fingerprints(self, paths):
+        """Fingerprint per path (None if unreadable), computing only new or changed files."""
+        stats = {}
+        for path in map(os.path.abspath, paths):
+            try:
+                stats[path] = os.stat(path)
+            except FileNotFoundError:
+                logger.warning(f"{path} vanished before fingerprinting, skipping it.")
+        paths = list(stats)
+        stored = {}
+        for row in self._conn.execute("SELECT * FROM fingerprints"):
+            st = stats.get(row['path'])
+            if (st is not None and (row['size'], row['mtime_ns']) == (st.st_size, st.st_mtime_ns)
+                    and (row['hashes'] is None or row['frame_count'] is not None)):
+                stored[row['path']] = row
+
+        todo = [p for p in paths if p not in stored]
+        if todo:
+            logger.info(f"Fingerprinting {len(todo)} videos ({len(paths) - len(todo)} unchanged)")
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                computed = dict(zip(todo, pool.map(lambda p: video_fingerprint(p, self.samples), todo)))
+            with self._lock, self._conn:
+                for path, fp in computed.items():
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO fingerprints (path, size, mtime_ns, duration, pixels, hashes, informative, "
+                        "fps, frame_count, width, height) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (path, stats[path].st_size, stats[path].st_mtime_ns,
+                         fp["duration"] if fp else None, fp["pixels"] if fp else None,
+                         fp["hashes"].tobytes() if fp else None, fp["informative"].tobytes() if fp else None,
+                         fp["fps"] if fp else None, fp["frame_count"] if fp else None,
+                         fp["width"] if fp else None, fp["height"] if fp else None))
+        else:
+            computed = {}
+
+        result = {}
+        for path in paths:
+            if path in computed:
+                result[path] = computed[path]
+                continue
+            row = stored[path]
+            hashes = np.frombuffer(row['hashes'], dtype=np.uint64) if row['hashes'] is not None else None
+            # Fingerprints taken with another sample count are not comparable; redo them next time
+            if hashes is None or len(hashes) != self.samples:
+                result[path] = None
+                continue
+            result[path] = {"duration": row['duration'], "pixels": row['pixels'], "fps": row['fps'],
+                            "frame_count": row['frame_count'], "width": row['width'], "height": row['height'],
+                            "hashes": hashes, "informative": np.frombuffer(row['informative'], dtype=bool)}
+        return result
+
+    def _pairs(self, fingerprints):
+        """Duplicate pairs; only videos of near-equal duration are compared (sorted sweep)."""
+        items = sorted(((fp["duration"], path) for path, fp in fingerprints.items() if fp), key=lambda x: x[0])
+        for i, (duration, path) in enumerate(items):
+            for other_duration, other in items[i + 1:]:
+                if other_duration - duration > max(duration * self.duration_tolerance, 0.1):
+                    break
+                if not same_timing(fingerprints[path], fingerprints[other]):
+                    continue
+                distance = fingerprint_distance(fingerprints[path], fingerprints[other])
+                if distance is not None and distance <= self.max_distance:
+                    yield path, other
+
+    def deduplicate(self, paths):
+        """
+        Groups `paths` into duplicates and stores each duplicate's canonical video.
+        Returns:
+            dict mapping every non-canonical path to its canonical path.
+        """
+        fingerprints = self.fingerprints(paths)
+        parent = {path: path for path in fingerprints}
+
+        def find(path):
+            while parent[path] != path:
+                parent[path] = parent[parent[path]]
+                path = parent[path]
+            return path
+
+        for a, b in self._pairs(fingerprints):
+            parent[find(a)] = find(b)
+        groups = {}
+        for path in fingerprints:
+            groups.setdefault(find(path), []).append(path)
+
+        previous = {row['path']: row['canonical'] for row in self._conn.execute("SELECT * FROM duplicates")}
+        duplicates = {}
+        for members in groups.values():
+            if len(members) < 2:
+                continue
+            # Keep an earlier canonical (its result may exist already), else the highest resolution, then the
+            # largest file (highest bitrate)
+            earlier = [m for m in members if m in set(previous.get(p) for p in members)]
+            canonical = earlier[0] if earlier else max(
+                members, key=lambda p: (fingerprints[p]["pixels"], os.path.getsize(p), p))
+            duplicates.update({m: canonical for m in members if m != canonical})
+
+        rows = []
+        for path, canonical in duplicates.items():
+            fp, canonical_fp = fingerprints[path], fingerprints[canonical]
+            rows.append((path, canonical, fp["width"] / canonical_fp["width"], fp["height"] / canonical_fp["height"]))
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM duplicates WHERE path = ?", [(p,) for p in fingerprints])
+            self._conn.executemany("INSERT INTO duplicates (path, canonical, scale_x, scale_y) VALUES (?, ?, ?, ?)",
+                                   rows)
+        if duplicates:
+            logger.info(f"{len(duplicates)} of {len(fingerprints)} videos are duplicates of "
+                        f"{len(set(duplicates.values()))} others")
+        return duplicates
+
+    def canonical(self, path):
+        """The canonical video `path` shares its result with (itself if it is not a duplicate)."""
+        path = os.path.abspath(path)
+        row = self._conn.execute("SELECT canonical FROM duplicates WHERE path = ?", (path,)).fetchone()
+        return row['canonical'] if row is not None else path
+
+    def alignment(self, path):
+        """
+        How `path` maps onto its canonical copy, as last stored by deduplicate():
+        dict with 'canonical', 'scale_x', 'scale_y' (duplicate pixels per canonical
+        pixel), the duplicate's 'fps', 'width' and 'height', and 'canonical_fps'.
+        None if `path` is not a duplicate.
+        """
+        row = self._conn.execute(
+            "SELECT d.canonical, d.scale_x, d.scale_y, f.fps, f.width, f.height, c.fps AS canonical_fps "
+            "FROM duplicates d JOIN fingerprints f ON f.path = d.path JOIN fingerprints c ON c.path = d.canonical "
+            "WHERE d.path = ?", (os.path.abspath(path),)).fetchone()
+        if row is None:
+            return None
+        alignment = dict(row)
+        # Rows from before scales were stored only grouped copies of the same resolution
+        for key in ('scale_x', 'scale_y'):
+            if alignment[key] is None:
+                alignment[key] = 1.0
+        return alignment
+
+    def groups(self):
+        """{canonical: [duplicates]} as last stored by deduplicate()."""
+        groups = {}
+        for row in self._conn.execute("SELECT * FROM duplicates ORDER BY path"):
+            groups.setdefault(row['canonical'], []).append(row['path'])
+        return groups
+
+if __name__ == "__main__":
+    from manifest_index import ManifestIndex
+
+    parser = argparse.ArgumentParser(description="Find duplicate / re-encoded videos by perceptual fingerprint")
+    parser.add_argument("index", help="Manifest index file (e.g. out/manifest.sqlite)")
+    parser.add_argument("--input_dir", "-i", default=None, help="Scan and deduplicate this directory first")
+    parser.add_argument("--samples", type=int, default=16, help="Frames hashed per video")
+    parser.add_argument("--max-distance", type=int, default=10, help="Median differing bits (of 64) to still match")
+    parser.add_argument("--workers", "-w", type=int, default=4, help="Videos fingerprinted in parallel")
+
+    args = parser.parse_args()
+
+    with VideoDeduplicator(args.index, args.samples, args.max_distance, workers=args.workers) as dedup:
+        if args.input_dir:
+            with ManifestIndex(args.index) as index:
+                index.scan(args.input_dir)
+                paths = [video['path'] for video in index.videos(args.input_dir)]
+            dedup.deduplicate(paths)
+        for canonical, copies in sorted(dedup.groups().items()):
+            print(canonical)
+            for path in copies:
+                print(f"  = {path}")
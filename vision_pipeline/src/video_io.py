@@ -0,0 +1,194 @@
+import os
+import queue
+import logging
+import threading
+import numpy as np
+import cv2
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def probe_video(video_path):
+    """
+    Reads container metadata without decoding any frames.
+    Returns:
+        dict with 'fps', 'width', 'height', 'frame_count' and 'codec' (FourCC string).
+    """
+    if not os.path.exists(video_path):
+        raise FileNotFoundError(f"Video {video_path} not found.")
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Could not open video {video_path}")
+
+    try:
+        fourcc = int(cap.get(cv2.CAP_PROP_FOURCC))
+        return {
+            "fps": float(cap.get(cv2.CAP_PROP_FPS)) or None,
+            "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "frame_count": int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+            "codec": "".join(chr((fourcc >> (8 * i)) & 0xFF) for i in range(4)).strip("\x00 ") or None,
+        }
+    finally:
+        cap.release()
+
+def try_probe_video(video_path):
+    """probe_video() that returns None instead of raising for unreadable files."""
+    try:
+        return probe_video(video_path)
+    except (IOError, FileNotFoundError) as e:
+        logger.warning(f"Could not read metadata of {video_path}: {e}")
+        return None
+
+_END = object()
+
+class VideoFrameReader:
+    """
+    Decodes a video on a background thread into a bounded prefetch queue, so
+    decoding overlaps with inference.
+
+    Frames can be downscaled, strided and trimmed before anything downstream
+    sees them. Keypoints predicted on the delivered frames are mapped back to
+    source pixel coordinates with to_source_coords().
+
+        reader = VideoFrameReader('squat.mp4', max_side=640, frame_stride=2)
+        for frame_idx, frame in reader:
+            ...
+    """
+    def __init__(self, video_path, max_side=None, target_size=None, frame_stride=1, start_time=None, end_time=None,
+                 prefetch=32):
+        """
+        Args:
+            max_side (int): Downscale so the longer side is at most this many pixels.
+            target_size (tuple): Exact (width, height) to resize to. Overrides max_side.
+            frame_stride (int): Keep every n-th frame.
+            start_time (float): Seconds into the video to start at.
+            end_time (float): Seconds into the video to stop at (exclusive).
+            prefetch (int): Max decoded frames waiting in the queue.
+        """
+        self.video_path = video_path
+        self.info = probe_video(video_path)
+        self.frame_stride = max(1, int(frame_stride))
+        self.prefetch = prefetch
+
+        fps = self.info["fps"] or 30.0
+        self.start_frame = int(round(start_time * fps)) if start_time else 0
+        self.end_frame = int(round(end_time * fps)) if end_time else None
+
+        width, height = self.info["width"], self.info["height"]
+        if target_size:
+            self.size = (int(target_size[0]), int(target_size[1]))
+        elif max_side and max(width, height) > max_side:
+            ratio = max_side / float(max(width, height))
+            self.size = (max(1, int(round(width * ratio))), max(1, int(round(height * ratio))))
+        else:
+            self.size = (width, height)
+        # Delivered pixels per source pixel, per axis
+        self.scale = np.array([self.size[0] / float(width or 1), self.size[1] / float(height or 1)])
+
+        self._resume_position = 0
+        self._queue = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def fps(self):
+        """Effective frame rate of the delivered frames (source fps / stride)."""
+        return (self.info["fps"] or 30.0) / self.frame_stride
+
+    @property
+    def params(self):
+        """Settings that change what the model sees (used as inference-cache parameters)."""
+        return {"size": list(self.size), "frame_stride": self.frame_stride,
+                "start_frame": self.start_frame, "end_frame": self.end_frame}
+
+    def output_info(self):
+        """Metadata for the output packet: effective fps plus the source resolution and fps."""
+        return {"fps": self.fps, "width": self.info["width"], "height": self.info["height"],
+                "source_fps": self.info["fps"], "frame_stride": self.frame_stride, "start_frame": self.start_frame}
+
+    def to_source_coords(self, keypoints):
+        """Maps [..., 2] pixel coordinates on delivered frames back to the source resolution."""
+        if np.all(self.scale == 1.0):
+            return keypoints
+        return np.asarray(keypoints) / self.scale
+
+    def resume_at(self, position):
+        """Starts the next iteration at the position-th delivered frame (for resuming an interrupted run)."""
+        self._resume_position = max(0, int(position))
+
+    def _decode(self):
+        cap = cv2.VideoCapture(self.video_path)
+        try:
+            # Stays a multiple of the stride past start_frame, so the stride phase is unchanged
+            frame_idx = self.start_frame + self._resume_position * self.frame_stride
+            if frame_idx:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+            resize = self.size != (self.info["width"], self.info["height"])
+
+            while not self._stop.is_set():
+                if self.end_frame is not None and frame_idx >= self.end_frame:
+                    break
+                if (frame_idx - self.start_frame) % self.frame_stride:
+                    # grab() demuxes/decodes without the colour conversion and copy
+                    if not cap.grab():
+                        break
+                    frame_idx += 1
+                    continue
+
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                if resize:
+                    frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+                self._put((frame_idx, frame))
+                frame_idx += 1
+        except Exception as e:
+            self._put(e)
+        finally:
+            cap.release()
+            self._put(_END)
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def __iter__(self):
+        self._stop.clear()
+        self._queue = queue.Queue(maxsize=max(1, self.prefetch))
+        self._thread = threading.Thread(target=self._decode, name="video-decode", daemon=True)
+        self._thread.start()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _END:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        """Stops the decode thread (also called when iteration ends or is abandoned)."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+def iter_frame_batches(reader, batch_size):
+    """Groups a reader's output into lists of at most batch_size frames: yields (frame_indices, frames)."""
+    indices, frames = [], []
+    for frame_idx, frame in reader:
+        indices.append(frame_idx)
+        frames.append(frame)
+        if len(frames) >= batch_size:
+            yield indices, frames
+            indices, frames = [], []
+    if frames:
+        yield indices, frames
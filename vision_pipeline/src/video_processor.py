@@ -1,26 +1,68 @@
 
 import os
-import json
 import logging
+import contextlib
 import argparse
 import numpy as np
-import cv2
-from scipy.signal import savgol_filter
-from mmpose.apis import MMPoseInferencer
+from signal_processing import gate_and_fill, smooth_keypoints, normalize_keypoints, postprocess_params
+from pose_archive import make_data_packet, save_output, PoseResult
+from video_io import try_probe_video, VideoFrameReader, iter_frame_batches
+from pose_backends import PoseBackend, create_backend, available_backends
+from tracking import PoseTracker
+from adaptive_sampling import MotionGate, fill_skipped
+from chunked import process_video_chunked
+from instrumentation import Recorder, NULL_RECORDER, profiled
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class PoseExtractor:
-    def __init__(self, mode='human', device='cpu'):
+    def __init__(self, mode=None, device='cpu', cache=None, backend='mmpose', warmup=False, score_threshold=0.3,
+                 max_gap=10, raw_only=False):
         """
-        Initialize the MMPose Inferencer.
+        Initialize the pose model through the backend registry (see pose_backends).
         Args:
-            mode (str): 'human' uses RTMPose-Large by default.
-            device (str): 'cuda' or 'cpu'.
+            mode (str): Model for the backend. MMPose: 'human' (RTMPose-Large, the
+                default) or a config name; YOLO: a weights file. None = backend default.
+            device (str): 'cuda', 'cpu' or 'mps'.
+            cache (InferenceCache): Optional cache of raw model output. Videos
+                already in it skip inference and only re-run post-processing.
+            backend (str or PoseBackend): 'mmpose', 'yolo', 'stub', or an already created backend.
+            warmup (bool): Run one dummy batch at load time.
+            score_threshold (float): Keypoints scoring below this are dropped before smoothing.
+            max_gap (int): Dropped runs up to this many frames are interpolated; longer ones
+                stay NaN in the smoothed/normalized output (None = interpolate every gap).
+            raw_only (bool): Store only raw keypoints, scores and the post-processing
+                parameters; smoothed/normalized keypoints are derived on read
+                (see pose_archive.PoseResult). About a third of the output size.
         """
-        logger.info(f"Initializing MMPoseInferencer (mode={mode}, device={device})...")
-        self.inferencer = MMPoseInferencer(mode, device=device)
+        if isinstance(backend, PoseBackend):
+            self.backend = backend
+            if not backend.loaded:
+                backend.load()
+        else:
+            self.backend = create_backend(backend, mode, device, warmup=warmup)
+        self.cache = cache
+        self.score_threshold = score_threshold
+        self.max_gap = max_gap
+        self.raw_only = raw_only
+        self.cache_key = self.backend.cache_key(person='first')
+        if cache is not None:
+            cache.invalidate_stale(self.cache_key["backend"], self.cache_key["model"], self.cache_key["fingerprint"])
+
+    def gate_signal(self, keypoints, scores):
+        """
+        Confidence gating: masks keypoints below score_threshold (and the zero fill of
+        frames without a detection) and interpolates gaps up to max_gap frames.
+        Returns:
+            gated (np.ndarray): [Frames, 17, 2], NaN where a joint stays unknown.
+            missing (np.ndarray): [Frames, 17] bool mask of those joints.
+        """
+        gated, missing = gate_and_fill(keypoints, scores, self.score_threshold, self.max_gap)
+        if missing.any():
+            logger.info(f"Confidence gating left {missing.any(axis=1).sum()} frames with joints missing "
+                        f"(gaps longer than {self.max_gap} frames).")
+        return gated, missing
 
     def smooth_signal(self, keypoints, window_length=5, polyorder=2):
         """
@@ -34,20 +76,12 @@ class PoseExtractor:
             logger.warning(f"Not enough frames to smooth (got {len(keypoints)}, need {window_length}). Returning raw.")
             return keypoints
             
-        smoothed_keypoints = np.zeros_like(keypoints)
-        num_points = keypoints.shape[1]
-        
-        for i in range(num_points):
-            # Smooth X coordinate
-            smoothed_keypoints[:, i, 0] = savgol_filter(keypoints[:, i, 0], window_length, polyorder)
-            # Smooth Y coordinate
-            smoothed_keypoints[:, i, 1] = savgol_filter(keypoints[:, i, 1], window_length, polyorder)
-            
-        return smoothed_keypoints
+        return smooth_keypoints(keypoints, window_length, polyorder)
 
     def normalize_signal(self, keypoints):
         """
         Normalizes coordinates based on Torso Length (Hip-to-Shoulder).
+        Centers every frame at Mid-Hip, then scales by 1 / torso length.
         Assuming COCO format:
         - Left Shoulder: 5
         - Right Shoulder: 6
@@ -55,107 +89,210 @@ class PoseExtractor:
         - Right Hip: 12
         """
         logger.info("Normalizing signal based on torso length...")
-        normalized_keypoints = np.zeros_like(keypoints)
+        return normalize_keypoints(keypoints)
+
+    def infer_frames(self, frames):
+        """
+        Runs pose inference on a batch of decoded BGR frames in one backend call.
+        Returns:
+            keypoints (np.ndarray): [N, 17, 2], zeros where nobody was detected.
+            scores (np.ndarray): [N, 17].
+        """
+        return self.backend.infer(frames)
+
+    def postprocess(self, video_path, raw_keypoints, scores, output_path=None, video_info=None, recorder=None,
+                    inferred=None):
+        """
+        Smooths, normalizes and serializes the raw keypoints of one video.
+        Args:
+            raw_keypoints (np.ndarray): [Frames, 17, 2]
+            scores (np.ndarray): [Frames, 17]
+            video_info (dict): fps/resolution for the output. Probed from the video if None.
+            recorder (instrumentation.Recorder): Optional stage timing.
+            inferred (np.ndarray): Optional [Frames] adaptive-sampling mask, saved with the output.
+        With raw_only, gating/smoothing/normalization are skipped here and a PoseResult
+        that derives them on first access is returned.
+        """
+        recorder = recorder or NULL_RECORDER
+        frames = len(raw_keypoints)
+        params = postprocess_params(self.score_threshold, self.max_gap)
+        # Pipeline Steps
+        logger.info(f"Raw data shape: {raw_keypoints.shape}")
+        video_info = video_info or try_probe_video(video_path)
+
+        if self.raw_only:
+            with recorder.stage('serialization', frames):
+                data_packet = PoseResult(make_data_packet(video_path, raw_keypoints, None, None, scores,
+                                                          video_info=video_info, inferred=inferred, postprocess=params))
+                if output_path:
+                    save_output(data_packet, output_path)
+            return data_packet
         
-        # Calculate Torso Length for every frame
-        # Mid-Shoulder = (LeftShoulder + RightShoulder) / 2
-        # Mid-Hip = (LeftHip + RightHip) / 2
-        # Torso Length = Dist(Mid-Shoulder, Mid-Hip)
+        # 1. Confidence gating
+        with recorder.stage('gating', frames):
+            gated_keypoints, missing = self.gate_signal(raw_keypoints, scores)
         
-        for f in range(len(keypoints)):
-            frame_kps = keypoints[f]
-            
-            # Check if we have confidence (sometimes points are 0,0)
-            # If standard COCO, indices are stable.
-            l_shoulder = frame_kps[5]
-            r_shoulder = frame_kps[6]
-            l_hip = frame_kps[11]
-            r_hip = frame_kps[12]
-            
-            # Calculate Midpoints
-            mid_shoulder = (l_shoulder + r_shoulder) / 2
-            mid_hip = (l_hip + r_hip) / 2
-            
-            # Calculate Torso Length (Euclidean distance)
-            torso_len = np.linalg.norm(mid_shoulder - mid_hip)
-            
-            # If torso length is near zero (failed detection), avoid div/0
-            if torso_len < 1e-3:
-                scale = 1.0
-            else:
-                scale = 1.0 / torso_len
-            
-            # Normalize: Scale everything relative to torso
-            # Optional: Center the hip at (0,0)? For now, just scaling.
-            # Using Mid-Hip as origin for centering could also be useful.
+        # 2. Smoothing
+        with recorder.stage('smoothing', frames):
+            smoothed_keypoints = self.smooth_signal(gated_keypoints)
+        
+        # 3. Normalization
+        with recorder.stage('normalization', frames):
+            normalized_keypoints = self.normalize_signal(smoothed_keypoints)
+        
+        # 4. Serialization
+        with recorder.stage('serialization', frames):
+            data_packet = make_data_packet(video_path, raw_keypoints, smoothed_keypoints, normalized_keypoints, scores,
+                                           video_info=video_info, inferred=inferred, missing=missing,
+                                           postprocess=params)
             
-            # Implementation: Center at Mid-Hip, then Scale.
-            centered = frame_kps - mid_hip
-            normalized_keypoints[f] = centered * scale
+            if output_path:
+                # .npz -> typed float32 arrays (memory-mappable), anything else -> JSON
+                save_output(data_packet, output_path)
             
-        return normalized_keypoints
+        return data_packet
 
-    def process_video(self, video_path, output_path=None, visualize=False):
+    def process_video(self, video_path, output_path=None, visualize=False, max_side=None, frame_stride=1,
+                      start_time=None, end_time=None, batch_size=8, recorder=None, track=False, keyframe_interval=30,
+                      motion_threshold=0.0, max_skip=4, chunk_frames=None):
+        """
+        Args:
+            visualize (bool): Accepted for interface compatibility; render overlays with visualizer.py.
+            max_side (int): Downscale frames so the longer side is at most this before inference.
+            frame_stride (int): Run on every n-th frame; the output fps is divided accordingly.
+            start_time, end_time (float): Only process this time range (seconds).
+            batch_size (int): Frames per inferencer call.
+            recorder (instrumentation.Recorder): Optional per-stage timing, memory and
+                per-frame inference latency. None disables instrumentation.
+            track (bool): Follow one athlete (see tracking.PoseTracker): full-frame person
+                detection only every `keyframe_interval` frames or when the track is lost,
+                pose on a predicted crop in between. Without it, each frame keeps the
+                detector's first person.
+            keyframe_interval (int): Frames between forced full-frame detections when tracking.
+            motion_threshold (float): > 0 enables adaptive sampling (see adaptive_sampling.MotionGate):
+                frames where less than this percent of pixels changed since the last inferred
+                frame skip the model and are interpolated. The output gets an 'inferred' mask.
+            max_skip (int): Most consecutive frames adaptive sampling may skip.
+            chunk_frames (int): Process in chunks of this many frames with O(chunk) memory and
+                checkpoint/resume (see chunked.py). Needs output_path; the returned packet then
+                holds only the metadata. Not combinable with adaptive sampling or the cache.
+        Keypoints are always reported in source-video pixel coordinates.
+        """
+        recorder = recorder or NULL_RECORDER
         if not os.path.exists(video_path):
             raise FileNotFoundError(f"Video {video_path} not found.")
+
+        if chunk_frames:
+            if motion_threshold:
+                raise ValueError("Chunked processing does not support adaptive sampling (motion_threshold).")
+            if not output_path:
+                raise ValueError("Chunked processing writes its results to disk and needs an output_path.")
+            return process_video_chunked(self, video_path, output_path, chunk_frames, max_side, frame_stride,
+                                         start_time, end_time, batch_size, recorder, track, keyframe_interval)
             
         logger.info(f"Processing video: {video_path}")
         
-        # Generators allow processing long videos without OOM
-        result_generator = self.inferencer(video_path, return_vis=visualize)
+        reader = VideoFrameReader(video_path, max_side=max_side, frame_stride=frame_stride,
+                                  start_time=start_time, end_time=end_time)
+        tracker = PoseTracker(self.backend, keyframe_interval) if track else None
+        gate = MotionGate(motion_threshold, max_skip) if motion_threshold else None
+        params = dict(self.cache_key["params"], **reader.params)
+        if tracker is not None:
+            params.update(person='track', tracking=tracker.params)
+        if gate is not None:
+            params["sampling"] = gate.params
+        cache_key = dict(self.cache_key, params=params)
+        
+        with recorder.stage('cache_lookup'):
+            cached = self.cache.load(video_path, **cache_key) if self.cache is not None else None
+        if cached is not None:
+            raw_keypoints, scores = cached
+            inferred = None
+            if gate is not None:
+                # Cached without the interpolation: skipped frames are NaN
+                raw_keypoints, scores, inferred = fill_skipped(raw_keypoints, scores)
+            return self.postprocess(video_path, raw_keypoints, scores, output_path, reader.output_info(), recorder,
+                                    inferred)
         
         raw_keypoints = []
         scores = []
         
-        for result in result_generator:
-            preds = result['predictions']
-            if preds and len(preds) > 0:
-                # Take the first detected person (Index 0)
-                # Structure: [{'keypoints': [[x,y], ...], 'keypoint_scores': [...]}]
-                raw_keypoints.append(preds[0]['keypoints'])
-                scores.append(preds[0]['keypoint_scores'])
-            else:
-                # Fallback for empty frame
-                # Assume COCO 17 points
-                raw_keypoints.append(np.zeros((17, 2)))
-                scores.append(np.zeros(17))
+        # The reader decodes ahead on a background thread while the model runs;
+        # 'decode' is the time spent waiting on it (including the motion check when sampling)
+        batches = gate.iter_batches(reader, batch_size) if gate is not None else iter_frame_batches(reader, batch_size)
+        batches = recorder.iterate('decode', batches, count=lambda b: len(b[0]))
+        for _, frames in batches:
+            with recorder.stage('inference', len(frames), per_frame=True):
+                kps, kp_scores = tracker.infer(frames) if tracker is not None else self.infer_frames(frames)
+            raw_keypoints.append(reader.to_source_coords(kps))
+            scores.append(kp_scores)
+        if tracker is not None:
+            logger.info(f"Tracking: {tracker.summary()}")
 
-        raw_keypoints = np.array(raw_keypoints) # Shape: (Frames, 17, 2)
-        scores = np.array(scores)
-        
-        # Pipeline Steps
-        logger.info(f"Raw data shape: {raw_keypoints.shape}")
-        
-        # 1. Smoothing
-        smoothed_keypoints = self.smooth_signal(raw_keypoints)
+        raw_keypoints = np.concatenate(raw_keypoints) if raw_keypoints else np.zeros((0, 17, 2)) # Shape: (Frames, 17, 2)
+        scores = np.concatenate(scores) if scores else np.zeros((0, 17))
+        if gate is not None:
+            raw_keypoints, scores = gate.expand(raw_keypoints, scores)
+            gate.log_summary(os.path.basename(video_path))
         
-        # 2. Normalization
-        normalized_keypoints = self.normalize_signal(smoothed_keypoints)
+        if self.cache is not None:
+            with recorder.stage('cache_store'):
+                self.cache.store(video_path, raw_keypoints, scores, **cache_key)
         
-        # 3. Serialization
-        data_packet = {
-            "video_id": os.path.basename(video_path),
-            "frame_count": len(raw_keypoints),
-            "raw_keypoints": raw_keypoints.tolist(),
-            "smoothed_keypoints": smoothed_keypoints.tolist(), # Optional: keep raw for debug
-            "normalized_keypoints": normalized_keypoints.tolist(),
-            "scores": scores.tolist()
-        }
-        
-        if output_path:
-            with open(output_path, 'w') as f:
-                json.dump(data_packet, f)
-            logger.info(f"Saved processed data to {output_path}")
-            
-        return data_packet
+        inferred = None
+        if gate is not None:
+            with recorder.stage('interpolation', len(raw_keypoints)):
+                raw_keypoints, scores, inferred = fill_skipped(raw_keypoints, scores)
+        return self.postprocess(video_path, raw_keypoints, scores, output_path, reader.output_info(), recorder,
+                                inferred)
 
 if __name__ == "__main__":
+    from autotune import tuned_settings
+
     parser = argparse.ArgumentParser(description="Fitness-AQA Vision Pipeline Processor")
     parser.add_argument("--input", "-i", required=True, help="Path to input video")
-    parser.add_argument("--output", "-o", required=True, help="Path to output JSON")
+    parser.add_argument("--output", "-o", required=True, help="Path to output JSON (or .npz for the binary format)")
     parser.add_argument("--visualize", "-v", action="store_true", help="Generate visualization video (slow)")
+    parser.add_argument("--backend", "-b", choices=available_backends(), default=None,
+                        help="Pose backend (default: tuning profile, else mmpose)")
+    parser.add_argument("--model", "-m", default=None, help="Model for the backend (default: backend default)")
+    parser.add_argument("--device", "-d", default=None, help="Inference device: cpu, cuda or mps (default: tuning profile, else cpu)")
+    parser.add_argument("--batch-size", type=int, default=None, help="Frames per model call (default: tuning profile, else 8)")
+    parser.add_argument("--no-tuning-profile", action="store_true", help="Ignore this host's autotune profile")
+    parser.add_argument("--max-side", type=int, default=None, help="Downscale frames to this longer side before inference")
+    parser.add_argument("--frame-stride", type=int, default=1, help="Process every n-th frame")
+    parser.add_argument("--start", type=float, default=None, help="Start time in seconds")
+    parser.add_argument("--end", type=float, default=None, help="End time in seconds")
+    parser.add_argument("--track", action="store_true",
+                        help="Follow one athlete: detect on keyframes only, pose on a tracked crop in between")
+    parser.add_argument("--keyframe-interval", type=int, default=30, help="Frames between full-frame detections with --track")
+    parser.add_argument("--motion-threshold", type=float, default=0.0,
+                        help="Skip inference on frames with less than this %% of pixels changed (0 = off, try 1)")
+    parser.add_argument("--max-skip", type=int, default=4, help="Most consecutive frames --motion-threshold may skip")
+    parser.add_argument("--score-threshold", type=float, default=0.3, help="Drop keypoints scoring below this before smoothing")
+    parser.add_argument("--max-gap", type=int, default=10,
+                        help="Interpolate dropped runs up to this many frames; longer ones stay NaN")
+    parser.add_argument("--raw-only", action="store_true",
+                        help="Store only raw keypoints + scores; smoothed/normalized are derived on read (~3x smaller)")
+    parser.add_argument("--chunk-frames", type=int, default=None,
+                        help="Process in chunks of this many frames (bounded memory, resumable; e.g. 9000 for long sessions)")
+    parser.add_argument("--metrics", default=None, help="Write per-stage timing/memory metrics to this JSON file")
+    parser.add_argument("--profile", default=None, help="Run under cProfile and dump stats to this file")
     
     args = parser.parse_args()
     
-    extractor = PoseExtractor()
-    extractor.process_video(args.input, args.output, args.visualize)
+    requested_backend = args.backend or ("mmpose" if args.model else None)
+    tuned = {} if args.no_tuning_profile else tuned_settings(requested_backend)
+    extractor = PoseExtractor(args.model or tuned.get("model"), args.device or tuned.get("device", "cpu"),
+                              backend=requested_backend or tuned.get("backend", "mmpose"),
+                              score_threshold=args.score_threshold, max_gap=args.max_gap, raw_only=args.raw_only)
+    recorder = Recorder(os.path.basename(args.input)) if args.metrics else None
+    with profiled(args.profile) if args.profile else contextlib.nullcontext():
+        extractor.process_video(args.input, args.output, args.visualize, max_side=args.max_side,
+                                frame_stride=args.frame_stride, start_time=args.start, end_time=args.end,
+                                batch_size=args.batch_size or tuned.get("batch_size", 8), recorder=recorder,
+                                track=args.track, keyframe_interval=args.keyframe_interval,
+                                motion_threshold=args.motion_threshold, max_skip=args.max_skip,
+                                chunk_frames=args.chunk_frames)
+    if recorder:
+        recorder.write_sidecar(args.metrics)
@@ -1,122 +1,76 @@
-
 import os
-import json
 import logging
+import contextlib
 import argparse
-import numpy as np
-import cv2
-from scipy.signal import savgol_filter
-from ultralytics import YOLO
+from video_processor import PoseExtractor
+from instrumentation import Recorder, profiled
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-class YOLOPoseExtractor:
-    def __init__(self, model_variant='yolov8n-pose.pt', device='cpu'):
+class YOLOPoseExtractor(PoseExtractor):
+    def __init__(self, model_variant='yolov8n-pose.pt', device='cpu', cache=None, warmup=False, score_threshold=0.3,
+                 max_gap=10, raw_only=False):
         """
-        Initialize the YOLOv8 Pose model.
+        PoseExtractor on the 'yolo' backend (see pose_backends.YOLOBackend).
         Args:
             model_variant (str): 'yolov8n-pose.pt' (fast), 'yolov8s-pose.pt', or 'yolov8x-pose.pt' (accurate).
             device (str): 'cuda', 'cpu', or 'mps' (for Mac).
+            cache (InferenceCache): Optional cache of raw model output.
+            score_threshold, max_gap: Confidence gating (see PoseExtractor).
+            raw_only (bool): Store only raw keypoints and scores (see PoseExtractor).
         """
-        logger.info(f"Initializing YOLO Pose (model={model_variant}, device={device})...")
-        self.model = YOLO(model_variant)
-        self.device = device
-
-    def smooth_signal(self, keypoints, window_length=5, polyorder=2):
-        """Applies Savitzky-Golay filter to smooth trajectories."""
-        if len(keypoints) < window_length:
-            return keypoints
-            
-        smoothed_keypoints = np.zeros_like(keypoints)
-        num_points = keypoints.shape[1]
-        
-        for i in range(num_points):
-            smoothed_keypoints[:, i, 0] = savgol_filter(keypoints[:, i, 0], window_length, polyorder)
-            smoothed_keypoints[:, i, 1] = savgol_filter(keypoints[:, i, 1], window_length, polyorder)
-            
-        return smoothed_keypoints
-
-    def normalize_signal(self, keypoints):
-        """Normalizes coordinates based on Torso Length."""
-        normalized_keypoints = np.zeros_like(keypoints)
-        
-        for f in range(len(keypoints)):
-            frame_kps = keypoints[f]
-            # COCO Indices: 5,6 (shoulders), 11,12 (hips)
-            l_shoulder, r_shoulder = frame_kps[5], frame_kps[6]
-            l_hip, r_hip = frame_kps[11], frame_kps[12]
-            
-            mid_shoulder = (l_shoulder + r_shoulder) / 2
-            mid_hip = (l_hip + r_hip) / 2
-            torso_len = np.linalg.norm(mid_shoulder - mid_hip)
-            
-            scale = 1.0 if torso_len < 1e-3 else 1.0 / torso_len
-            centered = frame_kps - mid_hip
-            normalized_keypoints[f] = centered * scale
-            
-        return normalized_keypoints
-
-    def process_video(self, video_path, output_path=None):
-        if not os.path.exists(video_path):
-            raise FileNotFoundError(f"Video {video_path} not found.")
-            
-        logger.info(f"Processing video: {video_path}")
-        
-        # Run YOLO inference
-        # stream=True allows processing long videos frame by frame
-        results = self.model(video_path, stream=True, device=self.device, verbose=False)
-        
-        raw_keypoints = []
-        scores = []
-        
-        for result in results:
-            if result.keypoints is not None and len(result.keypoints.data) > 0:
-                # Get the first person detected [1, 17, 2]
-                kp_data = result.keypoints.data[0].cpu().numpy()
-                raw_keypoints.append(kp_data[:, :2])
-                # Confidence scores
-                scores.append(result.keypoints.conf[0].cpu().numpy())
-            else:
-                # Fallback for empty frame
-                raw_keypoints.append(np.zeros((17, 2)))
-                scores.append(np.zeros(17))
-
-        raw_keypoints = np.array(raw_keypoints)
-        scores = np.array(scores)
-        
-        logger.info(f"Frames processed: {len(raw_keypoints)}")
-        
-        # Pipeline Steps
-        smoothed_keypoints = self.smooth_signal(raw_keypoints)
-        normalized_keypoints = self.normalize_signal(smoothed_keypoints)
-        
-        data_packet = {
-            "video_id": os.path.basename(video_path),
-            "frame_count": len(raw_keypoints),
-            "raw_keypoints": raw_keypoints.tolist(),
-            "smoothed_keypoints": smoothed_keypoints.tolist(),
-            "normalized_keypoints": normalized_keypoints.tolist(),
-            "scores": scores.tolist()
-        }
-        
-        if output_path:
-            with open(output_path, 'w') as f:
-                json.dump(data_packet, f)
-            logger.info(f"Saved processed data to {output_path}")
-            
-        return data_packet
+        super().__init__(model_variant, device, cache, backend='yolo', warmup=warmup,
+                         score_threshold=score_threshold, max_gap=max_gap, raw_only=raw_only)
 
 if __name__ == "__main__":
+    from autotune import tuned_settings
+
     parser = argparse.ArgumentParser(description="YOLO Pose Pipeline")
     parser.add_argument("--input", "-i", required=True, help="Input video")
-    parser.add_argument("--output", "-o", required=True, help="Output JSON")
-    parser.add_argument("--model", "-m", default="yolov8s-pose.pt", help="YOLO model variant")
+    parser.add_argument("--output", "-o", required=True, help="Output JSON (or .npz for the binary format)")
+    parser.add_argument("--model", "-m", default=None,
+                        help="YOLO model variant (default: tuning profile, else yolov8s-pose.pt)")
+    # Use 'mps' for Mac M1/M2, 'cuda' for PC, 'cpu' for default
+    parser.add_argument("--device", "-d", default=None, help="Inference device: cpu, cuda or mps (default: tuning profile, else cpu)")
+    parser.add_argument("--batch-size", type=int, default=None, help="Frames per model call (default: tuning profile, else 8)")
+    parser.add_argument("--no-tuning-profile", action="store_true", help="Ignore this host's autotune profile")
+    parser.add_argument("--max-side", type=int, default=None, help="Downscale frames to this longer side before inference")
+    parser.add_argument("--frame-stride", type=int, default=1, help="Process every n-th frame")
+    parser.add_argument("--start", type=float, default=None, help="Start time in seconds")
+    parser.add_argument("--end", type=float, default=None, help="End time in seconds")
+    parser.add_argument("--track", action="store_true",
+                        help="Follow one athlete: detect on keyframes only, pose on a tracked crop in between")
+    parser.add_argument("--keyframe-interval", type=int, default=30, help="Frames between full-frame detections with --track")
+    parser.add_argument("--motion-threshold", type=float, default=0.0,
+                        help="Skip inference on frames with less than this %% of pixels changed (0 = off, try 1)")
+    parser.add_argument("--max-skip", type=int, default=4, help="Most consecutive frames --motion-threshold may skip")
+    parser.add_argument("--score-threshold", type=float, default=0.3, help="Drop keypoints scoring below this before smoothing")
+    parser.add_argument("--max-gap", type=int, default=10,
+                        help="Interpolate dropped runs up to this many frames; longer ones stay NaN")
+    parser.add_argument("--raw-only", action="store_true",
+                        help="Store only raw keypoints + scores; smoothed/normalized are derived on read (~3x smaller)")
+    parser.add_argument("--chunk-frames", type=int, default=None,
+                        help="Process in chunks of this many frames (bounded memory, resumable; e.g. 9000 for long sessions)")
+    parser.add_argument("--metrics", default=None, help="Write per-stage timing/memory metrics to this JSON file")
+    parser.add_argument("--profile", default=None, help="Run under cProfile and dump stats to this file")
     
     args = parser.parse_args()
     
-    # Use 'mps' for Mac M1/M2, 'cuda' for PC, 'cpu' for default
-    device = 'cpu'
+    # Only a profile tuned for the YOLO backend applies here
+    tuned = {} if args.no_tuning_profile else tuned_settings('yolo')
     
-    extractor = YOLOPoseExtractor(model_variant=args.model, device=device)
-    extractor.process_video(args.input, args.output)
+    extractor = YOLOPoseExtractor(model_variant=args.model or tuned.get("model", "yolov8s-pose.pt"),
+                                  device=args.device or tuned.get("device", "cpu"),
+                                  score_threshold=args.score_threshold, max_gap=args.max_gap,
+                                  raw_only=args.raw_only)
+    recorder = Recorder(os.path.basename(args.input)) if args.metrics else None
+    with profiled(args.profile) if args.profile else contextlib.nullcontext():
+        extractor.process_video(args.input, args.output, max_side=args.max_side, frame_stride=args.frame_stride,
+                                start_time=args.start, end_time=args.end,
+                                batch_size=args.batch_size or tuned.get("batch_size", 8), recorder=recorder,
+                                track=args.track, keyframe_interval=args.keyframe_interval,
+                                motion_threshold=args.motion_threshold, max_skip=args.max_skip,
+                                chunk_frames=args.chunk_frames)
+    if recorder:
+        recorder.write_sidecar(args.metrics)
@@ -1,72 +1,197 @@
-
-import json
+import queue
+import threading
 import cv2
 import numpy as np
 import argparse
-import os
+from pose_archive import load_output
+from video_io import VideoFrameReader
+from instrumentation import Recorder, NULL_RECORDER
 
 # Skeleton connections for COCO format (17 keypoints)
 SKELETON = [
-    (15, 13), (13, 11), (16, 14), (14, 12), (11, 12), (5, 11), (6, 12), 
-    (5, 6), (5, 7), (6, 8), (7, 9), (8, 10), (1, 2), (0, 1), (0, 2), 
+    (15, 13), (13, 11), (16, 14), (14, 12), (11, 12), (5, 11), (6, 12),
+    (5, 6), (5, 7), (6, 8), (7, 9), (8, 10), (1, 2), (0, 1), (0, 2),
     (1, 3), (2, 4), (3, 5), (4, 6)
 ]
+_EDGES = np.array(SKELETON)
+
+# Overlay variants: keypoint field, whether to gate on scores, (line colour, dot colour) in BGR
+VARIANTS = {
+    'smoothed': ('smoothed_keypoints', False, ((0, 255, 0), (0, 0, 255))),
+    'raw': ('raw_keypoints', False, ((0, 165, 255), (255, 0, 255))),
+    'gated': ('smoothed_keypoints', True, ((255, 255, 0), (0, 0, 255))),
+}
+
+_END = object()
+
+class _Overlay:
+    """Pixel coordinates and visibility of one variant, precomputed for the whole sequence."""
+    def __init__(self, keypoints, scores=None, score_threshold=0.3, colors=((0, 255, 0), (0, 0, 255))):
+        keypoints = np.asarray(keypoints, dtype=float)
+        finite = np.isfinite(keypoints).all(axis=-1)
+        self.points = np.rint(np.nan_to_num(keypoints)).astype(np.int32)          # [T, 17, 2]
+        # (0,0) is the extractors' marker for a missing detection
+        self.visible = finite & self.points.any(axis=-1)                         # [T, 17]
+        if scores is not None:
+            self.visible &= np.asarray(scores) >= score_threshold
+        self.edge_visible = self.visible[:, _EDGES[:, 0]] & self.visible[:, _EDGES[:, 1]]  # [T, E]
+        self.segments = self.points[:, _EDGES]                                   # [T, E, 2, 2]
+        self.line_color, self.dot_color = colors
+
+    def __len__(self):
+        return len(self.points)
+
+    def draw(self, frame, t):
+        if t >= len(self.points):
+            return frame
+        segments = self.segments[t][self.edge_visible[t]]
+        if len(segments):
+            # One call for every visible bone
+            cv2.polylines(frame, segments, False, self.line_color, 2)
+        for x, y in self.points[t][self.visible[t]]:
+            cv2.circle(frame, (int(x), int(y)), 4, self.dot_color, -1)
+        return frame
+
+def _build_overlays(data, variants, score_threshold):
+    overlays = {}
+    for name in variants:
+        if name not in VARIANTS:
+            raise ValueError(f"Unknown variant '{name}'. Choose from {sorted(VARIANTS)}.")
+        field, gated, colors = VARIANTS[name]
+        if field not in data:
+            raise KeyError(f"Pose data has no '{field}' field (needed for the '{name}' overlay).")
+        scores = data.get('scores') if gated else None
+        overlays[name] = _Overlay(data[field], scores, score_threshold, colors)
+    return overlays
+
+def render_overlays(video_path, data_path, outputs, score_threshold=0.3, queue_size=32, recorder=None):
+    """
+    Renders several skeleton overlays from a single decode of the source video.
+    Decode, drawing (one thread per output) and encoding (one thread per
+    output) run concurrently, connected by bounded queues.
+    Args:
+        video_path (str): Original video.
+        data_path (str): Pipeline output (.json or .npz).
+        outputs (dict): variant name ('raw', 'smoothed', 'gated') -> output video path.
+        score_threshold (float): Minimum keypoint score for the 'gated' overlay.
+        recorder (instrumentation.Recorder): Optional; records decode wait, per-frame
+            draw/encode latency and the overall 'visualization' stage.
+    """
+    recorder = recorder or NULL_RECORDER
+    data = load_output(data_path)
+    overlays = _build_overlays(data, outputs, score_threshold)
+    frame_count = max(len(o) for o in overlays.values())
+
+    # Decode the same frames the keypoints were extracted from
+    stride = int(data.get('frame_stride') or 1)
+    source_fps = data.get('source_fps') or data.get('fps')
+    start_time = data.get('start_frame', 0) / source_fps if data.get('start_frame') and source_fps else None
+    reader = VideoFrameReader(video_path, frame_stride=stride, start_time=start_time, prefetch=queue_size)
+    width, height = reader.size
 
-def visualize_pose(video_path, json_path, output_path):
-    # 1. Load data
-    with open(json_path, 'r') as f:
-        data = json.load(f)
-    
-    keypoints_seq = np.array(data['smoothed_keypoints'])
-    
-    # 2. Setup video reader & writer
-    cap = cv2.VideoCapture(video_path)
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    
     fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-    
-    print(f"🎥 Generating visualization: {output_path}...")
-    
-    frame_idx = 0
-    while cap.isOpened() and frame_idx < len(keypoints_seq):
-        ret, frame = cap.read()
-        if not ret: break
-        
-        kps = keypoints_seq[frame_idx]
-        
-        # Draw skeleton lines
-        for pair in SKELETON:
-            p1 = tuple(kps[pair[0]].astype(int))
-            p2 = tuple(kps[pair[1]].astype(int))
-            # Only draw if both points are non-zero (simple check for missing data)
-            if p1 != (0,0) and p2 != (0,0):
-                cv2.line(frame, p1, p2, (0, 255, 0), 2)
-        
-        # Draw keypoint dots
-        for i, kp in enumerate(kps):
-            pt = tuple(kp.astype(int))
-            if pt != (0,0):
-                cv2.circle(frame, pt, 4, (0, 0, 255), -1)
-                # Optional: Label the index for debugging
-                # cv2.putText(frame, str(i), pt, cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
-
-        out.write(frame)
-        frame_idx += 1
-        if frame_idx % 30 == 0:
-            print(f"  Processed {frame_idx} frames...")
-
-    cap.release()
-    out.release()
-    print(f"✅ Visualization saved to {output_path}")
+    writers = {name: cv2.VideoWriter(path, fourcc, reader.fps, (width, height)) for name, path in outputs.items()}
+    draw_queues = {name: queue.Queue(maxsize=queue_size) for name in outputs}
+    encode_queues = {name: queue.Queue(maxsize=queue_size) for name in outputs}
+    errors = []
+
+    def draw_worker(name):
+        overlay, src, dst = overlays[name], draw_queues[name], encode_queues[name]
+        failed = False
+        while True:
+            item = src.get()
+            if item is _END:
+                break
+            if failed:
+                # Keep consuming so the decoder never blocks on a dead consumer
+                continue
+            t, frame = item
+            try:
+                with recorder.stage('draw', 1, per_frame=True):
+                    frame = overlay.draw(frame.copy(), t)
+                dst.put(frame)
+            except Exception as e:
+                errors.append(e)
+                failed = True
+        dst.put(_END)
+
+    def encode_worker(name):
+        writer, src = writers[name], encode_queues[name]
+        failed = False
+        try:
+            while True:
+                frame = src.get()
+                if frame is _END:
+                    break
+                if failed:
+                    # Keep consuming so the draw worker never blocks on a dead encoder
+                    continue
+                try:
+                    with recorder.stage('encode', 1, per_frame=True):
+                        writer.write(frame)
+                except Exception as e:
+                    errors.append(e)
+                    failed = True
+        finally:
+            try:
+                writer.release()
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=draw_worker, args=(n,), daemon=True) for n in outputs]
+    threads += [threading.Thread(target=encode_worker, args=(n,), daemon=True) for n in outputs]
+    for thread in threads:
+        thread.start()
+
+    print(f"🎥 Generating visualizations: {', '.join(outputs.values())}...")
+    t = 0
+    with recorder.stage('visualization') as stage:
+        try:
+            for _, frame in recorder.iterate('visualization_decode', reader):
+                if t >= frame_count or errors:
+                    break
+                # Every variant gets the same decoded frame; draw workers copy before drawing
+                for q in draw_queues.values():
+                    q.put((t, frame))
+                t += 1
+                if t % 30 == 0:
+                    print(f"  Processed {t} frames...")
+        finally:
+            reader.close()
+            for q in draw_queues.values():
+                q.put(_END)
+            for thread in threads:
+                thread.join()
+            stage.frames = t
+
+    if errors:
+        raise errors[0]
+    for name, path in outputs.items():
+        print(f"✅ {name} visualization saved to {path}")
+    return outputs
+
+def visualize_pose(video_path, json_path, output_path):
+    """Renders the smoothed skeleton over the source video."""
+    return render_overlays(video_path, json_path, {'smoothed': output_path})
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--video", "-v", required=True, help="Original video file")
-    parser.add_argument("--json", "-j", required=True, help="Processed JSON file")
-    parser.add_argument("--output", "-o", default="video_viz.mp4", help="Output file name")
-    
+    parser.add_argument("--json", "-j", required=True, help="Processed JSON (or .npz) file")
+    parser.add_argument("--output", "-o", default="video_viz.mp4", help="Output file name (smoothed overlay)")
+    parser.add_argument("--variant", action="append", default=[], metavar="NAME:PATH",
+                        help="Overlay to render, e.g. raw:raw.mp4 or gated:gated.mp4. Repeatable; all listed "
+                             "variants come from one decode. Replaces --output when given.")
+    parser.add_argument("--score-threshold", type=float, default=0.3, help="Min keypoint score for the gated overlay")
+    parser.add_argument("--metrics", default=None, help="Write decode/draw/encode timing to this JSON file")
+
     args = parser.parse_args()
-    visualize_pose(args.video, args.json, args.output)
+
+    if args.variant:
+        outputs = dict(v.split(":", 1) for v in args.variant)
+    else:
+        outputs = {'smoothed': args.output}
+    recorder = Recorder(args.video) if args.metrics else None
+    render_overlays(args.video, args.json, outputs, args.score_threshold, recorder=recorder)
+    if recorder:
+        recorder.write_sidecar(args.metrics)
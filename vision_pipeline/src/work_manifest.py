@@ -0,0 +1,450 @@
+import os
+import json
+import time
+import glob
+import uuid
+import random
+import socket
+import hashlib
+import logging
+import argparse
+import threading
+import multiprocessing
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+
+class LeaseLost(Exception):
+    """Raised in a worker whose lease was broken or taken over while it was processing the video."""
+
+def _video_id(path):
+    return hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+
+def _write_json_atomic(path, data):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+class WorkManifest:
+    """
+    Shared, file-based work list for processing one dataset on many hosts.
+
+    Everything lives in one directory on the shared filesystem (e.g. NFS):
+        manifest.json         the frozen work list and job settings
+        leases/<id>.lease     a video currently claimed by a worker
+        done/<id>.json        completion records (the source of truth for "done")
+        failed/<id>.<n>.json  one record per failed attempt
+
+    A lease is claimed with an atomic hard link, kept alive by touching its
+    mtime (heartbeat), and may be broken by any worker once it is older than
+    the lease TTL, so work held by a crashed node is picked up again.
+    """
+    def __init__(self, manifest_dir):
+        self.manifest_dir = manifest_dir
+        with open(os.path.join(manifest_dir, MANIFEST_FILE), 'r') as f:
+            self.manifest = json.load(f)
+        self.videos = self.manifest["videos"]
+        self.max_attempts = self.manifest.get("max_attempts", 3)
+        self.lease_dir = os.path.join(manifest_dir, "leases")
+        self.done_dir = os.path.join(manifest_dir, "done")
+        self.failed_dir = os.path.join(manifest_dir, "failed")
+
+    @classmethod
+    def build(cls, manifest_dir, video_paths, output_dir, output_format='json', max_attempts=3):
+        """Writes a new manifest. Fails if one already exists in manifest_dir."""
+        os.makedirs(manifest_dir, exist_ok=True)
+        manifest_path = os.path.join(manifest_dir, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            raise FileExistsError(f"{manifest_path} already exists")
+        for sub in ("leases", "done", "failed"):
+            os.makedirs(os.path.join(manifest_dir, sub), exist_ok=True)
+
+        videos = [{"id": _video_id(p), "path": os.path.abspath(p)} for p in sorted(video_paths)]
+        _write_json_atomic(manifest_path, {
+            "created": time.time(),
+            "output_dir": os.path.abspath(output_dir),
+            "output_format": output_format,
+            "max_attempts": max_attempts,
+            "videos": videos,
+        })
+        logger.info(f"Manifest with {len(videos)} videos written to {manifest_path}")
+        return cls(manifest_dir)
+
+    def _lease_path(self, video_id):
+        return os.path.join(self.lease_dir, f"{video_id}.lease")
+
+    def is_done(self, video_id):
+        return os.path.exists(os.path.join(self.done_dir, f"{video_id}.json"))
+
+    def attempts(self, video_id):
+        return len(glob.glob(os.path.join(self.failed_dir, f"{video_id}.*.json")))
+
+    def claim(self, video_id, lease_ttl):
+        """
+        Tries to take the lease on one video. Returns a token on success, None
+        if another live worker holds it. Stale leases are broken first.
+        """
+        lease_path = self._lease_path(video_id)
+        token = uuid.uuid4().hex
+        tmp_path = os.path.join(self.lease_dir, f".{video_id}.{token}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump({"token": token, "host": socket.gethostname(), "pid": os.getpid(), "acquired": time.time()}, f)
+
+        try:
+            for _ in range(2):
+                try:
+                    # link() is atomic even on NFS: exactly one worker creates the lease
+                    os.link(tmp_path, lease_path)
+                    return token
+                except FileExistsError:
+                    if not self._break_if_stale(lease_path, lease_ttl):
+                        return None
+            return None
+        finally:
+            os.remove(tmp_path)
+
+    @staticmethod
+    def _read_lease(path):
+        """(token, mtime_ns) of a lease file; raises FileNotFoundError if it is gone."""
+        with open(path, 'r') as f:
+            mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+            try:
+                token = json.load(f).get("token")
+            except ValueError:
+                token = None
+        return token, mtime_ns
+
+    def _break_if_stale(self, lease_path, lease_ttl):
+        """
+        Removes the lease at lease_path if it is older than lease_ttl. Returns True
+        if the caller may try to claim again, False if a live lease is in place.
+        """
+        try:
+            stale = self._read_lease(lease_path)
+        except FileNotFoundError:
+            return True
+        age = time.time() - stale[1] / 1e9
+        if age < lease_ttl:
+            return False
+        expired_path = f"{lease_path}.expired.{uuid.uuid4().hex}"
+        try:
+            # Only one breaker wins the rename; everyone else sees FileNotFoundError
+            os.rename(lease_path, expired_path)
+        except FileNotFoundError:
+            return True
+        # Reading and renaming are not atomic: in between, another breaker may have removed the stale
+        # lease and a worker linked a fresh one, or the owner heartbeated. Put such a lease back.
+        try:
+            moved = self._read_lease(expired_path)
+        except FileNotFoundError:
+            return True
+        if moved != stale:
+            try:
+                os.link(expired_path, lease_path)
+            except FileExistsError:
+                logger.warning(f"Lease {os.path.basename(lease_path)} was replaced while restoring it; "
+                               f"its previous holder will drop the video")
+            os.remove(expired_path)
+            return False
+        os.remove(expired_path)
+        logger.warning(f"Broke expired lease {os.path.basename(lease_path)} (idle {age:.0f}s)")
+        return True
+
+    def heartbeat(self, video_id, token=None):
+        """Refreshes the lease; False if it is gone or (given token) now held by another worker."""
+        if token is not None and not self.owns(video_id, token):
+            return False
+        try:
+            os.utime(self._lease_path(video_id))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def owns(self, video_id, token):
+        try:
+            with open(self._lease_path(video_id), 'r') as f:
+                return json.load(f).get("token") == token
+        except (OSError, ValueError):
+            return False
+
+    def release(self, video_id, token):
+        if self.owns(video_id, token):
+            try:
+                os.remove(self._lease_path(video_id))
+            except FileNotFoundError:
+                pass
+
+    def mark_done(self, video_id, record):
+        _write_json_atomic(os.path.join(self.done_dir, f"{video_id}.json"), record)
+
+    def mark_failed(self, video_id, record):
+        attempt = self.attempts(video_id) + 1
+        _write_json_atomic(os.path.join(self.failed_dir, f"{video_id}.{attempt}.{uuid.uuid4().hex[:8]}.json"), record)
+        return attempt
+
+    def status(self, window=600.0):
+        """Counts per state, recent throughput (videos/min) and ETA in seconds."""
+        done_records = []
+        for path in glob.glob(os.path.join(self.done_dir, "*.json")):
+            try:
+                with open(path, 'r') as f:
+                    done_records.append(json.load(f))
+            except (OSError, ValueError):
+                pass
+        done_ids = {r["id"] for r in done_records}
+
+        now = time.time()
+        leased = exhausted = pending = 0
+        for video in self.videos:
+            if video["id"] in done_ids:
+                continue
+            if os.path.exists(self._lease_path(video["id"])):
+                leased += 1
+            elif self.attempts(video["id"]) >= self.max_attempts:
+                exhausted += 1
+            else:
+                pending += 1
+
+        finished = sorted(r["finished"] for r in done_records)
+        recent = [t for t in finished if t >= now - window]
+        if len(recent) >= 2:
+            rate = len(recent) / max(now - recent[0], 1e-6)
+        elif len(finished) >= 2:
+            rate = len(finished) / max(finished[-1] - finished[0], 1e-6)
+        else:
+            rate = 0.0
+        remaining = leased + pending
+
+        hosts = {}
+        for r in done_records:
+            hosts[r.get("host", "?")] = hosts.get(r.get("host", "?"), 0) + 1
+
+        # Only videos processed with adaptive sampling record frame counts
+        sampled_frames = sum(r.get("frames", 0) for r in done_records)
+        inferred_frames = sum(r.get("inferred_frames", 0) for r in done_records if "frames" in r)
+
+        return {
+            "total": len(self.videos),
+            "done": len(done_ids),
+            "in_progress": leased,
+            "pending": pending,
+            "failed": exhausted,
+            "videos_per_min": rate * 60.0,
+            "eta_seconds": 0.0 if remaining == 0 else (remaining / rate if rate > 0 else None),
+            "done_by_host": hosts,
+            "skip_ratio": 1.0 - inferred_frames / sampled_frames if sampled_frames else None,
+        }
+
+class _Heartbeat:
+    """
+    Touches a lease every `interval` seconds while a video is being processed.
+    Once the lease is lost, check() raises LeaseLost so the worker drops the video.
+    """
+    def __init__(self, manifest, video_id, token, interval):
+        self.manifest, self.video_id, self.token, self.interval = manifest, video_id, token, interval
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not self.manifest.heartbeat(self.video_id, self.token):
+                logger.warning(f"Lost lease on {self.video_id}; another worker may have taken it over")
+                self.lost.set()
+                return
+
+    def check(self, stage=None):
+        if self.lost.is_set():
+            raise LeaseLost(f"lease on {self.video_id} lost")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+def run_worker(manifest_dir, backend='mmpose', model=None, device='cpu', threads=None, lease_ttl=300.0,
+               heartbeat_interval=30.0, wait=True, poll_interval=30.0, ingest=None, score_threshold=0.3, max_gap=10):
+    """
+    Claims and processes videos from a manifest until none are left.
+    Args:
+        lease_ttl (float): Seconds without a heartbeat after which a lease is considered dead.
+        heartbeat_interval (float): How often the active lease is refreshed.
+        wait (bool): Keep polling while other workers still hold leases (their
+            videos may fail or their node may die) instead of exiting early.
+        ingest (dict): process_video options (max_side, frame_stride, batch_size, track, ...).
+        score_threshold, max_gap: Confidence gating before smoothing (see PoseExtractor).
+    """
+    from batch_runner import build_extractor, limit_threads, sampling_counts
+    from instrumentation import StageTracker, NULL_RECORDER
+
+    if threads:
+        limit_threads(threads)
+    manifest = WorkManifest(manifest_dir)
+    output_dir = manifest.manifest["output_dir"]
+    output_format = manifest.manifest.get("output_format", "json")
+    os.makedirs(output_dir, exist_ok=True)
+
+    extractor = build_extractor(backend, model, device, score_threshold=score_threshold, max_gap=max_gap)
+    host = socket.gethostname()
+    processed = 0
+
+    while True:
+        # Workers walk the list in different orders to avoid contending for the same leases
+        order = list(manifest.videos)
+        random.Random(f"{host}-{os.getpid()}").shuffle(order)
+
+        outstanding = 0
+        for video in order:
+            video_id = video["id"]
+            if manifest.is_done(video_id) or manifest.attempts(video_id) >= manifest.max_attempts:
+                continue
+            outstanding += 1
+            token = manifest.claim(video_id, lease_ttl)
+            if token is None:
+                continue
+            # Re-check after claiming: another worker may have finished it in between
+            if manifest.is_done(video_id):
+                manifest.release(video_id, token)
+                continue
+
+            start = time.time()
+            base_name = os.path.splitext(os.path.basename(video["path"]))[0]
+            output_path = os.path.join(output_dir, f"{base_name}.{output_format}")
+            partial_path = os.path.join(output_dir, f".{base_name}.{token[:8]}.partial.{output_format}")
+            try:
+                with _Heartbeat(manifest, video_id, token, heartbeat_interval) as heartbeat:
+                    # Checked as every stage and frame starts, so a worker that lost its lease stops early
+                    packet = extractor.process_video(video["path"], partial_path,
+                                                     recorder=StageTracker(NULL_RECORDER, heartbeat.check),
+                                                     **(ingest or {}))
+                if not manifest.owns(video_id, token):
+                    raise LeaseLost(f"lease on {video_id} lost")
+                os.replace(partial_path, output_path)
+                manifest.mark_done(video_id, dict({"id": video_id, "path": video["path"], "output": output_path,
+                                                   "host": host, "pid": os.getpid(), "seconds": time.time() - start,
+                                                   "finished": time.time()}, **sampling_counts(packet)))
+                processed += 1
+                logger.info(f"Done {os.path.basename(video['path'])} ({time.time() - start:.1f}s)")
+            except LeaseLost:
+                # Not a failure of the video: the worker now holding the lease processes it
+                logger.warning(f"Dropped {os.path.basename(video['path'])}: its lease was taken over")
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+            except Exception as e:
+                attempt = manifest.mark_failed(video_id, {"id": video_id, "path": video["path"], "host": host,
+                                                          "error": str(e), "finished": time.time()})
+                logger.error(f"Failed {video['path']} (attempt {attempt}/{manifest.max_attempts}): {e}")
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+            finally:
+                manifest.release(video_id, token)
+
+        if outstanding == 0 or not wait:
+            break
+        time.sleep(poll_interval)
+
+    logger.info(f"Worker finished: processed {processed} videos.")
+    return processed
+
+def _format_status(status):
+    eta = status["eta_seconds"]
+    if eta is None:
+        eta_text = "n/a"
+    elif eta >= 3600:
+        eta_text = f"{eta / 3600:.1f}h"
+    else:
+        eta_text = f"{eta / 60:.1f}min"
+    lines = [
+        f"Total: {status['total']}  Done: {status['done']}  In progress: {status['in_progress']}  "
+        f"Pending: {status['pending']}  Failed (retries exhausted): {status['failed']}",
+        f"Throughput: {status['videos_per_min']:.1f} videos/min  ETA: {eta_text}",
+    ]
+    if status.get("skip_ratio") is not None:
+        lines.append(f"Adaptive sampling: {status['skip_ratio']:.1%} of frames skipped")
+    for host, count in sorted(status["done_by_host"].items()):
+        lines.append(f"  {host}: {count} done")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    from pose_backends import available_backends
+    from autotune import tuned_settings
+
+    parser = argparse.ArgumentParser(description="Multi-node batch processing through a shared work manifest")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_build = sub.add_parser("build", help="Create the work list once")
+    p_build.add_argument("manifest_dir", help="Shared manifest directory")
+    p_build.add_argument("--input_dir", "-i", required=True, help="Directory containing video files")
+    p_build.add_argument("--output_dir", "-o", required=True, help="Shared output directory")
+    p_build.add_argument("--format", "-f", choices=["json", "npz"], default="json", help="Output format")
+    p_build.add_argument("--max-attempts", type=int, default=3, help="Failures before a video is given up on")
+
+    p_work = sub.add_parser("work", help="Claim and process videos (run on every host)")
+    p_work.add_argument("manifest_dir", help="Shared manifest directory")
+    p_work.add_argument("--workers", "-w", type=int, default=None,
+                        help="Worker processes on this host (default: tuning profile, else 1)")
+    p_work.add_argument("--threads", "-t", type=int, default=None, help="Total CPU thread budget on this host")
+    p_work.add_argument("--backend", "-b", choices=available_backends(), default=None,
+                        help="Pose backend (default: tuning profile, else mmpose)")
+    p_work.add_argument("--model", "-m", default=None, help="MMPose mode or YOLO weights")
+    p_work.add_argument("--device", "-d", default=None, help="Inference device (default: tuning profile, else cpu)")
+    p_work.add_argument("--batch-size", type=int, default=None, help="Frames per model call (default: tuning profile, else 8)")
+    p_work.add_argument("--no-tuning-profile", action="store_true", help="Ignore this host's autotune profile")
+    p_work.add_argument("--lease-ttl", type=float, default=300.0, help="Seconds before an idle lease expires")
+    p_work.add_argument("--heartbeat", type=float, default=30.0, help="Lease refresh interval in seconds")
+    p_work.add_argument("--no-wait", action="store_true", help="Exit when nothing is claimable right now")
+    p_work.add_argument("--max-side", type=int, default=None, help="Downscale frames before inference")
+    p_work.add_argument("--frame-stride", type=int, default=1, help="Run inference on every n-th frame")
+    p_work.add_argument("--track", action="store_true", help="Detect the athlete on keyframes only and track a crop in between")
+    p_work.add_argument("--keyframe-interval", type=int, default=30, help="Frames between full-frame detections with --track")
+    p_work.add_argument("--motion-threshold", type=float, default=0.0,
+                        help="Skip inference on frames with less than this %% of pixels changed (0 = off)")
+    p_work.add_argument("--max-skip", type=int, default=4, help="Most consecutive frames --motion-threshold may skip")
+    p_work.add_argument("--score-threshold", type=float, default=0.3, help="Drop keypoints scoring below this before smoothing")
+    p_work.add_argument("--max-gap", type=int, default=10, help="Interpolate dropped runs up to this many frames")
+
+    p_status = sub.add_parser("status", help="Show progress, throughput and ETA")
+    p_status.add_argument("manifest_dir", help="Shared manifest directory")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        videos = []
+        for ext in ('.mp4', '.mov', '.avi'):
+            videos.extend(glob.glob(os.path.join(args.input_dir, f"*{ext}")))
+        WorkManifest.build(args.manifest_dir, videos, args.output_dir, args.format, args.max_attempts)
+    elif args.command == "work":
+        # Each host of a mixed fleet picks up its own autotune profile
+        requested_backend = args.backend or ("mmpose" if args.model else None)
+        tuned = {} if args.no_tuning_profile else tuned_settings(requested_backend)
+        workers = args.workers or tuned.get("workers", 1)
+        if args.threads:
+            threads = max(1, args.threads // workers)
+        else:
+            threads = tuned.get("threads") or max(1, (os.cpu_count() or 1) // workers)
+        ingest = {"max_side": args.max_side, "frame_stride": args.frame_stride,
+                  "batch_size": args.batch_size or tuned.get("batch_size", 8),
+                  "track": args.track, "keyframe_interval": args.keyframe_interval,
+                  "motion_threshold": args.motion_threshold, "max_skip": args.max_skip}
+        kwargs = dict(backend=requested_backend or tuned.get("backend", "mmpose"), model=args.model or tuned.get("model"),
+                      device=args.device or tuned.get("device", "cpu"), threads=threads,
+                      lease_ttl=args.lease_ttl, heartbeat_interval=args.heartbeat, wait=not args.no_wait,
+                      ingest=ingest, score_threshold=args.score_threshold, max_gap=args.max_gap)
+        if workers > 1:
+            ctx = multiprocessing.get_context('spawn')
+            procs = [ctx.Process(target=run_worker, args=(args.manifest_dir,), kwargs=kwargs)
+                     for _ in range(workers)]
+            for proc in procs:
+                proc.start()
+            for proc in procs:
+                proc.join()
+        else:
+            run_worker(args.manifest_dir, **kwargs)
+    else:
+        print(_format_status(WorkManifest(args.manifest_dir).status()))
@@ -0,0 +1,26 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+# The pipeline modules import each other top-level from src/ (as when run as scripts)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+def random_walk(rng, frames, scale=300.0):
+    """A jittery [frames, 17, 2] skeleton track in pixels, with a realistic torso."""
+    from synthetic_data import STANDING_POSE
+
+    drift = np.cumsum(rng.normal(0, 2.0, size=(frames, 1, 2)), axis=0)
+    jitter = rng.normal(0, 1.5, size=(frames, 17, 2))
+    return STANDING_POSE[None] * scale + 500.0 + drift + jitter
+
+def gappy_scores(rng, frames, gaps):
+    """[frames, 17] scores, high except for (joint, start, length) runs scored below any threshold."""
+    scores = rng.uniform(0.6, 1.0, size=(frames, 17))
+    for joint, start, length in gaps:
+        scores[start:start + length, joint] = 0.05
+    return scores
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
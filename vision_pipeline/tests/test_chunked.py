@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from chunked import ChunkedPostprocessor
+from signal_processing import gate_and_fill, smooth_keypoints, normalize_keypoints
+from conftest import random_walk, gappy_scores
+
+def whole_video(keypoints, scores, score_threshold=0.3, max_gap=10, window_length=5, polyorder=2):
+    gated, missing = gate_and_fill(keypoints, scores, score_threshold, max_gap)
+    smoothed = smooth_keypoints(gated, window_length, polyorder)
+    return smoothed, normalize_keypoints(smoothed), missing
+
+def run_chunked(keypoints, scores, chunk_frames, push_size, **params):
+    post = ChunkedPostprocessor(**params)
+    parts = []
+    for start in range(0, len(keypoints), push_size):
+        post.push(keypoints[start:start + push_size], scores[start:start + push_size])
+        while post.ready(chunk_frames):
+            parts.append(post.emit())
+    final = post.emit(final=True)
+    if final is not None:
+        parts.append(final)
+    assert post.emitted == len(keypoints)
+    return [np.concatenate([part[i] for part in parts]) for i in range(3)]
+
+@pytest.mark.parametrize("chunk_frames, push_size", [(16, 8), (25, 7), (37, 50), (500, 64), (1, 1)])
+def test_chunked_matches_whole_video(rng, chunk_frames, push_size):
+    frames = 230
+    keypoints = random_walk(rng, frames)
+    # Gaps at the start and end, short (filled) and long (left NaN), several crossing chunk boundaries
+    scores = gappy_scores(rng, frames, [(0, 0, 14), (3, 20, 6), (7, 40, 30), (11, 95, 11), (12, 150, 9),
+                                        (15, 210, 20), (16, 222, 8)])
+    chunked = run_chunked(keypoints, scores, chunk_frames, push_size, max_gap=10)
+    whole = whole_video(keypoints, scores, max_gap=10)
+    for result, expected in zip(chunked, whole):
+        np.testing.assert_array_equal(result, expected)
+
+@pytest.mark.parametrize("frames", [1, 3, 5, 12])
+def test_chunked_short_videos(rng, frames):
+    keypoints = random_walk(rng, frames)
+    scores = gappy_scores(rng, frames, [(2, 0, 1)])
+    chunked = run_chunked(keypoints, scores, 4, 2, max_gap=10, window_length=5, polyorder=2)
+    for result, expected in zip(chunked, whole_video(keypoints, scores, max_gap=10)):
+        np.testing.assert_array_equal(result, expected)
+
+def test_chunked_other_parameters(rng):
+    keypoints = random_walk(rng, 140)
+    scores = gappy_scores(rng, 140, [(4, 30, 5), (9, 60, 40)])
+    params = dict(score_threshold=0.5, max_gap=3, window_length=9, polyorder=3)
+    chunked = run_chunked(keypoints, scores, 20, 13, **params)
+    for result, expected in zip(chunked, whole_video(keypoints, scores, **params)):
+        np.testing.assert_array_equal(result, expected)
+
+def test_chunked_needs_finite_max_gap():
+    with pytest.raises(ValueError):
+        ChunkedPostprocessor(max_gap=None)
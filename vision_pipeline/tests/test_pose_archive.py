@@ -0,0 +1,77 @@
+import json
+import numpy as np
+from pose_archive import make_data_packet, save_output, load_output, PoseResult, DERIVED_FIELDS
+from signal_processing import gate_and_fill, smooth_keypoints, normalize_keypoints, derive_views, postprocess_params
+from conftest import random_walk, gappy_scores
+
+def full_packet(rng, frames=90):
+    keypoints = random_walk(rng, frames)
+    scores = gappy_scores(rng, frames, [(2, 10, 5), (13, 40, 20)])
+    gated, missing = gate_and_fill(keypoints, scores, max_gap=10)
+    smoothed = smooth_keypoints(gated)
+    return make_data_packet('squat.mp4', keypoints, smoothed, normalize_keypoints(smoothed), scores, missing=missing)
+
+def reject(constant):
+    raise ValueError(f"non-standard JSON constant {constant}")
+
+def test_json_writes_missing_joints_as_null(rng, tmp_path):
+    packet = full_packet(rng)
+    assert np.isnan(packet['smoothed_keypoints']).any()
+    path = str(tmp_path / 'squat.json')
+    save_output(packet, path)
+    with open(path, 'r') as f:
+        json.load(f, parse_constant=reject)
+    loaded = load_output(path)
+    for field in ('raw_keypoints', 'smoothed_keypoints', 'normalized_keypoints', 'scores', 'missing'):
+        np.testing.assert_array_equal(loaded[field], packet[field])
+
+def packets(rng, frames=90, **params):
+    """A full packet and the raw-only packet of the same video."""
+    keypoints = random_walk(rng, frames)
+    scores = gappy_scores(rng, frames, [(2, 10, 5), (13, 40, 20)])
+    postprocess = postprocess_params(**params)
+    smoothed, normalized, missing = derive_views(keypoints, scores, **params)
+    full = make_data_packet('squat.mp4', keypoints, smoothed, normalized, scores, missing=missing,
+                            postprocess=postprocess)
+    raw = make_data_packet('squat.mp4', keypoints, None, None, scores, postprocess=postprocess)
+    return full, raw
+
+def test_lazy_views_match_full_output(rng):
+    full, raw = packets(rng, max_gap=10, window_length=7, polyorder=3)
+    result = PoseResult(raw)
+    assert result.raw_only
+    for field in DERIVED_FIELDS:
+        assert field in result
+        np.testing.assert_array_equal(result[field], full[field])
+
+def test_with_params_rederives(rng):
+    full, raw = packets(rng)
+    wider = PoseResult(full).with_params(window_length=9)
+    assert wider.raw_only
+    expected = derive_views(full['raw_keypoints'], full['scores'], window_length=9)
+    np.testing.assert_array_equal(wider['smoothed_keypoints'], expected[0])
+
+def test_raw_only_json_stays_raw_only(rng, tmp_path):
+    full, raw = packets(rng)
+    path = str(tmp_path / 'raw.json')
+    save_output(raw, path)
+    with open(path, 'r') as f:
+        assert not set(DERIVED_FIELDS) & set(json.load(f, parse_constant=reject))
+    loaded = load_output(path)
+    assert loaded.raw_only
+    save_output(loaded, path)    # written back raw-only
+    loaded = load_output(path)
+    assert loaded.raw_only
+    for field in ('raw_keypoints', 'scores') + DERIVED_FIELDS:
+        np.testing.assert_array_equal(loaded[field], full[field])
+
+def test_npz_lazy_views_match_full_output(rng, tmp_path):
+    full, raw = packets(rng)
+    save_output(full, str(tmp_path / 'full.npz'))
+    save_output(raw, str(tmp_path / 'raw.npz'))
+    stored, derived = load_output(str(tmp_path / 'full.npz')), load_output(str(tmp_path / 'raw.npz'))
+    assert derived.raw_only and not stored.raw_only
+    # Both are stored as float32; the raw-only file derives from the float32 raw keypoints
+    for field in ('smoothed_keypoints', 'normalized_keypoints'):
+        np.testing.assert_allclose(derived[field], stored[field], rtol=0, atol=1e-3)
+    np.testing.assert_array_equal(derived['missing'], stored['missing'])
@@ -0,0 +1,128 @@
+import numpy as np
+import pytest
+from scipy.signal import savgol_filter
+from signal_processing import (smooth_keypoints, smooth_packed, normalize_keypoints, gate_and_fill, process_batch,
+                               derive_views, postprocess_params, reprocess_outputs, pack_sequences,
+                               unpack_sequences)
+from conftest import random_walk, gappy_scores
+
+def loop_smooth(keypoints, window_length=5, polyorder=2):
+    """The original per-joint, per-axis smoothing loop of PoseExtractor."""
+    smoothed = np.zeros_like(keypoints)
+    for i in range(keypoints.shape[1]):
+        smoothed[:, i, 0] = savgol_filter(keypoints[:, i, 0], window_length, polyorder)
+        smoothed[:, i, 1] = savgol_filter(keypoints[:, i, 1], window_length, polyorder)
+    return smoothed
+
+def loop_normalize(keypoints):
+    """The original per-frame torso normalization of PoseExtractor."""
+    normalized = np.zeros_like(keypoints)
+    for f in range(len(keypoints)):
+        mid_shoulder = (keypoints[f, 5] + keypoints[f, 6]) / 2
+        mid_hip = (keypoints[f, 11] + keypoints[f, 12]) / 2
+        torso_len = np.linalg.norm(mid_shoulder - mid_hip)
+        scale = 1.0 if torso_len < 1e-3 else 1.0 / torso_len
+        normalized[f] = (keypoints[f] - mid_hip) * scale
+    return normalized
+
+@pytest.mark.parametrize("window_length, polyorder", [(5, 2), (7, 3), (9, 2)])
+def test_smooth_keypoints_matches_per_joint_loop(rng, window_length, polyorder):
+    keypoints = random_walk(rng, 120)
+    np.testing.assert_allclose(smooth_keypoints(keypoints, window_length, polyorder),
+                               loop_smooth(keypoints, window_length, polyorder), rtol=0, atol=1e-9)
+
+def test_normalize_matches_per_frame_loop(rng):
+    keypoints = random_walk(rng, 50)
+    keypoints[7, [5, 6, 11, 12]] = 0.0   # failed detection: zero torso, only centred
+    np.testing.assert_allclose(normalize_keypoints(keypoints), loop_normalize(keypoints), rtol=0, atol=1e-12)
+
+@pytest.mark.parametrize("window_length, polyorder", [(5, 2), (7, 3)])
+def test_smooth_packed_matches_each_video(rng, window_length, polyorder):
+    # Includes videos shorter than the window, exactly one window, and a single frame
+    sequences = [random_walk(rng, n) for n in (90, 3, window_length, 1, 41)]
+    flat, offsets = pack_sequences(sequences)
+    smoothed = unpack_sequences(smooth_packed(flat, offsets, window_length, polyorder), offsets)
+    for sequence, result in zip(sequences, smoothed):
+        expected = smooth_keypoints(sequence, window_length, polyorder)
+        np.testing.assert_allclose(result, expected, rtol=0, atol=1e-9)
+        if len(sequence) >= window_length:
+            np.testing.assert_allclose(result, loop_smooth(sequence, window_length, polyorder), rtol=0, atol=1e-9)
+
+def test_smooth_packed_keeps_nan_gaps_in_place(rng):
+    sequences = [random_walk(rng, n) for n in (60, 4, 35)]
+    sequences[0][10:25, 3] = np.nan
+    sequences[0][:2, 9] = np.nan       # gap at the start of a video
+    sequences[1][1, 0] = np.nan        # too short to smooth: left as it is
+    sequences[2][-3:, 16] = np.nan     # gap at the end of the last video
+    flat, offsets = pack_sequences(sequences)
+    smoothed = unpack_sequences(smooth_packed(flat, offsets), offsets)
+    for sequence, result in zip(sequences, smoothed):
+        expected = smooth_keypoints(sequence)
+        np.testing.assert_array_equal(np.isnan(result), np.isnan(sequence))
+        np.testing.assert_allclose(result, expected, rtol=0, atol=1e-9)
+
+def test_gate_and_fill_interpolates_short_gaps_and_keeps_long_ones(rng):
+    keypoints = random_walk(rng, 60)
+    scores = gappy_scores(rng, 60, [(5, 10, 3), (11, 30, 15)])
+    gated, missing = gate_and_fill(keypoints, scores, score_threshold=0.3, max_gap=10)
+    # Short gap: linear between the valid frames around it
+    ramp = np.linspace(0, 1, 5)[1:-1, None]
+    np.testing.assert_allclose(gated[10:13, 5], keypoints[9, 5] + ramp * (keypoints[13, 5] - keypoints[9, 5]))
+    assert missing[30:45, 11].all() and np.isnan(gated[30:45, 11]).all()
+    assert missing.sum() == 15
+    np.testing.assert_array_equal(gated[scores >= 0.3], keypoints[scores >= 0.3])   # confident joints untouched
+
+def test_gating_never_bridges_videos(rng):
+    sequences = [random_walk(rng, 20), random_walk(rng, 20)]
+    scores = [gappy_scores(rng, 20, [(0, 17, 3)]), gappy_scores(rng, 20, [(0, 0, 3)])]
+    flat, offsets = pack_sequences(sequences)
+    _, missing = gate_and_fill(flat, pack_sequences(scores)[0], max_gap=10, offsets=offsets)
+    # Gaps at a video's end/start have a valid neighbour on one side only: held as missing, not interpolated
+    for sequence, score, result in zip(sequences, scores, unpack_sequences(missing, offsets)):
+        np.testing.assert_array_equal(result, gate_and_fill(sequence, score, max_gap=10)[1])
+
+def test_process_batch_matches_each_video(rng):
+    lengths = (80, 30, 3)
+    sequences = [random_walk(rng, n) for n in lengths]
+    scores = [gappy_scores(rng, 80, [(5, 10, 4), (11, 30, 25)]), gappy_scores(rng, 30, [(0, 0, 12)]),
+              gappy_scores(rng, 3, [])]
+    for sequence, score, (smoothed, normalized, missing) in zip(sequences, scores,
+                                                                process_batch(sequences, scores=scores, max_gap=10)):
+        gated, expected_missing = gate_and_fill(sequence, score, max_gap=10)
+        expected = smooth_keypoints(gated)
+        np.testing.assert_allclose(smoothed, expected, rtol=0, atol=1e-9)
+        np.testing.assert_allclose(normalized, normalize_keypoints(expected), rtol=0, atol=1e-9)
+        np.testing.assert_array_equal(missing, expected_missing)
+
+def test_derive_views_matches_process_batch(rng):
+    sequences = [random_walk(rng, n) for n in (70, 9)]
+    scores = [gappy_scores(rng, 70, [(3, 5, 4), (8, 20, 30)]), gappy_scores(rng, 9, [(1, 0, 2)])]
+    params = dict(score_threshold=0.4, max_gap=6, window_length=7, polyorder=3)
+    batched = process_batch(sequences, params['window_length'], params['polyorder'], scores,
+                            params['score_threshold'], params['max_gap'])
+    for sequence, score, expected in zip(sequences, scores, batched):
+        for result, field in zip(derive_views(sequence, score, **params), expected):
+            np.testing.assert_allclose(result, field, rtol=0, atol=1e-9)
+
+def test_reprocess_outputs_rewrites_json_and_npz_in_place(rng, tmp_path):
+    from pose_archive import make_data_packet, save_output, load_output
+
+    keypoints = random_walk(rng, 60)
+    scores = gappy_scores(rng, 60, [(4, 20, 5)])
+    smoothed, normalized, missing = derive_views(keypoints, scores)
+    full = make_data_packet('a.mp4', keypoints, smoothed, normalized, scores, missing=missing,
+                            postprocess=postprocess_params())
+    raw = make_data_packet('c.mp4', keypoints, None, None, scores, postprocess=postprocess_params())
+    for name, packet in (('a.json', full), ('b.npz', full), ('c.npz', raw)):
+        save_output(packet, str(tmp_path / name))
+
+    reprocess_outputs(str(tmp_path), window_length=9, polyorder=3)
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['a.json', 'b.npz', 'c.npz']
+    for name, stored_raw_only in (('a.json', False), ('b.npz', False), ('c.npz', True)):
+        result = load_output(str(tmp_path / name))
+        assert result.raw_only == stored_raw_only
+        assert result.params['window_length'] == 9 and result.params['polyorder'] == 3
+        expected = derive_views(result['raw_keypoints'], result['scores'], window_length=9, polyorder=3)
+        np.testing.assert_allclose(result['smoothed_keypoints'], expected[0], rtol=0, atol=1e-3)
+        np.testing.assert_array_equal(result['missing'], expected[2])
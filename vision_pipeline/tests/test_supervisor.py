@@ -0,0 +1,83 @@
+import os
+import time
+from supervisor import SupervisedPool, Quarantine, video_budget
+
+# Module-level so spawned workers can import them
+def _init(marker):
+    global _marker
+    _marker = marker
+
+def _task(behaviour, on_stage=None):
+    on_stage('decode')
+    if behaviour == 'hang':
+        on_stage('inference')
+        time.sleep(60)
+    if behaviour == 'crash':
+        on_stage('smoothing')
+        os._exit(3)
+    if behaviour == 'error':
+        return {"status": "failed", "error": "bad video"}
+    on_stage('serialization')
+    return {"status": "done", "marker": _marker}
+
+def run(tasks, workers=2):
+    pool = SupervisedPool(workers, _init, ('loaded',), _task, start_timeout=60)
+    return {key: (result, failure, stage) for key, result, failure, stage in pool.run(tasks)}
+
+def test_healthy_tasks_run_once_per_worker_init():
+    results = run([(f"ok{i}", ('ok',), 30) for i in range(5)])
+    assert sorted(results) == [f"ok{i}" for i in range(5)]
+    for result, failure, stage in results.values():
+        assert failure is None and result == {"status": "done", "marker": "loaded"}
+        assert stage == 'serialization'
+
+def test_timeout_and_crash_only_fail_their_task():
+    start = time.monotonic()
+    results = run([('hang', ('hang',), 1.5), ('crash', ('crash',), 30), ('ok1', ('ok',), 30),
+                   ('error', ('error',), 30), ('ok2', ('ok',), 30)])
+    assert time.monotonic() - start < 30
+
+    result, failure, stage = results['hang']
+    assert result is None and failure["error"].startswith("timed out") and stage == 'inference'
+    assert 1.5 <= failure["seconds"] < 10
+
+    result, failure, stage = results['crash']
+    assert result is None and failure["error"] == "worker died (exit code 3)" and stage == 'smoothing'
+
+    # A task that fails normally is a result, not a supervisor failure; replaced workers keep going
+    assert results['error'][0] == {"status": "failed", "error": "bad video"}
+    assert results['ok1'][0]["status"] == results['ok2'][0]["status"] == "done"
+
+def test_video_budget():
+    assert video_budget(1000, 0.5, 60) == 500
+    assert video_budget(10, 0.5, 60) == 60
+    assert video_budget(None, 0.5, 60) == 60
+
+def test_quarantine_after_max_strikes(tmp_path):
+    video = tmp_path / 'clip.mp4'
+    video.write_bytes(b'broken')
+    report = str(tmp_path / '.quarantine.json')
+
+    quarantine = Quarantine(report, max_strikes=2)
+    assert not quarantine.strike(str(video), "timed out after 60.0s", 'decode')
+    assert quarantine.strike(str(video), "worker died (exit code -11)", 'inference')
+    quarantine.save()
+
+    reloaded = Quarantine(report, max_strikes=2)
+    assert reloaded.is_quarantined(str(video))
+    assert [f["stage"] for f in reloaded.videos[str(video)]["failures"]] == ['decode', 'inference']
+    reloaded.release()
+    assert not reloaded.is_quarantined(str(video))
+
+def test_quarantine_resets_when_the_file_changes(tmp_path):
+    video = tmp_path / 'clip.mp4'
+    video.write_bytes(b'broken')
+    quarantine = Quarantine(str(tmp_path / '.quarantine.json'), max_strikes=1)
+    assert quarantine.strike(str(video), "bad", 'decode')
+    video.write_bytes(b'fixed upload')
+    assert not quarantine.is_quarantined(str(video))
+
+def test_quarantine_strike_on_deleted_video(tmp_path):
+    quarantine = Quarantine(str(tmp_path / '.quarantine.json'), max_strikes=1)
+    assert quarantine.strike(str(tmp_path / 'gone.mp4'), "worker died", 'decode')
+    quarantine.save()
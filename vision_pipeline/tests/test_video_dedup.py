@@ -0,0 +1,54 @@
+import numpy as np
+from pose_archive import make_data_packet, PoseResult
+from signal_processing import derive_views, normalize_keypoints, postprocess_params
+from video_dedup import same_timing, share_result, FRAME_TOLERANCE
+from conftest import random_walk, gappy_scores
+
+def timing(fps, frame_count):
+    return {"fps": fps, "frame_count": frame_count}
+
+def test_same_timing_tolerates_small_frame_rate_and_length_differences():
+    assert same_timing(timing(30.0, 300), timing(29.97, 300))
+    assert same_timing(timing(30.0, 300), timing(30.0, 300 + FRAME_TOLERANCE))
+    assert not same_timing(timing(30.0, 300), timing(30.0, 300 + FRAME_TOLERANCE + 1))
+    assert not same_timing(timing(30.0, 300), timing(15.0, 150))    # same span, other frame rate
+    assert not same_timing(timing(30.0, 3000), timing(29.97, 3000))  # a 1 s longer copy
+
+def canonical_packet(rng, frames=60, raw_only=False):
+    keypoints = random_walk(rng, frames)
+    scores = gappy_scores(rng, frames, [(3, 10, 4)])
+    smoothed, normalized, missing = (None, None, None) if raw_only else derive_views(keypoints, scores)
+    return PoseResult(make_data_packet('clip.mp4', keypoints, smoothed, normalized, scores,
+                                       video_info={'fps': 30.0, 'width': 320, 'height': 240}, missing=missing,
+                                       postprocess=postprocess_params()))
+
+def alignment(canonical_fps=30.0, fps=30.0, width=240, height=240):
+    return {"canonical": 'clip.mp4', "scale_x": width / 320, "scale_y": height / 240, "fps": fps, "width": width,
+            "height": height, "canonical_fps": canonical_fps}
+
+def test_share_result_rescales_to_the_duplicate_resolution(rng):
+    packet = canonical_packet(rng)
+    shared = share_result(packet, alignment(), 'clip (1).mp4')
+    scale = np.array([0.75, 1.0])
+    np.testing.assert_allclose(shared['raw_keypoints'], packet['raw_keypoints'] * scale)
+    np.testing.assert_allclose(shared['smoothed_keypoints'], packet['smoothed_keypoints'] * scale)
+    np.testing.assert_allclose(shared['normalized_keypoints'], normalize_keypoints(shared['smoothed_keypoints']))
+    np.testing.assert_array_equal(shared['missing'], packet['missing'])
+    assert shared['video_id'] == 'clip (1).mp4' and shared['resolution'] == [240, 240]
+    assert shared['frame_count'] == 60 and shared['fps'] == 30.0
+
+def test_share_result_aligns_frames_by_time(rng):
+    packet = canonical_packet(rng, frames=300)
+    packet['fps'] = 25.0
+    shared = share_result(packet, alignment(canonical_fps=25.0, fps=24.9, width=320), 'clip (1).mp4')
+    # The canonical's 12 s at 24.9 fps; each frame takes the canonical frame nearest in time
+    assert shared['frame_count'] == 299 and np.isclose(shared['fps'], 24.9)
+    index = np.round(np.arange(299) / 24.9 * 25.0).astype(int)
+    np.testing.assert_array_equal(shared['scores'], packet['scores'][index])
+    assert index[-1] == 299 and (np.diff(index) == 2).sum() == 1
+
+def test_share_result_keeps_raw_only_outputs_raw_only(rng):
+    packet = canonical_packet(rng, raw_only=True)
+    shared = share_result(packet, alignment(width=160, height=120), 'clip (1).mp4')
+    assert shared.raw_only
+    np.testing.assert_allclose(shared['raw_keypoints'], packet['raw_keypoints'] * 0.5)
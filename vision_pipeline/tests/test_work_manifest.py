@@ -0,0 +1,59 @@
+import os
+import time
+import pytest
+from work_manifest import WorkManifest, _Heartbeat, LeaseLost
+
+@pytest.fixture
+def manifest(tmp_path):
+    video = tmp_path / 'clip.mp4'
+    video.write_bytes(b'')
+    return WorkManifest.build(str(tmp_path / 'job'), [str(video)], str(tmp_path / 'out'))
+
+def age(path, seconds):
+    os.utime(path, (time.time() - seconds, time.time() - seconds))
+
+def test_claim_is_exclusive_until_the_lease_expires(manifest):
+    video_id = manifest.videos[0]["id"]
+    token = manifest.claim(video_id, lease_ttl=60)
+    assert token and manifest.owns(video_id, token)
+    assert WorkManifest(manifest.manifest_dir).claim(video_id, lease_ttl=60) is None
+
+    age(manifest._lease_path(video_id), 120)
+    other = WorkManifest(manifest.manifest_dir).claim(video_id, lease_ttl=60)
+    assert other and other != token
+    assert manifest.owns(video_id, other) and not manifest.owns(video_id, token)
+
+def test_breaking_a_stale_lease_keeps_a_fresh_one_linked_meanwhile(manifest, monkeypatch):
+    video_id = manifest.videos[0]["id"]
+    lease_path = manifest._lease_path(video_id)
+    manifest.claim(video_id, lease_ttl=60)
+    age(lease_path, 120)
+
+    # Between this breaker's age check and its rename, another breaker removes the
+    # stale lease and a worker links a fresh one
+    fresh = {}
+    read_lease = WorkManifest._read_lease
+
+    def racing_read(path):
+        lease = read_lease(path)
+        if not fresh:
+            os.remove(lease_path)
+            fresh["token"] = WorkManifest(manifest.manifest_dir).claim(video_id, lease_ttl=60)
+        return lease
+
+    monkeypatch.setattr(manifest, '_read_lease', racing_read)
+    assert manifest._break_if_stale(lease_path, lease_ttl=60) is False
+    assert manifest.owns(video_id, fresh["token"])
+    assert os.listdir(manifest.lease_dir) == [os.path.basename(lease_path)]
+
+def test_heartbeat_reports_a_lost_lease(manifest):
+    video_id = manifest.videos[0]["id"]
+    token = manifest.claim(video_id, lease_ttl=60)
+    heartbeat = _Heartbeat(manifest, video_id, token, interval=0.01)
+    with heartbeat:
+        heartbeat.check('decode')
+        os.remove(manifest._lease_path(video_id))
+        assert WorkManifest(manifest.manifest_dir).claim(video_id, lease_ttl=60)
+        assert heartbeat.lost.wait(5)
+        with pytest.raises(LeaseLost):
+            heartbeat.check('inference')